@@ -0,0 +1,224 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import ast
+import compileall
+import io
+import json
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import zipfile
+
+from constructs import Construct
+from aws_cdk import aws_lambda as lambda_ # lambda is system reserved name
+from cdk_common.function_settings import FUNCTION_SETTINGS_CONTEXT_KEY
+
+# Builds one minimal asset per Lambda function instead of uploading the whole source
+# directory for every function: only the handler module, the local modules it imports
+# (followed transitively) and the pinned third-party packages it needs are copied to
+# .lambda_build/<function id>, with bytecode precompiled when the synthesizing Python
+# matches the function runtime. A size and import time report is written next to them.
+#
+# Third-party imports other than the SDK shipped with the Lambda runtime must be pinned
+# ("name==version") in a requirements.txt in the source directory. Bundling can be turned
+# off with -c lambdaBundling=false, which falls back to the whole directory asset.
+
+BUNDLING_CONTEXT_KEY = "lambdaBundling"
+BUILD_DIR = ".lambda_build"
+REPORT_FILE = "bundle-report.json"
+
+# provided by the Lambda Python runtimes, never bundled
+RUNTIME_PROVIDED = {"boto3", "botocore"}
+
+# pip platform tags per Lambda architecture for wheels of pinned dependencies
+PLATFORMS = {
+    "arm64": "manylinux2014_aarch64",
+    "x86_64": "manylinux2014_x86_64"
+}
+
+# import names of distributions whose name differs from the module they install
+IMPORT_NAMES = {
+    "python-dateutil": "dateutil",
+    "pyyaml": "yaml"
+}
+
+_report = []
+
+def function_code(scope: Construct, function_id: str, source_dir: str, handler: str,
+                  runtime: lambda_.Runtime = lambda_.Runtime.PYTHON_3_9) -> lambda_.Code:
+    # code for lambda_.Function(scope, function_id, handler=handler, ...)
+    enabled = scope.node.try_get_context(BUNDLING_CONTEXT_KEY)
+    if str(enabled).lower() == "false":
+        return lambda_.Code.from_asset(source_dir)
+
+    build_dir = os.path.join(BUILD_DIR, function_id)
+    if os.path.exists(build_dir):
+        shutil.rmtree(build_dir)
+    os.makedirs(build_dir)
+
+    handler_module = handler.split(".")[0]
+    local_modules, third_party = module_closure(source_dir, handler_module)
+    for module in sorted(local_modules):
+        shutil.copy2(os.path.join(source_dir, module + ".py"), build_dir)
+
+    requirements = pinned_requirements(source_dir, third_party, function_id)
+    if requirements:
+        install_requirements(requirements, build_dir, architecture(scope, function_id), runtime)
+
+    precompiled = precompile(build_dir, runtime)
+    record(function_id, source_dir, build_dir, handler_module, sorted(local_modules), requirements, precompiled)
+    return lambda_.Code.from_asset(build_dir)
+
+def module_closure(source_dir, handler_module):
+    # local modules reachable from the handler and the top level names of everything else it imports
+    local = {name[:-3] for name in os.listdir(source_dir) if name.endswith(".py")}
+    if handler_module not in local:
+        raise ValueError(f"Handler module {handler_module} not found in {source_dir}")
+    seen, third_party, pending = set(), set(), [handler_module]
+    while pending:
+        module = pending.pop()
+        if module in seen:
+            continue
+        seen.add(module)
+        for name in imported_names(os.path.join(source_dir, module + ".py")):
+            if name in local:
+                pending.append(name)
+            elif name not in stdlib_modules() and name not in RUNTIME_PROVIDED:
+                third_party.add(name)
+    return seen, third_party
+
+def imported_names(path):
+    with open(path) as source:
+        tree = ast.parse(source.read(), path)
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split(".")[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.level == 0 and node.module:
+            names.add(node.module.split(".")[0])
+    return names
+
+def stdlib_modules():
+    if hasattr(sys, "stdlib_module_names"):
+        return sys.stdlib_module_names
+    # Python < 3.10: anything importable from outside site-packages counts as standard library
+    import sysconfig
+    stdlib = sysconfig.get_paths()["stdlib"]
+    names = set(sys.builtin_module_names)
+    for entry in os.listdir(stdlib) + os.listdir(os.path.join(stdlib, "lib-dynload")):
+        names.add(entry.split(".")[0])
+    names.discard("site-packages")
+    return names
+
+def pinned_requirements(source_dir, third_party, function_id):
+    # the pinned requirements.txt lines this function needs; unpinned or missing ones fail the synth
+    if not third_party:
+        return []
+    pins = {}
+    path = os.path.join(source_dir, "requirements.txt")
+    if os.path.exists(path):
+        with open(path) as requirements:
+            for line in requirements:
+                line = line.split("#")[0].strip()
+                if not line:
+                    continue
+                if "==" not in line:
+                    raise ValueError(f"{path}: {line} is not pinned (name==version)")
+                name = line.split("==")[0].strip().lower()
+                pins[IMPORT_NAMES.get(name, name.replace("-", "_"))] = line
+    missing = sorted(third_party - set(pins))
+    if missing:
+        raise ValueError(f"{function_id} imports {', '.join(missing)} which must be pinned in {path}")
+    return [pins[name] for name in sorted(third_party)]
+
+def architecture(scope, function_id):
+    context = scope.node.try_get_context(FUNCTION_SETTINGS_CONTEXT_KEY) or {}
+    if isinstance(context, str):
+        context = json.loads(context)
+    return dict(context.get("default", {}), **context.get(function_id, {})).get("architecture", "x86_64")
+
+def install_requirements(requirements, build_dir, arch, runtime):
+    version = runtime_version(runtime)
+    subprocess.run([
+        sys.executable, "-m", "pip", "install", "--quiet", "--no-compile",
+        "--target", build_dir,
+        "--platform", PLATFORMS[arch],
+        "--implementation", "cp",
+        "--python-version", f"{version[0]}.{version[1]}",
+        "--only-binary=:all:",
+        *requirements
+    ], check=True)
+    # metadata and caches are not needed at run time
+    for entry in os.listdir(build_dir):
+        if entry.endswith((".dist-info", ".egg-info")):
+            shutil.rmtree(os.path.join(build_dir, entry))
+
+def runtime_version(runtime):
+    # "python3.9" -> (3, 9)
+    major, minor = runtime.name.replace("python", "").split(".")[:2]
+    return int(major), int(minor)
+
+def precompile(build_dir, runtime):
+    # bytecode is interpreter specific, so it is only written when synthesizing with the runtime's
+    # Python; unchecked hash based .pyc files stay valid although the asset zip resets timestamps
+    if sys.version_info[:2] != runtime_version(runtime):
+        return False
+    return bool(compileall.compile_dir(
+        build_dir, quiet=1, optimize=0,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH
+    ))
+
+def zipped_size(directory):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                archive.write(path, os.path.relpath(path, directory))
+    return buffer.tell()
+
+def import_seconds(build_dir, handler_module):
+    # time to run the handler's import statements in a fresh interpreter (the module body itself
+    # needs the function's environment); None when a dependency is not installed locally
+    path = os.path.join(build_dir, handler_module + ".py")
+    with open(path) as source:
+        tree = ast.parse(source.read(), path)
+    imports = "\n".join(ast.unparse(node) for node in tree.body if isinstance(node, (ast.Import, ast.ImportFrom)))
+    script = f"import time\nstarted = time.perf_counter()\n{imports}\nprint(time.perf_counter() - started)"
+    result = subprocess.run([sys.executable, "-c", script], cwd=build_dir, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return float(result.stdout.strip())
+
+def record(function_id, source_dir, build_dir, handler_module, modules, requirements, precompiled):
+    entry = {
+        "functionId": function_id,
+        "modules": modules,
+        "requirements": requirements,
+        "precompiled": precompiled,
+        "zippedBytes": zipped_size(build_dir),
+        "sourceDirZippedBytes": zipped_size(source_dir),
+        "importSeconds": import_seconds(build_dir, handler_module)
+    }
+    _report.append(entry)
+    with open(os.path.join(BUILD_DIR, REPORT_FILE), "w") as report:
+        json.dump(_report, report, indent=2)
+    import_time = f"{entry['importSeconds'] * 1000:.0f} ms" if entry["importSeconds"] is not None else "n/a"
+    print(f"Bundled {function_id}: {len(modules)} modules, {entry['zippedBytes']} bytes zipped "
+          f"(whole directory {entry['sourceDirZippedBytes']}), imports {import_time}", file=sys.stderr)
@@ -0,0 +1,55 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import json
+
+import aws_cdk as core
+from constructs import Construct
+from aws_cdk import aws_lambda as lambda_ # lambda is system reserved name
+
+# Per-function Lambda settings read from the "lambdaFunctionSettings" CDK context, e.g. in cdk.json:
+#
+#   "lambdaFunctionSettings": {
+#     "default": {"architecture": "arm64", "memorySize": 128, "timeoutSeconds": 30},
+#     "stop-running-batch-jobs-lambda-function": {"memorySize": 256, "timeoutSeconds": 300}
+#   }
+#
+# or on the command line: cdk deploy -c lambdaFunctionSettings='{"default": {...}}'
+# Keys are the construct ids of the functions. Settings left out keep the Lambda defaults.
+
+FUNCTION_SETTINGS_CONTEXT_KEY = "lambdaFunctionSettings"
+
+ARCHITECTURES = {
+    "arm64": lambda_.Architecture.ARM_64,
+    "x86_64": lambda_.Architecture.X86_64
+}
+
+def function_settings(scope: Construct, function_id: str) -> dict:
+    # keyword arguments for lambda_.Function(scope, function_id, ...)
+    context = scope.node.try_get_context(FUNCTION_SETTINGS_CONTEXT_KEY) or {}
+    if isinstance(context, str):
+        context = json.loads(context)
+    settings = dict(context.get("default", {}), **context.get(function_id, {}))
+    
+    kwargs = {}
+    if "memorySize" in settings:
+        kwargs["memory_size"] = int(settings["memorySize"])
+    if "timeoutSeconds" in settings:
+        kwargs["timeout"] = core.Duration.seconds(int(settings["timeoutSeconds"]))
+    if "architecture" in settings:
+        kwargs["architecture"] = ARCHITECTURES[settings["architecture"]]
+    if "reservedConcurrentExecutions" in settings:
+        kwargs["reserved_concurrent_executions"] = int(settings["reservedConcurrentExecutions"])
+    return kwargs
@@ -22,6 +22,9 @@ from aws_cdk import aws_sns_subscriptions as subscriptions
 from aws_cdk import aws_s3 as s3
 from aws_cdk import aws_s3_notifications as s3_notify
 from aws_cdk import aws_kms as kms
+from aws_cdk import aws_dynamodb as dynamodb
+from cdk_common.function_settings import function_settings
+from cdk_common.bundling import function_code
 
 # input parameters = Batch compute env name/ARN, CUR S3 bucket name/ARN, 
 # desired threshold % before high frequency checker kicks in, email for SNS 
@@ -149,20 +152,68 @@ class AwsCdkBudgetCheckerStack(core.Stack):
           description='Desired Budget threshold to reach before invoking the serverless Cost Guardian.'
         )
         
+        spend_source_order = core.CfnParameter(self, 'spendSourceOrder',
+          type='String',
+          default='budgets,cur,costexplorer',
+          description='Comma separated month-to-date spend sources to try in order (budgets, cur, costexplorer). Put the cheapest or freshest first.'
+        )
+        
+        cost_explorer_mode = core.CfnParameter(self, 'costExplorerMode',
+          type='String',
+          default='MONTHLY',
+          allowed_values=['MONTHLY', 'DAILY'],
+          description='MONTHLY queries Cost Explorer for the whole month on every run. DAILY caches finalized days in DynamoDB and only queries the still-open recent days.'
+        )
+        
+        start_on_projection = core.CfnParameter(self, 'startOnProjection',
+          type='String',
+          default='true',
+          allowed_values=['true', 'false'],
+          description='Also start the Cost Guardian when spend, projected from the recent burn rate, would cross the Budget limit before the next CUR delivery.'
+        )
+        
+        expected_cur_interval_hours = core.CfnParameter(self, 'expectedCurIntervalHours',
+          type='Number',
+          default=8,
+          description='Expected hours between Cost and Usage Report deliveries, used as the spend projection horizon.'
+        )
+        
+        # DynamoDB Cost Explorer Closed-Day Cache Table (finalized daily totals per compute environment, 
+        # plus the month-to-date spend observations used for projection)
+        cost_explorer_cache_table = dynamodb.Table(self, "cost-explorer-cache-table",
+            partition_key=dynamodb.Attribute(name="environment", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="date", type=dynamodb.AttributeType.STRING)
+        )
+        
+        lambda_role.attach_inline_policy(iam.Policy(self, "dynamo-cost-explorer-cache-policy",
+            statements=[iam.PolicyStatement(
+                actions=[
+                  "dynamodb:Query",
+                  "dynamodb:PutItem"
+                ],
+                resources=[cost_explorer_cache_table.table_arn])]
+            ))
+        
         # Lambda Function
         lambda_function = lambda_.Function(
             self, LAMBDA_FUNCTION_NAME,
-            code=lambda_.Code.from_asset('./event_driven_budget_checker/lambda'),
+            code=function_code(self, LAMBDA_FUNCTION_NAME, './event_driven_budget_checker/lambda', 'month_to_date_batch_spend_checker.lambda_handler'),
             handler='month_to_date_batch_spend_checker.lambda_handler',
             role=lambda_role,
             runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, LAMBDA_FUNCTION_NAME),
             environment={
                 'ACCOUNT_ID': account_id.value_as_string, 
                 'BUDGET_NAME': budget_name.value_as_string, 
                 'BATCH_COMPUTE_ENV_NAME': batch_compute_env_name.value_as_string, 
                 'COST_GUARDIAN_STATE_MACHINE_ARN': cost_guardian_state_machine_arn.value_as_string, 
                 'DESIRED_BUDGET_THRESHOLD_PERCENT': desired_budget_threshold_percent.value_as_string, 
-                'SNS_ARN': sns_topic.topic_arn 
+                'SNS_ARN': sns_topic.topic_arn,
+                'SPEND_SOURCE_ORDER': spend_source_order.value_as_string,
+                'COST_EXPLORER_MODE': cost_explorer_mode.value_as_string,
+                'COST_EXPLORER_CACHE_TABLE_NAME': cost_explorer_cache_table.table_name,
+                'START_ON_PROJECTION': start_on_projection.value_as_string,
+                'EXPECTED_CUR_INTERVAL_HOURS': expected_cur_interval_hours.value_as_string
             }
         )
         lambda_function.node.add_dependency(sns_topic) 
@@ -176,6 +227,9 @@ class AwsCdkBudgetCheckerStack(core.Stack):
         
         s3_bucket = s3.Bucket.from_bucket_name(self, IMPORTED_S3_BUCKET, imported_s3_cur_bucket_name.value_as_string)
         
+        # Allow the CUR spend source to read report files and manifests
+        s3_bucket.grant_read(lambda_role)
+        
         # S3 Trigger
         s3_notification = s3_notify.LambdaDestination(lambda_function)
         s3_notification.bind(self, s3_bucket)
@@ -1,8 +1,9 @@
 import json
 import boto3
 import os
-from dateutil import relativedelta
 import datetime
+import spend_projection
+import spend_sources
 
 # Create a Cost Explorer client
 ce_client = boto3.client('ce')
@@ -10,58 +11,17 @@ ce_client = boto3.client('ce')
 # Create a Budgets client
 budgets_client = boto3.client('budgets')
 
+# Create an S3 client (CUR reader)
+s3_client = boto3.client('s3')
+
+# Closed-day cache for DAILY Cost Explorer mode, also holding the spend observations for projection
+dynamodb_resource = boto3.resource('dynamodb')
+spend_cache_table = dynamodb_resource.Table(os.environ['COST_EXPLORER_CACHE_TABLE_NAME'])
+
 def lambda_handler(event, context):
 
-    # NEW date range calculation 
-    
-    todayDate = datetime.date.today()
-    
-    # get beginning of month before incrementing 
-    # (not doing this would cause errors on last day of the month)
-    beginningMonthDate = todayDate.replace(day=1) 
-    
-    # account for end date in cost API being exclusive
-    # (aka the end date is not counted so we add one)
-    todayDate += datetime.timedelta(1) 
-            
-    formattedBeginningMonthDate = beginningMonthDate.strftime('%Y-%m-%d')
-    formattedTodayDate = todayDate.strftime('%Y-%m-%d')
-    
-    response = ce_client.get_cost_and_usage(
-            TimePeriod={"Start": formattedBeginningMonthDate, "End": formattedTodayDate},
-            Granularity="MONTHLY",
-            Metrics=["UnblendedCost"],
-            Filter={
-            	"And": [{
-            			'Dimensions': {
-            				'Key': 'SERVICE',
-            				'Values': [
-            					'Amazon Elastic Container Service',
-            				],
-            				'MatchOptions': [
-            					'EQUALS',
-            				]
-            			}
-            		},
-            		{
-            			'Tags': {
-            				'Key': 'aws:batch:compute-environment',
-            				'Values': [
-            					os.environ['BATCH_COMPUTE_ENV_NAME'],
-            				],
-            				'MatchOptions': [
-            					'EQUALS',
-            				]
-            			}
-            		}
-            	]
-            }
-    )
-    
-    amount = response["ResultsByTime"][0]["Total"]["UnblendedCost"]["Amount"]
-    output = "%.3f" % float(amount)
-    
-    ###
+    # NEW date range calculation (start of month, tomorrow as the exclusive end)
+    formattedBeginningMonthDate, formattedTodayDate = spend_sources.month_to_date_period(datetime.date.today())
     
     account = os.environ['ACCOUNT_ID']
     budget = os.environ['BUDGET_NAME']
@@ -73,7 +33,29 @@ def lambda_handler(event, context):
     
     budget_limit = response['Budget']['BudgetLimit']['Amount']
     
-    msg = "Cost Explorer says you spent $" + output + " (USD) out of Budget limit $" + budget_limit + " (USD)."
+    # try the configured spend sources in order, cheapest/freshest first
+    sources = build_spend_sources(event, response)
+    cache_window_seconds = int(os.environ.get('SPEND_CACHE_WINDOW_SECONDS', '3600'))
+    amount, source = spend_sources.month_to_date_spend(
+            sources, 
+            formattedBeginningMonthDate, 
+            formattedTodayDate, 
+            cache_window_seconds
+    )
+    output = "%.3f" % float(amount)
+    print(f"Month to date spend answered by {source.name}")
+    
+    # project spend to the next expected CUR delivery and to month end from the recent observations
+    compute_env_name = os.environ['BATCH_COMPUTE_ENV_NAME']
+    now = datetime.datetime.now()
+    spend_projection.record_observation(spend_cache_table, compute_env_name, now, float(output), cache_window_seconds)
+    observations = spend_projection.recent_observations(spend_cache_table, compute_env_name, now, 
+            int(os.environ.get('PROJECTION_OBSERVATIONS', '4')))
+    projection = spend_projection.project(observations, now, float(output), float(budget_limit), 
+            float(os.environ.get('EXPECTED_CUR_INTERVAL_HOURS', '8')))
+    
+    msg = source.label + " says you spent $" + output + " (USD) out of Budget limit $" + budget_limit + " (USD)."
+    msg += projection_message(projection)
     client = boto3.client('sns')
     arn = os.environ['SNS_ARN']
     subject = "AWS Current Batch Spend this Month."
@@ -90,9 +72,16 @@ def lambda_handler(event, context):
     
     percent_used = percent(output, budget_limit)
     
-    if percent_used >= int(os.environ['DESIRED_BUDGET_THRESHOLD_PERCENT']):
+    # a burn fast enough to cross the budget before the next CUR delivery starts the guardian now
+    projected_to_cross = os.environ.get('START_ON_PROJECTION', 'true') == 'true' \
+        and projection['projectedAtNextDelivery'] >= float(budget_limit)
+    
+    if percent_used >= int(os.environ['DESIRED_BUDGET_THRESHOLD_PERCENT']) or projected_to_cross:
         
-        print("Budget threshold reached. Invoking Cost Guardian now.")
+        if percent_used >= int(os.environ['DESIRED_BUDGET_THRESHOLD_PERCENT']):
+            print("Budget threshold reached. Invoking Cost Guardian now.")
+        else:
+            print("Budget projected to be crossed before the next CUR delivery. Invoking Cost Guardian now.")
         
         if os.environ['COST_GUARDIAN_STATE_MACHINE_ARN'] == '':
             return {"statusCode": 200, "body": "Please set Cost Guardian ARN as an input parameter."}
@@ -106,11 +95,45 @@ def lambda_handler(event, context):
             input=json.dumps({ 
                 'startTime': str(datetime.datetime.now()), 
                 'startCost': output,
-                'budgetLimit': budget_limit
+                'budgetLimit': budget_limit,
+                'spendSource': source.name,
+                'projectedCrossing': format_projection_time(projection['projectedCrossing'])
             })
         )
 
-    return {"statusCode": 200, "body": msg}
+    return {"statusCode": 200, "body": msg, "spendSource": source.name}
+
+def build_spend_sources(event, budget_response):
+    available = {
+        'budgets': lambda: spend_sources.BudgetsSpendSource(budget_response),
+        'cur': lambda: spend_sources.CurSpendSource(s3_client, event, os.environ['BATCH_COMPUTE_ENV_NAME']),
+        'costexplorer': lambda: cost_explorer_spend_source()
+    }
+    order = os.environ.get('SPEND_SOURCE_ORDER', 'budgets,cur,costexplorer')
+    return [available[name.strip()]() for name in order.split(',') if name.strip()]
+
+def cost_explorer_spend_source():
+    if os.environ.get('COST_EXPLORER_MODE', 'MONTHLY') == 'DAILY':
+        return spend_sources.DailyCostExplorerSpendSource(
+            ce_client, 
+            os.environ['BATCH_COMPUTE_ENV_NAME'], 
+            dynamodb_resource.Table(os.environ['COST_EXPLORER_CACHE_TABLE_NAME']), 
+            int(os.environ.get('COST_EXPLORER_OPEN_DAYS', '3'))
+        )
+    return spend_sources.CostExplorerSpendSource(ce_client, os.environ['BATCH_COMPUTE_ENV_NAME'])
+
+def projection_message(projection):
+    msg = " At the recent burn rate of $" + "%.3f" % projection['hourlyRate'] + " (USD) per hour, spend is projected to reach $" \
+        + "%.3f" % projection['projectedAtNextDelivery'] + " (USD) by the next expected CUR delivery and $" \
+        + "%.3f" % projection['projectedAtMonthEnd'] + " (USD) by month end."
+    if projection['projectedCrossing'] is not None:
+        msg += " The Budget limit is projected to be crossed at " + format_projection_time(projection['projectedCrossing']) + "."
+    return msg
+
+def format_projection_time(timestamp):
+    if timestamp is None:
+        return None
+    return timestamp.strftime('%Y-%m-%d %H:%M') + " UTC"
 
 def percent(part, whole):
     return 100 * float(part)/float(whole)
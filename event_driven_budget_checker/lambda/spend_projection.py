@@ -0,0 +1,78 @@
+import datetime
+from decimal import Decimal
+
+# Projects month-to-date spend forward from the series of spend observations made by
+# the checker on each CUR delivery, so the guardian can be started before a fast burn
+# crosses the budget between two deliveries. Observations are kept in the spend cache
+# table under the "<compute environment>#observations" partition, one item per run.
+
+OBSERVATION_SUFFIX = '#observations'
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+def record_observation(table, compute_env_name, observed_at, amount, min_interval_seconds):
+    # skip runs answered from the memoized spend of a previous run: they would flatten the series
+    latest = recent_observations(table, compute_env_name, observed_at, 1)
+    if latest and (observed_at - latest[-1][0]).total_seconds() < min_interval_seconds:
+        return
+    table.put_item(Item={
+        'environment': compute_env_name + OBSERVATION_SUFFIX,
+        'date': observed_at.strftime(TIMESTAMP_FORMAT),
+        'amount': Decimal(str(amount))
+    })
+
+def recent_observations(table, compute_env_name, now, limit):
+    # latest observations of the current month, oldest first, as (datetime, amount)
+    response = table.query(
+        KeyConditionExpression='#environment = :environment AND #date >= :month_start',
+        ExpressionAttributeNames={'#environment': 'environment', '#date': 'date'},
+        ExpressionAttributeValues={
+            ':environment': compute_env_name + OBSERVATION_SUFFIX,
+            ':month_start': month_start(now).strftime(TIMESTAMP_FORMAT)
+        },
+        ScanIndexForward=False,
+        Limit=limit
+    )
+    return [(datetime.datetime.strptime(item['date'], TIMESTAMP_FORMAT), float(item['amount'])) for item in reversed(response['Items'])]
+
+def month_start(now):
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def month_end(now):
+    return (month_start(now) + datetime.timedelta(days=32)).replace(day=1)
+
+def hourly_rate(observations, now, amount):
+    # least squares slope of the recent observations (dollars per hour); with fewer than two
+    # observations or a non-positive slope, fall back to the month-to-date average rate
+    points = [(hours_between(month_start(now), observed_at), observed) for observed_at, observed in observations]
+    if len(points) >= 2:
+        mean_x = sum(x for x, _ in points) / len(points)
+        mean_y = sum(y for _, y in points) / len(points)
+        spread = sum((x - mean_x) ** 2 for x, _ in points)
+        if spread > 0:
+            slope = sum((x - mean_x) * (y - mean_y) for x, y in points) / spread
+            if slope > 0:
+                return slope
+    elapsed = hours_between(month_start(now), now)
+    return amount / elapsed if elapsed > 0 else 0.0
+
+def project(observations, now, amount, budget_limit, next_delivery_hours):
+    rate = hourly_rate(observations, now, amount)
+    end = month_end(now)
+    next_delivery = min(now + datetime.timedelta(hours=next_delivery_hours), end)
+    crossing = None
+    if amount >= budget_limit:
+        crossing = now
+    elif rate > 0:
+        crossing = now + datetime.timedelta(hours=(budget_limit - amount) / rate)
+        if crossing >= end:
+            crossing = None
+    return {
+        'hourlyRate': rate,
+        'nextDelivery': next_delivery,
+        'projectedAtNextDelivery': amount + rate * hours_between(now, next_delivery),
+        'projectedAtMonthEnd': amount + rate * hours_between(now, end),
+        'projectedCrossing': crossing
+    }
+
+def hours_between(start, end):
+    return (end - start).total_seconds() / 3600
@@ -0,0 +1,228 @@
+import csv
+import datetime
+import gzip
+import json
+import time
+import urllib.parse
+
+# Interchangeable backends answering "how much did the tagged Batch compute
+# environment spend this month". The checker tries them in a configurable order
+# (cheapest/freshest first) and uses the first one that answers.
+
+# memoized answers per (source, billing period, evaluation window) in a warm container
+_cache = {}
+
+class SpendSourceUnavailable(Exception):
+    pass
+
+class BudgetsSpendSource:
+    # CalculatedSpend comes with the describe_budget response the checker already fetched: no extra call
+    name = 'budgets'
+    label = 'AWS Budgets'
+
+    def __init__(self, budget_response):
+        self.budget_response = budget_response
+
+    def month_to_date(self, start, end):
+        calculated_spend = self.budget_response['Budget'].get('CalculatedSpend', {})
+        if 'ActualSpend' not in calculated_spend:
+            raise SpendSourceUnavailable('Budget has no calculated actual spend yet')
+        return float(calculated_spend['ActualSpend']['Amount'])
+
+class CostExplorerSpendSource:
+    # billed per request
+    name = 'costexplorer'
+    label = 'Cost Explorer'
+
+    def __init__(self, ce_client, compute_env_name):
+        self.ce_client = ce_client
+        self.compute_env_name = compute_env_name
+
+    def month_to_date(self, start, end):
+        response = self.ce_client.get_cost_and_usage(
+                TimePeriod={"Start": start, "End": end},
+                Granularity="MONTHLY",
+                Metrics=["UnblendedCost"],
+                Filter=cost_filter(self.compute_env_name)
+        )
+        return sum(float(result["Total"]["UnblendedCost"]["Amount"]) for result in response["ResultsByTime"])
+
+class DailyCostExplorerSpendSource(CostExplorerSpendSource):
+    # DAILY granularity: finalized past days are kept in a DynamoDB cache so each run only
+    # asks Cost Explorer for the days that can still change (the last open_days days)
+
+    def __init__(self, ce_client, compute_env_name, cache_table, open_days):
+        super().__init__(ce_client, compute_env_name)
+        self.cache_table = cache_table
+        self.open_days = open_days
+
+    def month_to_date(self, start, end):
+        closed_end = closed_days_end(start, end, self.open_days)
+        cached = self.cached_days(start, closed_end)
+
+        # everything from the first closed day missing in the cache onwards is fetched again
+        fetch_start = first_missing_day(start, closed_end, cached)
+        total = sum(amount for day, amount in cached.items() if day < fetch_start)
+        if fetch_start >= end:
+            return total
+
+        kwargs = {
+            'TimePeriod': {"Start": fetch_start, "End": end},
+            'Granularity': "DAILY",
+            'Metrics': ["UnblendedCost"],
+            'Filter': cost_filter(self.compute_env_name)
+        }
+        while True:
+            response = self.ce_client.get_cost_and_usage(**kwargs)
+            for result in response["ResultsByTime"]:
+                day = result["TimePeriod"]["Start"]
+                amount = result["Total"]["UnblendedCost"]["Amount"]
+                total += float(amount)
+                # Cost Explorer flags every day of the open billing month as Estimated, the
+                # COST_EXPLORER_OPEN_DAYS cutoff alone decides which days are final
+                if day < closed_end:
+                    self.cache_table.put_item(Item={
+                        'environment': self.compute_env_name,
+                        'date': day,
+                        'amount': amount
+                    })
+            if 'NextPageToken' not in response:
+                return total
+            kwargs['NextPageToken'] = response['NextPageToken']
+
+    def cached_days(self, start, closed_end):
+        if closed_end <= start:
+            return {}
+        last_closed_day = (datetime.date.fromisoformat(closed_end) - datetime.timedelta(days=1)).isoformat()
+        kwargs = {
+            'KeyConditionExpression': '#environment = :environment AND #date BETWEEN :start AND :last',
+            'ExpressionAttributeNames': {'#environment': 'environment', '#date': 'date'},
+            'ExpressionAttributeValues': {
+                ':environment': self.compute_env_name,
+                ':start': start,
+                ':last': last_closed_day
+            }
+        }
+        cached = {}
+        while True:
+            response = self.cache_table.query(**kwargs)
+            for item in response['Items']:
+                cached[item['date']] = float(item['amount'])
+            if 'LastEvaluatedKey' not in response:
+                return cached
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+class CurSpendSource:
+    # reads the CUR delivery that triggered the checker (CSV/GZIP reports only)
+    name = 'cur'
+    label = 'Cost and Usage Report'
+
+    def __init__(self, s3_client, event, compute_env_name):
+        self.s3_client = s3_client
+        self.records = [record for record in event.get('Records', []) if 's3' in record]
+        self.compute_env_name = compute_env_name
+
+    def month_to_date(self, start, end):
+        if not self.records:
+            raise SpendSourceUnavailable('Not invoked by a CUR delivery')
+        bucket = self.records[0]['s3']['bucket']['name']
+        key = urllib.parse.unquote_plus(self.records[0]['s3']['object']['key'])
+        if not key.endswith('.csv.gz'):
+            raise SpendSourceUnavailable(f"Unsupported CUR format: {key}")
+
+        total = 0.0
+        for report_key in self.report_keys(bucket, key):
+            body = self.s3_client.get_object(Bucket=bucket, Key=report_key)['Body']
+            with gzip.open(body, mode='rt', newline='') as report:
+                for row in csv.DictReader(report):
+                    if row.get('lineItem/ProductCode') != 'AmazonECS':
+                        continue
+                    if row.get('resourceTags/aws:batch:compute-environment') != self.compute_env_name:
+                        continue
+                    if not start <= row.get('lineItem/UsageStartDate', '')[:10] < end:
+                        continue
+                    total += float(row['lineItem/UnblendedCost'] or 0)
+        return total
+
+    def report_keys(self, bucket, key):
+        # a delivery can be split in several files, all listed in its manifest. In the standard layout
+        # <prefix>/<report>/<yyyymmdd-yyyymmdd>/<assemblyId>/<report>-<n>.csv.gz the manifest is in the
+        # billing period directory, one level above the files; some copies keep it next to them
+        directories = key.split('/')[:-1]
+        for depth in (len(directories) - 1, len(directories)):
+            if depth < 0:
+                continue
+            prefix = ''.join(directory + '/' for directory in directories[:depth])
+            response = self.s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix, Delimiter='/')
+            for obj in response.get('Contents', []):
+                if obj['Key'].endswith('-Manifest.json'):
+                    manifest = json.loads(self.s3_client.get_object(Bucket=bucket, Key=obj['Key'])['Body'].read())
+                    return manifest.get('reportKeys', [key])
+        return [key]
+
+def cost_filter(compute_env_name):
+    return {
+        "And": [{
+                'Dimensions': {
+                    'Key': 'SERVICE',
+                    'Values': [
+                        'Amazon Elastic Container Service',
+                    ],
+                    'MatchOptions': [
+                        'EQUALS',
+                    ]
+                }
+            },
+            {
+                'Tags': {
+                    'Key': 'aws:batch:compute-environment',
+                    'Values': [
+                        compute_env_name,
+                    ],
+                    'MatchOptions': [
+                        'EQUALS',
+                    ]
+                }
+            }
+        ]
+    }
+
+def month_to_date_period(today):
+    # get beginning of month before incrementing 
+    # (not doing this would cause errors on last day of the month)
+    beginning_month_date = today.replace(day=1)
+
+    # account for end date in cost API being exclusive
+    # (aka the end date is not counted so we add one)
+    end_date = today + datetime.timedelta(1)
+    return beginning_month_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d')
+
+def closed_days_end(start, end, open_days):
+    # days before the returned date (YYYY-MM-DD) are final; the last open_days days before
+    # the exclusive end date are still open. Clamped to the [start, end] range.
+    start_date = datetime.date.fromisoformat(start)
+    end_date = datetime.date.fromisoformat(end)
+    return min(max(end_date - datetime.timedelta(days=open_days), start_date), end_date).isoformat()
+
+def first_missing_day(start, closed_end, cached):
+    day = datetime.date.fromisoformat(start)
+    while day.isoformat() < closed_end and day.isoformat() in cached:
+        day += datetime.timedelta(days=1)
+    return day.isoformat()
+
+def month_to_date_spend(sources, start, end, window_seconds):
+    # returns (amount, source) from the first source that answers
+    window = int(time.time() // window_seconds) if window_seconds > 0 else None
+    for source in sources:
+        cache_key = (source.name, start, window)
+        if window is not None and cache_key in _cache:
+            return _cache[cache_key], source
+        try:
+            amount = source.month_to_date(start, end)
+        except Exception as e:
+            print(f"Spend source {source.name} unavailable: {e}")
+            continue
+        if window is not None:
+            _cache[cache_key] = amount
+        return amount, source
+    raise SpendSourceUnavailable('No spend source answered')
@@ -0,0 +1,66 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Command line entry point: python -m guardian_simulator [--trace trace.json] ..."""
+
+import argparse
+import json
+import sys
+
+from guardian_simulator.simulator import sweep, synthetic_trace
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m guardian_simulator',
+        description='Replay a Batch workload trace through the cost guardian on a virtual clock.')
+    parser.add_argument('--trace', help='JSON trace file (defaults to a synthetic trace)')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the synthetic trace')
+    parser.add_argument('--wait-time', type=float, nargs='+', default=[300], help='waitTime values (seconds) to sweep')
+    parser.add_argument('--threshold', type=int, nargs='+', default=[80], help='desiredBudgetThresholdPercent values to sweep')
+    parser.add_argument('--cur-interval', type=float, nargs='+', default=[8], help='hours between CUR deliveries')
+    parser.add_argument('--horizon', type=float, default=72, help='simulated hours before a run is cut off')
+    parser.add_argument('--workers', type=int, default=None, help='parallel simulations (defaults to the number of cores)')
+    parser.add_argument('--json', action='store_true', help='print the full reports as JSON')
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        with open(args.trace) as trace_file:
+            trace = json.load(trace_file)
+    else:
+        trace = synthetic_trace(seed=args.seed)
+
+    reports = sweep(trace, {
+        'waitTime': args.wait_time,
+        'desiredBudgetThresholdPercent': args.threshold,
+        'curIntervalHours': args.cur_interval,
+        'horizonHours': [args.horizon]
+    }, workers=args.workers)
+
+    if args.json:
+        json.dump(reports, sys.stdout, indent=2, default=str)
+        print()
+        return
+
+    print(f"{'waitTime':>9} {'threshold':>9} {'curHours':>8} {'overshoot$':>11} {'detectLat(s)':>12} {'guardian$':>10} {'transitions':>11} {'errors':>6}")
+    for report in reports:
+        parameters = report['parameters']
+        latency = report['detectionLatencySeconds']
+        print(f"{parameters['waitTime']:>9g} {parameters['desiredBudgetThresholdPercent']:>9g} {parameters['curIntervalHours']:>8g} "
+            f"{report['overshootUsd']:>11.2f} {'-' if latency is None else '%.0f' % latency:>12} "
+            f"{report['guardianCostUsd']:>10.4f} {report['stateTransitions']:>11} {len(report['errors']):>6}")
+
+
+if __name__ == '__main__':
+    main()
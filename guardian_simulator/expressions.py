@@ -0,0 +1,399 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Evaluator for the subset of DynamoDB expression syntax used by the guardian Lambdas.
+
+Supports update expressions (SET / REMOVE / ADD / DELETE with ``+``/``-``,
+``if_not_exists`` and ``list_append``) and condition, filter and key condition
+expressions (comparators, BETWEEN, IN, AND / OR / NOT, ``attribute_exists``,
+``attribute_not_exists``, ``begins_with``, ``contains`` and ``size``).
+"""
+
+import copy
+import re
+from decimal import Decimal
+
+KEYWORDS = {'SET', 'REMOVE', 'ADD', 'DELETE', 'AND', 'OR', 'NOT', 'BETWEEN', 'IN'}
+COMPARATORS = {'=', '<>', '<', '<=', '>', '>='}
+CONDITION_FUNCTIONS = {'attribute_exists', 'attribute_not_exists', 'attribute_type', 'begins_with', 'contains'}
+
+TOKEN_PATTERN = re.compile(r'\s*(?:(<>|<=|>=|[=<>+\-(),.\[\]])|(#[A-Za-z0-9_]+)|(:[A-Za-z0-9_]+)|([A-Za-z_][A-Za-z0-9_]*)|(\d+))')
+
+
+class ExpressionError(Exception):
+    """Raised for malformed expressions or invalid operands (ValidationException)."""
+
+
+def tokenize(expression):
+    tokens = []
+    pos = 0
+    expression = expression.strip()
+    while pos < len(expression):
+        match = TOKEN_PATTERN.match(expression, pos)
+        if not match:
+            raise ExpressionError(f"Invalid token in expression at {pos}: {expression!r}")
+        pos = match.end()
+        symbol, name, value, word, number = match.groups()
+        if symbol:
+            tokens.append(('sym', symbol))
+        elif name:
+            tokens.append(('name', name))
+        elif value:
+            tokens.append(('value', value))
+        elif word:
+            if word.upper() in KEYWORDS:
+                tokens.append(('kw', word.upper()))
+            else:
+                tokens.append(('word', word))
+        else:
+            tokens.append(('num', int(number)))
+    return tokens
+
+
+class Parser:
+
+    def __init__(self, expression, names, values):
+        self.tokens = tokenize(expression)
+        self.pos = 0
+        self.names = names or {}
+        self.values = values or {}
+
+    def peek(self, offset=0):
+        index = self.pos + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def take(self, kind=None, text=None):
+        token = self.peek()
+        if kind and token[0] != kind or text and token[1] != text:
+            raise ExpressionError(f"Expected {text or kind}, got {token[1]!r}")
+        self.pos += 1
+        return token
+
+    def at(self, kind, text=None):
+        token = self.peek()
+        return token[0] == kind and (text is None or token[1] == text)
+
+    def done(self):
+        return self.pos >= len(self.tokens)
+
+    # operands
+
+    def path(self):
+        segments = [self.path_name()]
+        while self.at('sym', '.') or self.at('sym', '['):
+            if self.take()[1] == '.':
+                segments.append(self.path_name())
+            else:
+                segments.append(self.take('num')[1])
+                self.take('sym', ']')
+        return ('path', segments)
+
+    def path_name(self):
+        kind, text = self.take()
+        if kind == 'name':
+            if text not in self.names:
+                raise ExpressionError(f"Undefined expression attribute name {text}")
+            return self.names[text]
+        if kind == 'word':
+            return text
+        raise ExpressionError(f"Expected attribute name, got {text!r}")
+
+    def operand(self):
+        kind, text = self.peek()
+        if kind == 'value':
+            self.take()
+            if text not in self.values:
+                raise ExpressionError(f"Undefined expression attribute value {text}")
+            return ('value', self.values[text])
+        if kind == 'word' and self.peek(1) == ('sym', '('):
+            self.take()
+            self.take('sym', '(')
+            args = [self.operand()]
+            while self.at('sym', ','):
+                self.take()
+                args.append(self.operand())
+            self.take('sym', ')')
+            return ('call', text, args)
+        return self.path()
+
+    def arithmetic(self):
+        left = self.operand()
+        if self.at('sym', '+') or self.at('sym', '-'):
+            operator = self.take()[1]
+            return ('arith', operator, left, self.operand())
+        return left
+
+    # update expressions
+
+    def update(self):
+        actions = []
+        while not self.done():
+            clause = self.take('kw')[1]
+            while True:
+                if clause == 'SET':
+                    target = self.path()
+                    self.take('sym', '=')
+                    actions.append(('SET', target, self.arithmetic()))
+                elif clause == 'REMOVE':
+                    actions.append(('REMOVE', self.path(), None))
+                elif clause in ('ADD', 'DELETE'):
+                    actions.append((clause, self.path(), self.operand()))
+                else:
+                    raise ExpressionError(f"Unexpected clause {clause}")
+                if not self.at('sym', ','):
+                    break
+                self.take()
+        return actions
+
+    # condition expressions
+
+    def condition(self):
+        node = self.conjunction()
+        while self.at('kw', 'OR'):
+            self.take()
+            node = ('or', node, self.conjunction())
+        return node
+
+    def conjunction(self):
+        node = self.negation()
+        while self.at('kw', 'AND'):
+            self.take()
+            node = ('and', node, self.negation())
+        return node
+
+    def negation(self):
+        if self.at('kw', 'NOT'):
+            self.take()
+            return ('not', self.negation())
+        return self.predicate()
+
+    def predicate(self):
+        if self.at('sym', '('):
+            self.take()
+            node = self.condition()
+            self.take('sym', ')')
+            return node
+        kind, text = self.peek()
+        if kind == 'word' and text in CONDITION_FUNCTIONS:
+            return ('test', self.operand())
+        left = self.operand()
+        if self.at('kw', 'BETWEEN'):
+            self.take()
+            low = self.operand()
+            self.take('kw', 'AND')
+            return ('between', left, low, self.operand())
+        if self.at('kw', 'IN'):
+            self.take()
+            self.take('sym', '(')
+            options = [self.operand()]
+            while self.at('sym', ','):
+                self.take()
+                options.append(self.operand())
+            self.take('sym', ')')
+            return ('in', left, options)
+        operator = self.take('sym')[1]
+        if operator not in COMPARATORS:
+            raise ExpressionError(f"Unexpected comparator {operator}")
+        return ('compare', operator, left, self.operand())
+
+
+MISSING = object()
+
+
+def resolve(item, segments):
+    current = item
+    for segment in segments:
+        if isinstance(segment, int):
+            if not isinstance(current, list) or segment >= len(current):
+                return MISSING
+            current = current[segment]
+        else:
+            if not isinstance(current, dict) or segment not in current:
+                return MISSING
+            current = current[segment]
+    return current
+
+
+def evaluate(node, item):
+    kind = node[0]
+    if kind == 'value':
+        return node[1]
+    if kind == 'path':
+        return resolve(item, node[1])
+    if kind == 'arith':
+        left = evaluate(node[2], item)
+        right = evaluate(node[3], item)
+        if left is MISSING or right is MISSING:
+            raise ExpressionError("The provided expression refers to an attribute that does not exist in the item")
+        if not isinstance(left, Decimal) or not isinstance(right, Decimal):
+            raise ExpressionError("An operand in the update expression has an incorrect data type")
+        return left + right if node[1] == '+' else left - right
+    if kind == 'call':
+        name, args = node[1], node[2]
+        if name == 'if_not_exists':
+            existing = evaluate(args[0], item)
+            return evaluate(args[1], item) if existing is MISSING else existing
+        if name == 'list_append':
+            left, right = evaluate(args[0], item), evaluate(args[1], item)
+            if not isinstance(left, list) or not isinstance(right, list):
+                raise ExpressionError("list_append requires two lists")
+            return left + right
+        if name == 'size':
+            value = evaluate(args[0], item)
+            return MISSING if value is MISSING else Decimal(len(value))
+        if name == 'attribute_exists':
+            return evaluate(args[0], item) is not MISSING
+        if name == 'attribute_not_exists':
+            return evaluate(args[0], item) is MISSING
+        if name == 'begins_with':
+            value, prefix = evaluate(args[0], item), evaluate(args[1], item)
+            return isinstance(value, (str, bytes)) and type(value) == type(prefix) and value.startswith(prefix)
+        if name == 'contains':
+            value, member = evaluate(args[0], item), evaluate(args[1], item)
+            return value is not MISSING and isinstance(value, (str, list, set, frozenset)) and member in value
+        if name == 'attribute_type':
+            value, type_name = evaluate(args[0], item), evaluate(args[1], item)
+            return value is not MISSING and type_of(value) == type_name
+        raise ExpressionError(f"Unsupported function {name}")
+    raise ExpressionError(f"Cannot evaluate {kind} as an operand")
+
+
+def type_of(value):
+    if isinstance(value, bool):
+        return 'BOOL'
+    if isinstance(value, str):
+        return 'S'
+    if isinstance(value, Decimal):
+        return 'N'
+    if isinstance(value, bytes):
+        return 'B'
+    if value is None:
+        return 'NULL'
+    if isinstance(value, dict):
+        return 'M'
+    if isinstance(value, list):
+        return 'L'
+    if isinstance(value, (set, frozenset)):
+        element = next(iter(value))
+        return {'S': 'SS', 'N': 'NS', 'B': 'BS'}[type_of(element)]
+    raise ExpressionError(f"Unsupported attribute value {value!r}")
+
+
+def compare(operator, left, right):
+    if left is MISSING or right is MISSING:
+        return False
+    if operator == '=':
+        return left == right
+    if operator == '<>':
+        return left != right
+    if type_of(left) != type_of(right) or type_of(left) not in ('S', 'N', 'B'):
+        return False
+    return {
+        '<': left < right,
+        '<=': left <= right,
+        '>': left > right,
+        '>=': left >= right
+    }[operator]
+
+
+def test(node, item):
+    kind = node[0]
+    if kind == 'or':
+        return test(node[1], item) or test(node[2], item)
+    if kind == 'and':
+        return test(node[1], item) and test(node[2], item)
+    if kind == 'not':
+        return not test(node[1], item)
+    if kind == 'test':
+        return evaluate(node[1], item)
+    if kind == 'compare':
+        return compare(node[1], evaluate(node[2], item), evaluate(node[3], item))
+    if kind == 'between':
+        value = evaluate(node[1], item)
+        return compare('>=', value, evaluate(node[2], item)) and compare('<=', value, evaluate(node[3], item))
+    if kind == 'in':
+        value = evaluate(node[1], item)
+        return any(compare('=', value, evaluate(option, item)) for option in node[2])
+    raise ExpressionError(f"Cannot evaluate {kind} as a condition")
+
+
+def condition_matches(expression, item, names=None, values=None):
+    if not expression:
+        return True
+    parser = Parser(expression, names, values)
+    node = parser.condition()
+    if not parser.done():
+        raise ExpressionError(f"Unexpected trailing tokens in {expression!r}")
+    return test(node, item or {})
+
+
+def assign(item, segments, value):
+    parent = resolve(item, segments[:-1]) if len(segments) > 1 else item
+    if parent is MISSING:
+        raise ExpressionError("The document path provided in the update expression is invalid for update")
+    last = segments[-1]
+    if isinstance(last, int):
+        if last >= len(parent):
+            parent.append(value)
+        else:
+            parent[last] = value
+    else:
+        parent[last] = value
+
+
+def remove(item, segments):
+    parent = resolve(item, segments[:-1]) if len(segments) > 1 else item
+    if parent is MISSING:
+        return
+    last = segments[-1]
+    if isinstance(last, int):
+        if last < len(parent):
+            del parent[last]
+    else:
+        parent.pop(last, None)
+
+
+def apply_update(expression, item, names=None, values=None):
+    """Apply an update expression to a copy of ``item`` and return (new_item, updated_names)."""
+    parser = Parser(expression, names, values)
+    actions = parser.update()
+    original = item
+    item = copy.deepcopy(item)
+    updated = []
+    for action, target, operand in actions:
+        segments = target[1]
+        updated.append(segments[0])
+        if action == 'SET':
+            assign(item, segments, copy.deepcopy(evaluate(operand, original)))
+        elif action == 'REMOVE':
+            remove(item, segments)
+        elif action == 'ADD':
+            increment = evaluate(operand, original)
+            existing = resolve(item, segments)
+            if isinstance(increment, Decimal):
+                assign(item, segments, increment if existing is MISSING else existing + increment)
+            elif isinstance(increment, (set, frozenset)):
+                assign(item, segments, set(increment) if existing is MISSING else set(existing) | set(increment))
+            else:
+                raise ExpressionError("ADD supports only numbers and sets")
+        elif action == 'DELETE':
+            existing = resolve(item, segments)
+            if existing is not MISSING:
+                remaining = set(existing) - set(evaluate(operand, original))
+                if remaining:
+                    assign(item, segments, remaining)
+                else:
+                    remove(item, segments)
+    return item, updated
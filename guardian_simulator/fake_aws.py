@@ -0,0 +1,703 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""In-memory stand-ins for the AWS services the guardian Lambdas call.
+
+The fakes keep their state in plain Python structures, follow the request and
+response shapes of the boto3 operations the handlers use (including page sizes
+and the DynamoDB resource layer's Decimal numbers) and meter every call so the
+simulator can price the guardian's own API usage.
+"""
+
+import copy
+import io
+import itertools
+import json
+import math
+import types
+from collections import Counter
+from decimal import Decimal
+
+from guardian_simulator import expressions
+
+ACCOUNT_ID = '123456789012'
+REGION = 'us-east-1'
+
+
+class ClientError(Exception):
+
+    def __init__(self, code, message, operation):
+        super().__init__(f"An error occurred ({code}) when calling the {operation} operation: {message}")
+        self.response = {'Error': {'Code': code, 'Message': message}}
+        self.operation_name = operation
+
+
+def exception_namespace(*codes):
+    namespace = types.SimpleNamespace(ClientError=ClientError)
+    for code in codes:
+        setattr(namespace, code, type(code, (ClientError,), {}))
+    return namespace
+
+
+def raise_error(exceptions, code, message, operation):
+    raise getattr(exceptions, code)(code, message, operation)
+
+
+class Meter:
+    """Counts API calls per service operation and DynamoDB capacity units."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.read_units = 0.0
+        self.write_units = 0.0
+
+    def call(self, service, operation):
+        self.calls[(service, operation)] += 1
+
+    def read(self, size_bytes, consistent=False):
+        units = max(1, math.ceil(size_bytes / 4096))
+        self.read_units += units if consistent else units / 2
+
+    def write(self, size_bytes):
+        self.write_units += max(1, math.ceil(size_bytes / 1024))
+
+    def total_calls(self):
+        return sum(self.calls.values())
+
+
+# DynamoDB
+
+def to_dynamo(value):
+    """Validate and copy a Python value the way the boto3 resource layer serializes it."""
+    if isinstance(value, bool) or value is None or isinstance(value, (str, Decimal)):
+        return value
+    if isinstance(value, float):
+        raise TypeError("Float types are not supported. Use Decimal types instead.")
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if isinstance(value, dict):
+        return {key: to_dynamo(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_dynamo(val) for val in value]
+    if isinstance(value, (set, frozenset)):
+        return {to_dynamo(val) for val in value}
+    if type(value).__name__ == 'Binary':
+        return bytes(value.value)
+    raise TypeError(f"Unsupported type {type(value)} for value {value!r}")
+
+
+def typed(value):
+    """Serialize a Python value to the typed JSON used in DynamoDB stream records."""
+    if isinstance(value, bool):
+        return {'BOOL': value}
+    if value is None:
+        return {'NULL': True}
+    if isinstance(value, str):
+        return {'S': value}
+    if isinstance(value, Decimal):
+        return {'N': str(value)}
+    if isinstance(value, bytes):
+        return {'B': value}
+    if isinstance(value, dict):
+        return {'M': {key: typed(val) for key, val in value.items()}}
+    if isinstance(value, list):
+        return {'L': [typed(val) for val in value]}
+    if isinstance(value, (set, frozenset)):
+        kind = expressions.type_of(value)
+        return {kind: sorted(str(val) if kind == 'NS' else val for val in value)}
+    raise TypeError(f"Unsupported type {type(value)}")
+
+
+def item_size(item):
+    return len(json.dumps(item, default=str)) if item else 0
+
+
+class FakeTable:
+
+    def __init__(self, resource, name, partition_key, sort_key=None, indexes=None, stream=False):
+        self.resource = resource
+        self.name = name
+        self.table_name = name
+        self.partition_key = partition_key
+        self.sort_key = sort_key
+        self.indexes = indexes or {}
+        self.items = {}
+        self.stream_enabled = stream
+        self.stream_records = []
+        self.meta = types.SimpleNamespace(client=resource.meta.client)
+
+    @property
+    def exceptions(self):
+        return self.resource.meta.client.exceptions
+
+    def key_of(self, item):
+        if self.partition_key not in item or (self.sort_key and self.sort_key not in item):
+            raise_error(self.exceptions, 'ValidationException', 'The provided key element does not match the schema', 'GetItem')
+        return (item[self.partition_key], item[self.sort_key] if self.sort_key else None)
+
+    def key_attributes(self, item):
+        key = {self.partition_key: item[self.partition_key]}
+        if self.sort_key:
+            key[self.sort_key] = item[self.sort_key]
+        return key
+
+    def emit(self, old, new):
+        if not self.stream_enabled or old == new:
+            return
+        if old is None:
+            event_name = 'INSERT'
+        elif new is None:
+            event_name = 'REMOVE'
+        else:
+            event_name = 'MODIFY'
+        record = {
+            'eventName': event_name,
+            'eventSource': 'aws:dynamodb',
+            'dynamodb': {'Keys': {key: typed(val) for key, val in self.key_attributes(old or new).items()}}
+        }
+        if old is not None:
+            record['dynamodb']['OldImage'] = {key: typed(val) for key, val in old.items()}
+        if new is not None:
+            record['dynamodb']['NewImage'] = {key: typed(val) for key, val in new.items()}
+        self.stream_records.append(record)
+
+    def check(self, operation, existing, kwargs):
+        condition = kwargs.get('ConditionExpression')
+        try:
+            matched = expressions.condition_matches(condition, existing,
+                kwargs.get('ExpressionAttributeNames'), to_dynamo(kwargs.get('ExpressionAttributeValues', {})))
+        except expressions.ExpressionError as error:
+            raise_error(self.exceptions, 'ValidationException', str(error), operation)
+        if not matched:
+            raise_error(self.exceptions, 'ConditionalCheckFailedException', 'The conditional request failed', operation)
+
+    def returned(self, kwargs, old, new, updated=None):
+        mode = kwargs.get('ReturnValues', 'NONE')
+        if mode == 'ALL_OLD' and old:
+            return {'Attributes': copy.deepcopy(old)}
+        if mode == 'ALL_NEW' and new:
+            return {'Attributes': copy.deepcopy(new)}
+        if mode in ('UPDATED_NEW', 'UPDATED_OLD'):
+            source = new if mode == 'UPDATED_NEW' else old
+            if source:
+                return {'Attributes': {name: copy.deepcopy(source[name]) for name in updated or [] if name in source}}
+        return {}
+
+    def get_item(self, Key, ConsistentRead=False, **kwargs):
+        self.resource.meter.call('dynamodb', 'GetItem')
+        item = self.items.get(self.key_of(to_dynamo(Key)))
+        self.resource.meter.read(item_size(item), ConsistentRead)
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def put_item(self, Item, **kwargs):
+        self.resource.meter.call('dynamodb', 'PutItem')
+        item = to_dynamo(Item)
+        key = self.key_of(item)
+        existing = self.items.get(key)
+        self.check('PutItem', existing, kwargs)
+        self.items[key] = item
+        self.resource.meter.write(item_size(item))
+        self.emit(existing, item)
+        return self.returned(kwargs, existing, item)
+
+    def update_item(self, Key, UpdateExpression, **kwargs):
+        self.resource.meter.call('dynamodb', 'UpdateItem')
+        key_item = to_dynamo(Key)
+        key = self.key_of(key_item)
+        existing = self.items.get(key)
+        self.check('UpdateItem', existing, kwargs)
+        try:
+            new, updated = expressions.apply_update(UpdateExpression, existing or dict(key_item),
+                kwargs.get('ExpressionAttributeNames'), to_dynamo(kwargs.get('ExpressionAttributeValues', {})))
+        except expressions.ExpressionError as error:
+            raise_error(self.exceptions, 'ValidationException', str(error), 'UpdateItem')
+        self.items[key] = new
+        self.resource.meter.write(max(item_size(existing), item_size(new)))
+        self.emit(existing, new)
+        return self.returned(kwargs, existing, new, updated)
+
+    def delete_item(self, Key, **kwargs):
+        self.resource.meter.call('dynamodb', 'DeleteItem')
+        key = self.key_of(to_dynamo(Key))
+        existing = self.items.get(key)
+        self.check('DeleteItem', existing, kwargs)
+        if existing is not None:
+            del self.items[key]
+        self.resource.meter.write(item_size(existing))
+        self.emit(existing, None)
+        return self.returned(kwargs, existing, None)
+
+    def query(self, KeyConditionExpression, **kwargs):
+        self.resource.meter.call('dynamodb', 'Query')
+        names = kwargs.get('ExpressionAttributeNames')
+        values = to_dynamo(kwargs.get('ExpressionAttributeValues', {}))
+        partition_key, sort_key = self.partition_key, self.sort_key
+        if 'IndexName' in kwargs:
+            partition_key, sort_key = self.indexes[kwargs['IndexName']]
+        candidates = [item for item in self.items.values()
+            if partition_key in item and (sort_key is None or sort_key in item)
+            and expressions.condition_matches(KeyConditionExpression, item, names, values)]
+        if sort_key:
+            candidates.sort(key=lambda item: item[sort_key], reverse=not kwargs.get('ScanIndexForward', True))
+        return self.page(candidates, kwargs, names, values, (partition_key, sort_key))
+
+    def scan(self, **kwargs):
+        self.resource.meter.call('dynamodb', 'Scan')
+        names = kwargs.get('ExpressionAttributeNames')
+        values = to_dynamo(kwargs.get('ExpressionAttributeValues', {}))
+        candidates = sorted(self.items.values(), key=lambda item: str(self.key_of(item)))
+        return self.page(candidates, kwargs, names, values, (self.partition_key, self.sort_key))
+
+    def page(self, candidates, kwargs, names, values, index_keys):
+        start = kwargs.get('ExclusiveStartKey')
+        if start is not None:
+            start = to_dynamo(start)
+            for position, item in enumerate(candidates):
+                if all(item.get(name) == value for name, value in start.items()):
+                    candidates = candidates[position + 1:]
+                    break
+        limit = kwargs.get('Limit')
+        evaluated = candidates[:limit] if limit else candidates
+        self.resource.meter.read(sum(item_size(item) for item in evaluated), kwargs.get('ConsistentRead', False))
+        matched = [item for item in evaluated
+            if expressions.condition_matches(kwargs.get('FilterExpression'), item, names, values)]
+        response = {'Count': len(matched), 'ScannedCount': len(evaluated)}
+        if kwargs.get('Select') != 'COUNT':
+            response['Items'] = copy.deepcopy(matched)
+        if limit and len(candidates) > limit:
+            last = evaluated[-1]
+            keys = {self.partition_key, self.sort_key} | set(index_keys)
+            response['LastEvaluatedKey'] = {name: copy.deepcopy(last[name]) for name in keys if name and name in last}
+        return response
+
+
+class FakeDynamoResource:
+
+    def __init__(self, meter):
+        self.meter = meter
+        self.tables = {}
+        self.meta = types.SimpleNamespace(client=types.SimpleNamespace(
+            exceptions=exception_namespace('ConditionalCheckFailedException', 'ValidationException',
+                'ResourceNotFoundException', 'ProvisionedThroughputExceededException')))
+
+    def create_table(self, name, partition_key, sort_key=None, indexes=None, stream=False):
+        self.tables[name] = FakeTable(self, name, partition_key, sort_key, indexes, stream)
+        return self.tables[name]
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        self.meter.call('dynamodb', 'BatchWriteItem')
+        exceptions = self.meta.client.exceptions
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise_error(exceptions, 'ValidationException', 'Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+        for name, requests in RequestItems.items():
+            table = self.Table(name)
+            keys = [table.key_of(to_dynamo(request['DeleteRequest']['Key'] if 'DeleteRequest' in request else request['PutRequest']['Item']))
+                for request in requests]
+            if len(set(keys)) != len(keys):
+                raise_error(exceptions, 'ValidationException', 'Provided list of item keys contains duplicates', 'BatchWriteItem')
+            for key, request in zip(keys, requests):
+                existing = table.items.get(key)
+                new = to_dynamo(request['PutRequest']['Item']) if 'PutRequest' in request else None
+                if new is None:
+                    table.items.pop(key, None)
+                else:
+                    table.items[key] = new
+                self.meter.write(max(item_size(existing), item_size(new)))
+                table.emit(existing, new)
+        return {'UnprocessedItems': {}}
+
+    def Table(self, name):
+        if name not in self.tables:
+            raise_error(self.meta.client.exceptions, 'ResourceNotFoundException', f"Table {name} not found", 'DescribeTable')
+        return self.tables[name]
+
+
+class Paginator:
+
+    def __init__(self, method):
+        self.method = method
+
+    def paginate(self, **kwargs):
+        token = None
+        while True:
+            page = self.method(**dict(kwargs, nextToken=token)) if token else self.method(**kwargs)
+            yield page
+            token = page.get('nextToken')
+            if not token:
+                return
+
+
+class PaginatedClient:
+
+    def get_paginator(self, operation_name):
+        return Paginator(getattr(self, operation_name))
+
+
+# Batch
+
+class FakeBatch(PaginatedClient):
+
+    PAGE_SIZE = 100
+
+    def __init__(self, meter, world):
+        self.meter = meter
+        self.world = world
+        self.compute_environments = {}
+        self.job_queues = {}
+        self.jobs = {}
+        self.exceptions = exception_namespace('ClientException', 'ServerException')
+
+    def add_compute_environment(self, name, max_vcpus):
+        self.compute_environments[name] = {
+            'computeEnvironmentName': name,
+            'computeEnvironmentArn': f"arn:aws:batch:{REGION}:{ACCOUNT_ID}:compute-environment/{name}",
+            'ecsClusterArn': f"arn:aws:ecs:{REGION}:{ACCOUNT_ID}:cluster/AWSBatch-{name}-cluster",
+            'state': 'ENABLED',
+            'status': 'VALID',
+            'type': 'MANAGED',
+            'computeResources': {'type': 'FARGATE', 'maxvCpus': max_vcpus}
+        }
+
+    def add_job_queue(self, name, compute_environment):
+        self.job_queues[name] = {
+            'jobQueueName': name,
+            'jobQueueArn': f"arn:aws:batch:{REGION}:{ACCOUNT_ID}:job-queue/{name}",
+            'state': 'ENABLED',
+            'status': 'VALID',
+            'priority': 1,
+            'computeEnvironmentOrder': [{'order': 1, 'computeEnvironment': compute_environment}]
+        }
+
+    def compute_environment(self, name):
+        for environment in self.compute_environments.values():
+            if name in (environment['computeEnvironmentName'], environment['computeEnvironmentArn']):
+                return environment
+        raise_error(self.exceptions, 'ClientException', f"{name} does not exist", 'DescribeComputeEnvironments')
+
+    def job_queue(self, name):
+        for queue in self.job_queues.values():
+            if name in (queue['jobQueueName'], queue['jobQueueArn']):
+                return queue
+        raise_error(self.exceptions, 'ClientException', f"{name} does not exist", 'DescribeJobQueues')
+
+    def describe_compute_environments(self, computeEnvironments=None, **kwargs):
+        self.meter.call('batch', 'DescribeComputeEnvironments')
+        names = computeEnvironments or list(self.compute_environments)
+        return {'computeEnvironments': [copy.deepcopy(self.compute_environment(name)) for name in names]}
+
+    def describe_job_queues(self, jobQueues=None, **kwargs):
+        self.meter.call('batch', 'DescribeJobQueues')
+        names = jobQueues or list(self.job_queues)
+        return {'jobQueues': [copy.deepcopy(self.job_queue(name)) for name in names]}
+
+    def update_compute_environment(self, computeEnvironment, state=None, computeResources=None, **kwargs):
+        self.meter.call('batch', 'UpdateComputeEnvironment')
+        environment = self.compute_environment(computeEnvironment)
+        if state:
+            environment['state'] = state
+        if computeResources and 'maxvCpus' in computeResources:
+            environment['computeResources']['maxvCpus'] = computeResources['maxvCpus']
+            self.world.schedule_dispatch()
+        return {'computeEnvironmentName': environment['computeEnvironmentName'],
+            'computeEnvironmentArn': environment['computeEnvironmentArn']}
+
+    def update_job_queue(self, jobQueue, state=None, **kwargs):
+        self.meter.call('batch', 'UpdateJobQueue')
+        queue = self.job_queue(jobQueue)
+        if state:
+            queue['state'] = state
+            if state == 'ENABLED':
+                self.world.schedule_dispatch()
+        return {'jobQueueName': queue['jobQueueName'], 'jobQueueArn': queue['jobQueueArn']}
+
+    def submit_job(self, jobName, jobQueue, jobDefinition, **kwargs):
+        self.meter.call('batch', 'SubmitJob')
+        queue = self.job_queue(jobQueue)
+        if queue['state'] != 'ENABLED':
+            raise_error(self.exceptions, 'ClientException', f"{jobQueue} is not ENABLED", 'SubmitJob')
+        job = self.world.submit(jobName, queue['jobQueueName'], jobDefinition, kwargs)
+        return {'jobId': job['jobId'], 'jobName': jobName, 'jobArn': job['jobArn']}
+
+    def summary(self, job):
+        summary = {key: job[key] for key in ('jobId', 'jobArn', 'jobName', 'status', 'createdAt', 'jobDefinition') if key in job}
+        for key in ('startedAt', 'stoppedAt'):
+            if key in job:
+                summary[key] = job[key]
+        return summary
+
+    def list_jobs(self, jobQueue=None, jobStatus='RUNNING', maxResults=None, nextToken=None, **kwargs):
+        self.meter.call('batch', 'ListJobs')
+        queue_name = self.job_queue(jobQueue)['jobQueueName']
+        matching = [job for job in self.jobs.values() if job['jobQueue'] == queue_name and job['status'] == jobStatus]
+        start = int(nextToken or 0)
+        size = min(maxResults or self.PAGE_SIZE, self.PAGE_SIZE)
+        response = {'jobSummaryList': [self.summary(job) for job in matching[start:start + size]]}
+        if start + size < len(matching):
+            response['nextToken'] = str(start + size)
+        return response
+
+    def describe_jobs(self, jobs, **kwargs):
+        self.meter.call('batch', 'DescribeJobs')
+        if len(jobs) > 100:
+            raise_error(self.exceptions, 'ClientException', 'jobs must contain at most 100 ids', 'DescribeJobs')
+        return {'jobs': [copy.deepcopy(self.jobs[job_id]) for job_id in jobs if job_id in self.jobs]}
+
+    def describe_job_definitions(self, jobDefinitions=None, **kwargs):
+        self.meter.call('batch', 'DescribeJobDefinitions')
+        definitions = self.world.job_definitions
+        names = jobDefinitions or list(definitions)
+        return {'jobDefinitions': [copy.deepcopy(definitions[name.split('/')[-1].split(':')[0]])
+            for name in names if name.split('/')[-1].split(':')[0] in definitions]}
+
+    def terminate_job(self, jobId, reason, **kwargs):
+        self.meter.call('batch', 'TerminateJob')
+        self.world.stop_job(jobId, reason, terminate=True)
+        return {}
+
+    def cancel_job(self, jobId, reason, **kwargs):
+        self.meter.call('batch', 'CancelJob')
+        self.world.stop_job(jobId, reason, terminate=False)
+        return {}
+
+    def tag_resource(self, resourceArn, tags, **kwargs):
+        self.meter.call('batch', 'TagResource')
+        for job in self.jobs.values():
+            if job['jobArn'] == resourceArn:
+                job.setdefault('tags', {}).update(tags)
+                self.world.notify_tagged(job)
+        return {}
+
+
+# ECS
+
+class FakeEcs(PaginatedClient):
+
+    PAGE_SIZE = 100
+
+    def __init__(self, meter):
+        self.meter = meter
+        self.tasks = {}
+        self.exceptions = exception_namespace('ClientException', 'ServerException', 'ClusterNotFoundException')
+
+    def cluster_tasks(self, cluster):
+        return [task for task in self.tasks.values()
+            if cluster in (task['clusterArn'], task['clusterArn'].split('/')[-1])]
+
+    def list_tasks(self, cluster, desiredStatus='RUNNING', maxResults=None, nextToken=None, **kwargs):
+        self.meter.call('ecs', 'ListTasks')
+        matching = [task['taskArn'] for task in self.cluster_tasks(cluster) if task['desiredStatus'] == desiredStatus]
+        start = int(nextToken or 0)
+        size = min(maxResults or self.PAGE_SIZE, self.PAGE_SIZE)
+        response = {'taskArns': matching[start:start + size]}
+        if start + size < len(matching):
+            response['nextToken'] = str(start + size)
+        return response
+
+    def describe_tasks(self, cluster, tasks, **kwargs):
+        self.meter.call('ecs', 'DescribeTasks')
+        if len(tasks) > 100:
+            raise_error(self.exceptions, 'ClientException', 'tasks must contain at most 100 ids', 'DescribeTasks')
+        return {
+            'tasks': [copy.deepcopy(self.tasks[arn]) for arn in tasks if arn in self.tasks],
+            'failures': [{'arn': arn, 'reason': 'MISSING'} for arn in tasks if arn not in self.tasks]
+        }
+
+
+# Billing services
+
+class FakeCostExplorer:
+
+    def __init__(self, meter, world):
+        self.meter = meter
+        self.world = world
+
+    def get_cost_and_usage(self, TimePeriod, Granularity, Metrics, Filter=None, GroupBy=None, **kwargs):
+        self.meter.call('ce', 'GetCostAndUsage')
+        return self.world.cost_and_usage(TimePeriod['Start'], TimePeriod['End'], Granularity, GroupBy)
+
+
+class FakeBudgets:
+
+    def __init__(self, meter, world):
+        self.meter = meter
+        self.world = world
+
+    def describe_budget(self, AccountId, BudgetName, **kwargs):
+        self.meter.call('budgets', 'DescribeBudget')
+        return {'Budget': {
+            'BudgetName': BudgetName,
+            'BudgetLimit': {'Amount': str(self.world.budget_limit), 'Unit': 'USD'},
+            'CalculatedSpend': {'ActualSpend': {'Amount': '%.2f' % self.world.billed_cost(), 'Unit': 'USD'}},
+            'TimeUnit': 'MONTHLY',
+            'BudgetType': 'COST'
+        }}
+
+
+class FakeSns:
+
+    def __init__(self, meter):
+        self.meter = meter
+        self.messages = []
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        self.meter.call('sns', 'Publish')
+        self.messages.append({'TopicArn': TopicArn, 'Subject': Subject, 'Message': Message})
+        return {'MessageId': str(len(self.messages))}
+
+
+class FakeStepFunctions:
+
+    def __init__(self, meter, world):
+        self.meter = meter
+        self.world = world
+
+    def start_execution(self, stateMachineArn, input='{}', name=None, **kwargs):
+        self.meter.call('stepfunctions', 'StartExecution')
+        execution_arn = self.world.start_execution(stateMachineArn, json.loads(input))
+        return {'executionArn': execution_arn, 'startDate': self.world.clock.now()}
+
+
+class FakeS3:
+
+    def __init__(self, meter):
+        self.meter = meter
+        self.objects = {}
+        self.exceptions = exception_namespace('NoSuchKey', 'NoSuchBucket')
+
+    def put(self, bucket, key, body):
+        self.objects[(bucket, key)] = bytes(body)
+
+    def list_objects_v2(self, Bucket, Prefix='', Delimiter=None, **kwargs):
+        self.meter.call('s3', 'ListObjectsV2')
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        common_prefixes = []
+        if Delimiter:
+            # keys below the next delimiter are rolled up into their common prefix
+            common_prefixes = sorted({Prefix + key[len(Prefix):].split(Delimiter)[0] + Delimiter
+                for key in keys if Delimiter in key[len(Prefix):]})
+            keys = [key for key in keys if Delimiter not in key[len(Prefix):]]
+        response = {'KeyCount': len(keys) + len(common_prefixes), 'Contents': [{'Key': key, 'Size': len(self.objects[(Bucket, key)])} for key in keys]}
+        if common_prefixes:
+            response['CommonPrefixes'] = [{'Prefix': prefix} for prefix in common_prefixes]
+        return response
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self.meter.call('s3', 'GetObject')
+        if (Bucket, Key) not in self.objects:
+            raise_error(self.exceptions, 'NoSuchKey', 'The specified key does not exist.', 'GetObject')
+        body = self.objects[(Bucket, Key)]
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+
+class FakeCloudWatch:
+
+    def __init__(self, meter):
+        self.meter = meter
+        self.metric_data = []
+
+    def put_metric_data(self, Namespace, MetricData, **kwargs):
+        self.meter.call('cloudwatch', 'PutMetricData')
+        for datum in MetricData:
+            self.metric_data.append(dict(datum, Namespace=Namespace))
+        return {}
+
+
+class EventHooks:
+    """The part of botocore's event system the handlers use: hooks registered on a
+    dotted event name prefix (e.g. "before-call.batch") run for every event below it."""
+
+    def __init__(self):
+        self.handlers = []
+
+    def register(self, event_name, handler):
+        self.handlers.append((event_name, handler))
+
+    def emit(self, event_name, **kwargs):
+        for prefix, handler in self.handlers:
+            if event_name == prefix or event_name.startswith(prefix + '.'):
+                handler(event_name=event_name, **kwargs)
+
+
+class ClientProxy:
+    """A client per boto3.client() call, as in boto3: its own meta.events in front of
+    the service's shared fake, emitting before-call for every operation (and page)."""
+
+    def __init__(self, service_name, fake):
+        self._fake = fake
+        self.meta = types.SimpleNamespace(
+            service_model=types.SimpleNamespace(service_name=service_name),
+            events=EventHooks()
+        )
+
+    def __getattr__(self, name):
+        attribute = getattr(self._fake, name)
+        if name.startswith('_') or name == 'exceptions' or not callable(attribute):
+            return attribute
+        operation = ''.join(part.title() for part in name.split('_'))
+
+        def call(*args, **kwargs):
+            self.meta.events.emit(f"before-call.{self.meta.service_model.service_name}.{operation}",
+                model=types.SimpleNamespace(name=operation), params=kwargs)
+            return attribute(*args, **kwargs)
+        return call
+
+    def get_paginator(self, operation_name):
+        return Paginator(getattr(self, operation_name))
+
+
+class FakeAws:
+    """One simulated account: every client shares a meter and the simulated world."""
+
+    def __init__(self, world):
+        self.meter = Meter()
+        self.dynamodb = FakeDynamoResource(self.meter)
+        self.batch = FakeBatch(self.meter, world)
+        self.ecs = FakeEcs(self.meter)
+        self.ce = FakeCostExplorer(self.meter, world)
+        self.budgets = FakeBudgets(self.meter, world)
+        self.sns = FakeSns(self.meter)
+        self.stepfunctions = FakeStepFunctions(self.meter, world)
+        self.cloudwatch = FakeCloudWatch(self.meter)
+        self.s3 = FakeS3(self.meter)
+        self.ids = itertools.count(1)
+
+    def client(self, service_name, *args, **kwargs):
+        if service_name == 'dynamodb':
+            return self.dynamodb.meta.client
+        if not hasattr(self, service_name):
+            raise ValueError(f"The simulator has no stand-in for the {service_name} service")
+        if service_name in ('batch', 'ecs'):
+            return ClientProxy(service_name, getattr(self, service_name))
+        return getattr(self, service_name)
+
+    def resource(self, service_name, *args, **kwargs):
+        if service_name != 'dynamodb':
+            raise ValueError(f"The simulator has no resource stand-in for the {service_name} service")
+        return self.dynamodb
+
+    def boto3_module(self):
+        """Module object handed to the handlers in place of boto3."""
+        module = types.ModuleType('boto3')
+        module.client = self.client
+        module.resource = self.resource
+        return module
+
+    def botocore_modules(self):
+        botocore = types.ModuleType('botocore')
+        botocore.exceptions = types.ModuleType('botocore.exceptions')
+        botocore.exceptions.ClientError = ClientError
+        return {'botocore': botocore, 'botocore.exceptions': botocore.exceptions}
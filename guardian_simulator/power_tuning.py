@@ -0,0 +1,225 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Local power tuning: benchmark each guardian handler at simulated Lambda memory sizes.
+
+Every handler is invoked once per repetition against a fresh simulation holding the
+requested number of running Fargate tasks, in the order an enforcement calls them.
+The measured CPU time of the handler (which includes the in-memory fakes, so errs high) is scaled by the CPU share Lambda allocates at
+each memory size (proportional to memory, one full vCPU at 1769 MB) and added to the
+modelled latency of its AWS calls. The cheapest memory size whose slowest repetition
+meets the latency target is recommended, in the shape of the "lambdaFunctionSettings"
+CDK context read by cdk_common.function_settings.
+
+Every function of the Event-Driven Budget Checker and Serverless Batch Cost Guardian
+stacks is benchmarked. The Organization-Wide Guardian runs against member accounts the
+simulator does not model, so it is not, and keeps the "default" entry.
+
+Usage: python -m guardian_simulator.power_tuning [--tasks 500] [--target-seconds 1] ...
+"""
+
+import argparse
+import heapq
+import json
+import math
+import sys
+import time
+
+from guardian_simulator.simulator import PRICES, JOB_QUEUE_NAME, SQS_BATCH_SIZE, Simulation, synthetic_trace
+
+MEMORY_SIZES = (128, 256, 512, 1024, 1769)
+FULL_VCPU_MEMORY_MB = 1769
+
+# Lambda GB-second prices per architecture (arm64 is 20% cheaper; CPU speed is assumed equal)
+GB_SECOND_PRICES = {
+    'x86_64': PRICES['lambda_gb_second'],
+    'arm64': 0.0000133334
+}
+
+# with no size meeting the target, sizes within this fraction of the fastest duration are considered equal
+NEAR_FASTEST = 0.05
+
+# recommended timeouts leave this much headroom over the benchmarked duration (Lambda default is 3 seconds)
+TIMEOUT_HEADROOM = 2.0
+
+# simulator function names whose CDK construct id differs
+CDK_FUNCTION_IDS = {
+    'month-to-date-batch-spend-checker': 'month_to_date_batch_spend_checker'
+}
+
+
+def enforcement_simulation(tasks):
+    """A simulation with the given number of long running tasks and no other workload."""
+    trace = synthetic_trace(hours=0, budget_limit=100.0, month_to_date_spend=50.0)
+    trace['maxvCpus'] = tasks * 2
+    simulation = Simulation(trace, {'desiredBudgetThresholdPercent': 1000})
+    for number in range(tasks):
+        simulation.submit(f"power-tuning-{number}", JOB_QUEUE_NAME, 'sim-2vcpu', {'simulatedDurationSeconds': 7 * 86400.0})
+    ready_at = simulation.parameters['taskStartSeconds'] + 1
+    while simulation.events and simulation.events[0][0] <= ready_at:
+        seconds, _, action, args = heapq.heappop(simulation.events)
+        simulation.advance(seconds)
+        action(*args)
+    return simulation
+
+
+def measure(simulation, function_name, event):
+    calls_before = simulation.aws.meter.total_calls()
+    cpu_before = time.process_time()
+    simulation.invoke(function_name, event)
+    return time.process_time() - cpu_before, simulation.aws.meter.total_calls() - calls_before
+
+
+def benchmark_once(tasks):
+    """CPU seconds and AWS calls of each handler during one enforcement."""
+    simulation = enforcement_simulation(tasks)
+    execution_input = {'startTime': str(simulation.clock.now()), 'startCost': '50.000', 'budgetLimit': '50.01'}
+    samples = {}
+
+    samples['month-to-date-batch-spend-checker'] = measure(simulation, 'month-to-date-batch-spend-checker', simulation.publish_cur())
+    samples['stop-new-jobs-lambda-function'] = measure(simulation, 'stop-new-jobs-lambda-function', execution_input)
+    samples['write-tasks-to-dynamo-lambda-function'] = measure(simulation, 'write-tasks-to-dynamo-lambda-function', execution_input)
+
+    # one full stream batch as configured on the event source mapping, then the rest unmeasured
+    running_table = simulation.running_table
+    while running_table.stream_records:
+        batch = running_table.stream_records[:100]
+        del running_table.stream_records[:100]
+        sample = measure(simulation, 'update-aggregate-ecs-task-table-lambda-function', {'Records': batch})
+        samples.setdefault('update-aggregate-ecs-task-table-lambda-function', sample)
+
+    simulation.aws.dynamodb.Table('sim-latest-timestamp-running-cost-table').put_item(Item={
+        'partition-key': 'pk', 'latestTimeStamp': execution_input['startTime'], 'runningCost': execution_input['startCost']})
+    simulation.advance(simulation.clock.seconds + 60)
+    samples['high-velocity-batch-spend-checker-lambda-function'] = measure(simulation,
+        'high-velocity-batch-spend-checker-lambda-function', execution_input)
+    samples['admission-control-lambda-function'] = measure(simulation, 'admission-control-lambda-function',
+        {'body': json.dumps({'jobDefinition': 'sim-2vcpu', 'expectedDurationHours': 2})})
+
+    # the heaviest actions, each making one call per queued or running job
+    simulation.submit('power-tuning-queued', JOB_QUEUE_NAME, 'sim-2vcpu', {})
+    samples['guardian-actions-lambda-function'] = measure(simulation, 'guardian-actions-lambda-function', dict(execution_input,
+        runningCost=50.0, actions=[{'action': 'NOTIFY', 'percent': 80.0}, {'action': 'CANCEL_QUEUED', 'percent': 90.0},
+            {'action': 'DRAIN', 'graceSeconds': 60.0, 'drainDeadline': simulation.clock.now().strftime('%Y-%m-%dT%H:%M:%SZ')}]))
+    samples['stop-running-batch-jobs-lambda-function'] = measure(simulation, 'stop-running-batch-jobs-lambda-function', execution_input)
+
+    # one full SQS batch of STOPPED events
+    jobs = [job for job in simulation.aws.batch.jobs.values() if job['status'] in ('STARTING', 'RUNNING')][:SQS_BATCH_SIZE]
+    records = []
+    for job in jobs:
+        simulation.finish_job(job['jobId'], 'FAILED')
+        records.append({'messageId': job['jobId'], 'body': json.dumps(simulation.task_state_change_event(simulation.aws.ecs.tasks[job['taskArn']]))})
+    samples['delete-ecs-task-from-dynamo-lambda-function'] = measure(simulation, 'delete-ecs-task-from-dynamo-lambda-function',
+        {'Records': records})
+
+    # one full SQS batch of job state change events, as if the jobs had run to completion
+    records = []
+    for job in jobs:
+        event = simulation.job_state_change_event(job)
+        event['detail'] = dict(event['detail'], status='SUCCEEDED')
+        event['detail'].pop('statusReason', None)
+        event['detail'].pop('tags', None)
+        records.append({'messageId': job['jobId'], 'body': json.dumps(event)})
+    samples['record-job-runtimes-lambda-function'] = measure(simulation, 'record-job-runtimes-lambda-function', {'Records': records})
+
+    samples['get-spend-history-lambda-function'] = measure(simulation, 'get-spend-history-lambda-function', {})
+
+    if simulation.errors:
+        raise RuntimeError(f"Handler failed during the benchmark: {simulation.errors[0]}")
+    return samples, simulation.parameters
+
+
+def modelled_duration(cpu_seconds, api_calls, memory_mb, parameters):
+    cpu_share = min(1.0, memory_mb / FULL_VCPU_MEMORY_MB)
+    return parameters['lambdaOverheadSeconds'] + api_calls * parameters['apiLatencySeconds'] + cpu_seconds / cpu_share
+
+
+def invocation_cost(duration, memory_mb, architecture):
+    billed_seconds = math.ceil(duration * 1000) / 1000
+    return PRICES['lambda_request'] + billed_seconds * memory_mb / 1024 * GB_SECOND_PRICES[architecture]
+
+
+def power_tune(tasks=500, memory_sizes=MEMORY_SIZES, target_seconds=1.0, architecture='arm64', repetitions=3):
+    runs = [benchmark_once(tasks) for _ in range(repetitions)]
+    parameters = runs[0][1]
+    results = {}
+    for function_name in runs[0][0]:
+        settings = []
+        for memory_mb in memory_sizes:
+            # the slowest repetition decides, so noisy CPU measurements err on the safe side
+            duration = max(modelled_duration(*samples[function_name], memory_mb, parameters) for samples, _ in runs)
+            settings.append({
+                'memorySize': memory_mb,
+                'durationSeconds': round(duration, 4),
+                'costPerInvocationUsd': invocation_cost(duration, memory_mb, architecture)
+            })
+        meeting_target = [setting for setting in settings if setting['durationSeconds'] <= target_seconds]
+        if meeting_target:
+            recommended = min(meeting_target, key=lambda setting: (setting['costPerInvocationUsd'], setting['memorySize']))
+        else:
+            # memory cannot buy back time spent waiting on AWS calls: take the cheapest size close to the fastest
+            fastest = min(setting['durationSeconds'] for setting in settings)
+            recommended = min((setting for setting in settings if setting['durationSeconds'] <= fastest * (1 + NEAR_FASTEST)),
+                key=lambda setting: setting['costPerInvocationUsd'])
+        results[function_name] = {
+            'cpuSeconds': max(samples[function_name][0] for samples, _ in runs),
+            'apiCalls': runs[0][0][function_name][1],
+            'settings': settings,
+            'recommended': dict(recommended, meetsTarget=bool(meeting_target))
+        }
+    return results
+
+
+def context_settings(results, architecture):
+    """The recommendation as a "lambdaFunctionSettings" CDK context value."""
+    context = {'default': {'architecture': architecture}}
+    for function_name, result in results.items():
+        context[CDK_FUNCTION_IDS.get(function_name, function_name)] = {
+            'memorySize': result['recommended']['memorySize'],
+            'timeoutSeconds': max(3, math.ceil(result['recommended']['durationSeconds'] * TIMEOUT_HEADROOM))
+        }
+    return context
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m guardian_simulator.power_tuning',
+        description='Recommend the cheapest Lambda memory size per guardian handler that meets a latency target.')
+    parser.add_argument('--tasks', type=int, default=500, help='running Fargate tasks during the benchmark')
+    parser.add_argument('--memory', type=int, nargs='+', default=list(MEMORY_SIZES), help='memory sizes (MB) to evaluate')
+    parser.add_argument('--target-seconds', type=float, default=1.0, help='latency target per invocation')
+    parser.add_argument('--architecture', choices=sorted(GB_SECOND_PRICES), default='arm64')
+    parser.add_argument('--repetitions', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help='print the full results as JSON')
+    args = parser.parse_args(argv)
+
+    results = power_tune(args.tasks, args.memory, args.target_seconds, args.architecture, args.repetitions)
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"{'function':<52} {'calls':>6} {'cpu(s)':>7} {'memory':>6} {'duration(s)':>11} {'$/1M invocations':>16}")
+    for function_name, result in results.items():
+        recommended = result['recommended']
+        print(f"{function_name:<52} {result['apiCalls']:>6} {result['cpuSeconds']:>7.3f} {recommended['memorySize']:>6} "
+            f"{recommended['durationSeconds']:>11.3f} {recommended['costPerInvocationUsd'] * 1000000:>16.2f}"
+            f"{'' if recommended['meetsTarget'] else '  (misses target)'}")
+    print()
+    print('cdk.json context:')
+    print(json.dumps({'lambdaFunctionSettings': context_settings(results, args.architecture)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,1017 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+"""Accelerated-clock replay of a Batch workload through the real guardian handlers.
+
+A trace describes the month-to-date spend before the replay, the job definitions
+and the job submissions. The simulator turns submissions into Batch jobs and
+Fargate tasks, delivers ECS STOPPED events and DynamoDB stream batches, invokes the
+Event-Driven Budget Checker on every CUR delivery and interprets the cost guardian
+state machine, all on a virtual clock. Each run reports how far spend overshot the
+budget, how long detection took and what the guardian itself cost.
+"""
+
+import contextlib
+import csv
+import datetime
+import gzip
+import heapq
+import importlib
+import io
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import time
+import traceback
+import types
+from concurrent.futures import ProcessPoolExecutor
+
+from guardian_simulator.fake_aws import FakeAws, ACCOUNT_ID, REGION
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDA_DIRECTORIES = [
+    os.path.join(REPO_ROOT, 'serverless_batch_cost_guardian', 'lambdas'),
+    os.path.join(REPO_ROOT, 'event_driven_budget_checker', 'lambda')
+]
+
+# Fargate Linux/x86 on-demand rates used by the guardian's own cost formula
+VCPU_HOUR_PRICE = 0.04048
+GB_HOUR_PRICE = 0.004445
+
+# Prices (USD) used to cost the guardian's own API usage
+PRICES = {
+    'lambda_request': 0.20 / 1000000,
+    'lambda_gb_second': 0.0000166667,
+    'state_transition': 0.025 / 1000,
+    'dynamodb_write_unit': 1.25 / 1000000,
+    'dynamodb_read_unit': 0.25 / 1000000,
+    'ce_request': 0.01,
+    'sns_publish': 0.50 / 1000000,
+    'cloudwatch_put_metric_data': 0.01 / 1000,
+    's3_get': 0.0004 / 1000,
+    's3_list': 0.005 / 1000,
+    'sqs_request': 0.40 / 1000000
+}
+
+DEFAULT_PARAMETERS = {
+    'waitTime': 300,                          # seconds between guardian polls
+    'desiredBudgetThresholdPercent': 80,      # budget checker threshold
+    'curIntervalHours': 8,                    # used when the trace lists no deliveries
+    'horizonHours': 72,                       # hard stop for runs that never settle
+    'taskStartSeconds': 60,                   # RUNNABLE -> RUNNING
+    'taskStopSeconds': 30,                    # terminate -> task STOPPED
+    'eventDelaySeconds': 2,                   # ECS state change -> EventBridge target
+    'streamDelaySeconds': 1,                  # DynamoDB stream polling interval
+    'sqsBatchWindowSeconds': 5,               # SQS event source maximum batching window
+    'sqsVisibilitySeconds': 180,              # failed SQS messages become visible again after this
+    'apiLatencySeconds': 0.02,                # modelled latency of each AWS call
+    'lambdaOverheadSeconds': 0.05,            # modelled handler overhead per invocation
+    'lambdaMemoryMb': 128,
+    'spendSourceOrder': 'budgets,cur,costexplorer',
+    'costExplorerMode': 'MONTHLY',
+    'anomalyAction': 'SHORTEN_WAIT',
+    'startOnProjection': 'true',
+    'jobCostCaps': '',                        # per-job cost caps JSON, see job_cost_caps.py
+    'runningJobCheckIntervalMinutes': 5,      # scheduled per-job cost cap and job queue budget checks
+    'queueBudgets': '',                       # per-job-queue budgets JSON, see queue_budgets.py
+    'escalationPolicy': '',                   # escalation tiers JSON, see escalation_policy.py
+    'rateGovernorLimits': '',                 # API rate governor limits JSON, see rate_governor.py
+    'drainGraceSeconds': 0,                   # drain mode grace window, 0 terminates without draining
+    'checkpointSeconds': 120                  # drain signal -> job checkpointed and exited
+}
+
+COMPUTE_ENV_NAME = 'sim-fargate-compute-environment'
+JOB_QUEUE_NAME = 'sim-job-queue'
+SQS_BATCH_SIZE = 100
+DRAIN_TAG = 'batch-cost-guardian:drain-deadline'   # see batch_actions.py
+STATE_MACHINE_ARN = f"arn:aws:states:{REGION}:{ACCOUNT_ID}:stateMachine:serverless-batch-cost-guardian"
+# where the first check's decision takes effect (TimeToFirstAction)
+FIRST_ACTION_STATES = ('first-stop-running-batch-jobs', 'first-dispatch-guardian-actions', 'first-check-no-action')
+
+
+class VirtualClock:
+
+    def __init__(self, start):
+        # real clocks are never on an exact second and str(datetime) drops the
+        # fractional part when it is zero, which the handlers' strptime formats expect
+        self.start = start.replace(microsecond=start.microsecond or 123457)
+        self.seconds = 0.0
+        self.offset = 0.0   # time spent sleeping inside the current invocation
+
+    def now(self):
+        return self.start + datetime.timedelta(seconds=self.seconds + self.offset)
+
+    def time(self):
+        return self.now().timestamp()
+
+    def sleep(self, seconds):
+        self.offset += max(0.0, seconds)
+
+    def datetime_module(self):
+        clock = self
+
+        class VirtualDatetime(datetime.datetime):
+
+            @classmethod
+            def now(cls, tz=None):
+                current = clock.now()
+                return current.replace(tzinfo=datetime.timezone.utc).astimezone(tz) if tz else current
+
+            @classmethod
+            def utcnow(cls):
+                return clock.now()
+
+            @classmethod
+            def today(cls):
+                return clock.now()
+
+        class VirtualDate(datetime.date):
+
+            @classmethod
+            def today(cls):
+                return clock.now().date()
+
+        module = types.ModuleType('datetime')
+        module.__dict__.update({name: getattr(datetime, name) for name in dir(datetime) if not name.startswith('__')})
+        module.datetime = VirtualDatetime
+        module.date = VirtualDate
+        return module
+
+    def time_module(self):
+        module = types.ModuleType('time')
+        module.__dict__.update({name: getattr(time, name) for name in dir(time) if not name.startswith('__')})
+        module.time = self.time
+        module.sleep = self.sleep
+        module.monotonic = lambda: self.seconds + self.offset
+        return module
+
+
+class Simulation:
+
+    def __init__(self, trace, parameters):
+        self.trace = trace
+        self.parameters = dict(DEFAULT_PARAMETERS, **(parameters or {}))
+        self.clock = VirtualClock(parse_time(trace['start']))
+        self.events = []
+        self.sequence = itertools.count()
+        self.aws = FakeAws(self)
+        self.budget_limit = float(trace['budgetLimit'])
+        self.month_start = self.clock.start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        self.base_spend = float(trace.get('monthToDateSpend', 0.0))
+        self.billed_as_of = self.clock.start
+        self.job_definitions = build_job_definitions(trace.get('jobDefinitions', {}))
+        self.ledger = []   # [start_seconds, stop_seconds or None, hourly_rate]
+        self.ids = itertools.count(1)
+        self.dispatch_scheduled = False
+        self.stream_poll_scheduled = {}
+        # SQS queues by the Lambda function draining them
+        self.sqs_queues = {'delete-ecs-task-from-dynamo-lambda-function': [], 'record-job-runtimes-lambda-function': []}
+        self.sqs_poll_scheduled = {}
+        self.executions = []
+        self.transitions = 0
+        self.lambda_invocations = 0
+        self.lambda_gb_seconds = 0.0
+        self.metrics = []
+        self.errors = []
+        self.crossed_at = None
+        self.detected_at = None
+        self.terminate_issued_at = None
+        self.escalations = []
+        self.backlog_forecast = 0.0
+        self.handlers = {}
+
+        self.aws.batch.add_compute_environment(COMPUTE_ENV_NAME, trace.get('maxvCpus', 256))
+        self.aws.batch.add_job_queue(JOB_QUEUE_NAME, COMPUTE_ENV_NAME)
+        for queue_name in trace.get('jobQueues', []):
+            self.aws.batch.add_job_queue(queue_name, COMPUTE_ENV_NAME)
+        self.cluster_arn = self.aws.batch.compute_environment(COMPUTE_ENV_NAME)['ecsClusterArn']
+        self.create_tables()
+        self.load_handlers()
+
+    # deployment
+
+    def create_tables(self):
+        dynamodb = self.aws.dynamodb
+        self.running_table = dynamodb.create_table('sim-batch-ecs-running-tasks-table', 'taskArn', stream=True,
+            indexes={'cap-breach-index': ('capQueue', 'capBreachAt')})
+        dynamodb.create_table('sim-batch-ecs-aggregate-table', 'aggregate_key')
+        dynamodb.create_table('sim-latest-timestamp-running-cost-table', 'partition-key')
+        dynamodb.create_table('sim-spend-history-table', 'series_key', 'chunk_start')
+        dynamodb.create_table('sim-cost-explorer-cache-table', 'environment', 'date')
+        dynamodb.create_table('sim-runtime-sketch-table', 'jobDefinition')
+        dynamodb.create_table('sim-api-rate-governor-table', 'bucket')
+        self.stream_consumers = {self.running_table.name: 'update-aggregate-ecs-task-table-lambda-function'}
+
+    def environment(self):
+        return {
+            'ACCOUNT_ID': ACCOUNT_ID,
+            'BUDGET_NAME': 'sim-budget',
+            'BATCH_COMPUTE_ENV_NAME': COMPUTE_ENV_NAME,
+            'BATCH_JOB_QUEUE_NAME': JOB_QUEUE_NAME,
+            'COST_GUARDIAN_STATE_MACHINE_ARN': STATE_MACHINE_ARN,
+            'DESIRED_BUDGET_THRESHOLD_PERCENT': str(self.parameters['desiredBudgetThresholdPercent']),
+            'SNS_ARN': f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:event-driven-budget-checker-sns-topic",
+            'RUNNING_TABLE_NAME': 'sim-batch-ecs-running-tasks-table',
+            'AGGREGATE_TABLE_NAME': 'sim-batch-ecs-aggregate-table',
+            'LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME': 'sim-latest-timestamp-running-cost-table',
+            'SPEND_HISTORY_TABLE_NAME': 'sim-spend-history-table',
+            'RUNTIME_SKETCH_TABLE_NAME': 'sim-runtime-sketch-table',
+            'RATE_GOVERNOR_TABLE_NAME': 'sim-api-rate-governor-table',
+            'RATE_GOVERNOR_LIMITS': self.parameters['rateGovernorLimits'],
+            'DRAIN_GRACE_SECONDS': str(int(self.parameters['drainGraceSeconds'])),
+            'SPEND_SOURCE_ORDER': self.parameters['spendSourceOrder'],
+            'COST_EXPLORER_MODE': self.parameters['costExplorerMode'],
+            'COST_EXPLORER_CACHE_TABLE_NAME': 'sim-cost-explorer-cache-table',
+            'WAIT_TIME_SECONDS': str(int(self.parameters['waitTime'])),
+            'ANOMALY_ACTION': self.parameters['anomalyAction'],
+            'START_ON_PROJECTION': self.parameters['startOnProjection'],
+            'EXPECTED_CUR_INTERVAL_HOURS': str(self.parameters['curIntervalHours']),
+            'JOB_COST_CAPS': self.parameters['jobCostCaps'],
+            'QUEUE_BUDGETS': self.parameters['queueBudgets'],
+            'ESCALATION_POLICY': self.parameters['escalationPolicy'],
+            'ESCALATION_TOPIC_ARN': f"arn:aws:sns:{REGION}:{ACCOUNT_ID}:guardian-escalation-topic"
+        }
+
+    def functions(self):
+        return {
+            'month-to-date-batch-spend-checker': 'month_to_date_batch_spend_checker',
+            'stop-new-jobs-lambda-function': 'stop_new_batch_job_submissions',
+            'write-tasks-to-dynamo-lambda-function': 'write_batch_ecs_tasks_to_dynamo',
+            'update-aggregate-ecs-task-table-lambda-function': 'update_aggregate_ecs_task_table',
+            'delete-ecs-task-from-dynamo-lambda-function': 'delete_ecs_task_from_dynamo',
+            'high-velocity-batch-spend-checker-lambda-function': 'high_velocity_batch_spend_checker',
+            'stop-running-batch-jobs-lambda-function': 'stop_running_batch_jobs',
+            'guardian-actions-lambda-function': 'guardian_actions',
+            'admission-control-lambda-function': 'admission_control',
+            'record-job-runtimes-lambda-function': 'record_job_runtimes',
+            'get-spend-history-lambda-function': 'get_spend_history',
+            'check-running-batch-jobs-lambda-function': 'check_running_batch_jobs'
+        }
+
+    def load_handlers(self):
+        # every run imports fresh copies of the handlers bound to this run's fakes and clock
+        local_modules = {name[:-3] for directory in LAMBDA_DIRECTORIES for name in os.listdir(directory) if name.endswith('.py')}
+        for name in local_modules:
+            sys.modules.pop(name, None)
+        for directory in LAMBDA_DIRECTORIES:
+            if directory not in sys.path:
+                sys.path.insert(0, directory)
+        os.environ.update(self.environment())
+        replaced = {'boto3': self.aws.boto3_module()}
+        replaced.update(self.aws.botocore_modules())
+        saved = {name: sys.modules.get(name) for name in replaced}
+        sys.modules.update(replaced)
+        try:
+            for function_name, module_name in self.functions().items():
+                self.handlers[function_name] = importlib.import_module(module_name).lambda_handler
+        finally:
+            for name, module in saved.items():
+                if module is None:
+                    sys.modules.pop(name, None)
+                else:
+                    sys.modules[name] = module
+        virtual_datetime = self.clock.datetime_module()
+        virtual_time = self.clock.time_module()
+        for name in local_modules:
+            module = sys.modules.get(name)
+            if module is None:
+                continue
+            if getattr(module, 'datetime', None) is datetime:
+                module.datetime = virtual_datetime
+            if getattr(module, 'time', None) is time:
+                module.time = virtual_time
+
+    # event loop
+
+    def at(self, seconds, action, *args):
+        heapq.heappush(self.events, (seconds, next(self.sequence), action, args))
+
+    def after(self, seconds, action, *args):
+        self.at(self.clock.seconds + seconds, action, *args)
+
+    def run(self):
+        horizon = self.parameters['horizonHours'] * 3600
+        for job in self.trace.get('jobs', []):
+            self.at(float(job['submitAt']), self.submit_from_trace, job)
+        for delivery in self.cur_deliveries(horizon):
+            self.at(delivery, self.deliver_cur)
+        self.after(self.parameters['runningJobCheckIntervalMinutes'] * 60, self.check_running_jobs)
+        while self.events:
+            seconds, _, action, args = heapq.heappop(self.events)
+            if seconds > horizon:
+                self.advance(horizon)
+                break
+            self.advance(seconds)
+            action(*args)
+            if self.settled():
+                break
+        return self.report()
+
+    def advance(self, seconds):
+        previous = self.clock.seconds
+        self.clock.seconds = max(previous, seconds)
+        self.clock.offset = 0.0
+        if self.crossed_at is None and self.accrued(self.clock.seconds) >= self.budget_limit:
+            self.crossed_at = self.crossing_time(previous, self.clock.seconds)
+
+    def settled(self):
+        # nothing can change the spend any more once enforcement finished and no task is running
+        return self.terminate_issued_at is not None and not self.running_tasks() \
+            and all(execution['status'] != 'RUNNING' for execution in self.executions) \
+            and not self.sqs_queues['delete-ecs-task-from-dynamo-lambda-function'] \
+            and not any(action in (self.deliver_ecs_event, self.deliver_stream_batch, self.deliver_sqs_batch, self.requeue_messages)
+                for _, _, action, _ in self.events)
+
+    def cur_deliveries(self, horizon):
+        if 'curDeliveryHours' in self.trace:
+            return [float(hours) * 3600 for hours in self.trace['curDeliveryHours']]
+        interval = float(self.parameters['curIntervalHours']) * 3600
+        return [interval * n for n in range(1, int(horizon // interval) + 1)]
+
+    # cost ledger
+
+    def accrued(self, seconds, since=None):
+        """True spend for the month up to ``seconds`` (optionally only since ``since``)."""
+        total = 0.0 if since is not None else self.base_spend
+        for start, stop, rate in self.ledger:
+            end = seconds if stop is None else min(stop, seconds)
+            begin = start if since is None else max(start, since)
+            if end > begin:
+                total += rate * (end - begin) / 3600
+        return total
+
+    def crossing_time(self, low, high):
+        for _ in range(50):
+            middle = (low + high) / 2
+            if self.accrued(middle) >= self.budget_limit:
+                high = middle
+            else:
+                low = middle
+        return high
+
+    def interval_cost(self, begin, end):
+        """Billed spend between two datetimes, as visible at the last CUR delivery."""
+        end = min(end, self.billed_as_of)
+        if end <= begin:
+            return 0.0
+        total = 0.0
+        base_seconds = (self.clock.start - self.month_start).total_seconds()
+        if base_seconds > 0:
+            overlap = (min(end, self.clock.start) - max(begin, self.month_start)).total_seconds()
+            total += self.base_spend * max(0.0, overlap) / base_seconds
+        else:
+            total += self.base_spend if begin <= self.clock.start < end else 0.0
+        offset_begin = (begin - self.clock.start).total_seconds()
+        offset_end = (end - self.clock.start).total_seconds()
+        for start, stop, rate in self.ledger:
+            task_end = offset_end if stop is None else min(stop, offset_end)
+            task_begin = max(start, offset_begin)
+            if task_end > task_begin:
+                total += rate * (task_end - task_begin) / 3600
+        return total
+
+    def cur_report(self):
+        """Gzipped CSV CUR with one ECS line item per task and day, billed up to now."""
+        columns = ['lineItem/UsageStartDate', 'lineItem/ProductCode', 'lineItem/UnblendedCost', 'resourceTags/aws:batch:compute-environment']
+        rows = io.StringIO()
+        writer = csv.writer(rows)
+        writer.writerow(columns)
+        day = self.month_start
+        while day < self.billed_as_of:
+            following = day + datetime.timedelta(days=1)
+            amount = self.interval_cost(day, following)
+            if amount > 0:
+                writer.writerow([day.strftime('%Y-%m-%dT%H:%M:%SZ'), 'AmazonECS', '%.10f' % amount, COMPUTE_ENV_NAME])
+            day = following
+        return gzip.compress(rows.getvalue().encode())
+
+    def billed_cost(self):
+        return self.interval_cost(self.month_start, self.billed_as_of)
+
+    def cost_and_usage(self, start, end, granularity, group_by=None):
+        begin, finish = parse_time(start), parse_time(end)
+        results = []
+        cursor = begin
+        while cursor < finish:
+            if granularity == 'DAILY':
+                following = cursor + datetime.timedelta(days=1)
+            else:
+                following = (cursor.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+            following = min(following, finish)
+            amount = self.interval_cost(cursor, following)
+            results.append({
+                'TimePeriod': {'Start': cursor.strftime('%Y-%m-%d'), 'End': following.strftime('%Y-%m-%d')},
+                'Total': {'UnblendedCost': {'Amount': '%.10f' % amount, 'Unit': 'USD'}},
+                'Groups': [],
+                # as in Cost Explorer, every day of the open billing month is an estimate
+                'Estimated': following > self.month_start
+            })
+            cursor = following
+        return {'ResultsByTime': results}
+
+    # workload
+
+    def submit_from_trace(self, job):
+        try:
+            self.aws.batch.submit_job(
+                jobName=job.get('jobName', f"job-{next(self.ids)}"),
+                jobQueue=job.get('jobQueue', JOB_QUEUE_NAME),
+                jobDefinition=job['jobDefinition'],
+                simulatedDurationSeconds=float(job['durationSeconds'])
+            )
+        except self.aws.batch.exceptions.ClientException:
+            pass   # the queue was disabled by the guardian, the submission is rejected
+
+    def submit(self, job_name, queue_name, job_definition, kwargs):
+        definition = self.job_definitions[job_definition.split('/')[-1].split(':')[0]]
+        job_id = f"{next(self.ids):08d}-0000-4000-8000-000000000000"
+        job = {
+            'jobId': job_id,
+            'jobArn': f"arn:aws:batch:{REGION}:{ACCOUNT_ID}:job/{job_id}",
+            'jobName': job_name,
+            'jobQueue': queue_name,
+            'jobDefinition': definition['jobDefinitionArn'],
+            'status': 'RUNNABLE',
+            'createdAt': self.epoch_millis(),
+            'tags': dict(kwargs.get('tags', {})),
+            'container': {'resourceRequirements': definition['containerProperties']['resourceRequirements']},
+            'simulatedDurationSeconds': kwargs.get('simulatedDurationSeconds', 3600.0)
+        }
+        self.aws.batch.jobs[job_id] = job
+        self.schedule_dispatch()
+        return job
+
+    def schedule_dispatch(self):
+        if not self.dispatch_scheduled:
+            self.dispatch_scheduled = True
+            self.after(0, self.dispatch)
+
+    def dispatch(self):
+        self.dispatch_scheduled = False
+        environment = self.aws.batch.compute_environments[COMPUTE_ENV_NAME]
+        if environment['state'] != 'ENABLED':
+            return
+        in_use = sum(job_vcpu(job) for job in self.aws.batch.jobs.values() if job['status'] in ('STARTING', 'RUNNING'))
+        for job in self.aws.batch.jobs.values():
+            if job['status'] != 'RUNNABLE' or self.aws.batch.job_queues[job['jobQueue']]['state'] != 'ENABLED':
+                continue
+            if in_use + job_vcpu(job) > environment['computeResources']['maxvCpus']:
+                continue
+            in_use += job_vcpu(job)
+            self.start_job(job)
+
+    def start_job(self, job):
+        job['status'] = 'STARTING'
+        vcpu, memory_mib = job_vcpu(job), job_memory_mib(job)
+        task_arn = f"arn:aws:ecs:{REGION}:{ACCOUNT_ID}:task/{self.cluster_arn.split('/')[-1]}/{job['jobId'].replace('-', '')}"
+        job['taskArn'] = task_arn
+        job['ledgerIndex'] = len(self.ledger)
+        self.ledger.append([self.clock.seconds, None, vcpu * VCPU_HOUR_PRICE + memory_mib / 1024 * GB_HOUR_PRICE])
+        self.aws.ecs.tasks[task_arn] = {
+            'taskArn': task_arn,
+            'clusterArn': self.cluster_arn,
+            'taskDefinitionArn': f"arn:aws:ecs:{REGION}:{ACCOUNT_ID}:task-definition/{job['jobDefinition'].split('/')[-1].replace(':', '-')}:1",
+            'cpu': str(int(vcpu * 1024)),
+            'memory': str(int(memory_mib)),
+            'startedBy': job['jobId'],
+            'group': f"family:{job['jobDefinition'].split('/')[-1].split(':')[0]}",
+            'lastStatus': 'PROVISIONING',
+            'desiredStatus': 'RUNNING',
+            'launchType': 'FARGATE',
+            'createdAt': self.clock.now()
+        }
+        self.after(self.parameters['taskStartSeconds'], self.job_running, job['jobId'])
+
+    def job_running(self, job_id):
+        job = self.aws.batch.jobs[job_id]
+        if job['status'] != 'STARTING':
+            return
+        job['status'] = 'RUNNING'
+        job['startedAt'] = self.epoch_millis()
+        task = self.aws.ecs.tasks[job['taskArn']]
+        task['lastStatus'] = 'RUNNING'
+        task['startedAt'] = self.clock.now()
+        self.after(job['simulatedDurationSeconds'], self.finish_job, job_id, 'SUCCEEDED')
+
+    def finish_job(self, job_id, status):
+        job = self.aws.batch.jobs[job_id]
+        if job['status'] not in ('STARTING', 'RUNNING'):
+            return
+        job['status'] = status
+        job['stoppedAt'] = self.epoch_millis()
+        self.ledger[job['ledgerIndex']][1] = self.clock.seconds
+        task = self.aws.ecs.tasks[job['taskArn']]
+        task['lastStatus'] = 'STOPPED'
+        task['desiredStatus'] = 'STOPPED'
+        task['stoppedAt'] = self.clock.now()
+        self.after(self.parameters['eventDelaySeconds'], self.deliver_ecs_event, self.task_state_change_event(task))
+        self.after(self.parameters['eventDelaySeconds'], self.deliver_job_event, self.job_state_change_event(job))
+        self.schedule_dispatch()
+
+    def job_state_change_event(self, job):
+        return {
+            'version': '0',
+            'detail-type': 'Batch Job State Change',
+            'source': 'aws.batch',
+            'account': ACCOUNT_ID,
+            'region': REGION,
+            'time': self.clock.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'detail': {key: job[key] for key in ('jobId', 'jobName', 'jobQueue', 'jobDefinition', 'status', 'statusReason',
+                'createdAt', 'startedAt', 'stoppedAt', 'tags') if key in job}
+        }
+
+    def task_state_change_event(self, task):
+        return {
+            'version': '0',
+            'detail-type': 'ECS Task State Change',
+            'source': 'aws.ecs',
+            'account': ACCOUNT_ID,
+            'region': REGION,
+            'time': self.clock.now().strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'detail': {key: (value.strftime('%Y-%m-%dT%H:%M:%S.%fZ') if isinstance(value, datetime.datetime) else value)
+                for key, value in task.items()}
+        }
+
+    def notify_tagged(self, job):
+        # a job signalled to drain checkpoints its work and exits, unless it finishes first
+        if DRAIN_TAG in job['tags'] and job['status'] in ('STARTING', 'RUNNING') and 'drainSignalledAt' not in job:
+            job['drainSignalledAt'] = self.clock.seconds
+            self.after(self.parameters['checkpointSeconds'], self.finish_job, job['jobId'], 'SUCCEEDED')
+
+    def stop_job(self, job_id, reason, terminate):
+        job = self.aws.batch.jobs.get(job_id)
+        if job is None:
+            return
+        if job['status'] in ('SUBMITTED', 'PENDING', 'RUNNABLE'):
+            job['status'] = 'FAILED'
+            job['statusReason'] = reason
+            self.after(self.parameters['eventDelaySeconds'], self.deliver_job_event, self.job_state_change_event(job))
+        elif terminate and job['status'] in ('STARTING', 'RUNNING'):
+            job['statusReason'] = reason
+            self.aws.ecs.tasks[job['taskArn']]['desiredStatus'] = 'STOPPED'
+            self.after(self.parameters['taskStopSeconds'], self.finish_job, job_id, 'FAILED')
+
+    def running_tasks(self):
+        return [task for task in self.aws.ecs.tasks.values() if task['lastStatus'] != 'STOPPED']
+
+    # event sources
+
+    def deliver_ecs_event(self, event):
+        # the EventBridge rule targets an SQS queue drained in batches by the delete Lambda
+        self.send_message('delete-ecs-task-from-dynamo-lambda-function', event)
+
+    def deliver_job_event(self, event):
+        # Batch job state changes are buffered the same way for the runtime sketches
+        self.send_message('record-job-runtimes-lambda-function', event)
+
+    def send_message(self, function_name, event):
+        queue = self.sqs_queues[function_name]
+        self.aws.meter.call('sqs', 'SendMessage')
+        queue.append({'messageId': f"{next(self.ids):08d}-sqs", 'body': json.dumps(event)})
+        if len(queue) % SQS_BATCH_SIZE == 0:
+            self.after(0, self.deliver_sqs_batch, function_name)
+        elif not self.sqs_poll_scheduled.get(function_name):
+            self.sqs_poll_scheduled[function_name] = True
+            self.after(self.parameters['sqsBatchWindowSeconds'], self.deliver_sqs_batch, function_name)
+
+    def deliver_sqs_batch(self, function_name):
+        self.sqs_poll_scheduled[function_name] = False
+        queue = self.sqs_queues[function_name]
+        batch = queue[:SQS_BATCH_SIZE]
+        if not batch:
+            return
+        del queue[:len(batch)]
+        self.aws.meter.call('sqs', 'ReceiveMessage')
+        try:
+            result = self.invoke(function_name, {'Records': batch})
+            failed = {failure['itemIdentifier'] for failure in result.get('batchItemFailures', [])}
+        except Exception:
+            failed = {message['messageId'] for message in batch}
+        if len(failed) < len(batch):
+            self.aws.meter.call('sqs', 'DeleteMessageBatch')
+        if failed:
+            self.after(self.parameters['sqsVisibilitySeconds'], self.requeue_messages, function_name,
+                [message for message in batch if message['messageId'] in failed])
+        if queue and not self.sqs_poll_scheduled.get(function_name):
+            self.sqs_poll_scheduled[function_name] = True
+            self.after(0, self.deliver_sqs_batch, function_name)
+
+    def requeue_messages(self, function_name, messages):
+        self.sqs_queues[function_name].extend(messages)
+        if not self.sqs_poll_scheduled.get(function_name):
+            self.sqs_poll_scheduled[function_name] = True
+            self.after(0, self.deliver_sqs_batch, function_name)
+
+    def check_running_jobs(self):
+        # the EventBridge schedule fires whether or not caps or queue budgets are configured
+        self.invoke_async('check-running-batch-jobs-lambda-function', {})
+        self.after(self.parameters['runningJobCheckIntervalMinutes'] * 60, self.check_running_jobs)
+
+    def deliver_cur(self):
+        self.invoke_async('month-to-date-batch-spend-checker', self.publish_cur())
+
+    def publish_cur(self):
+        """Write a CUR delivery billed up to now and return its S3 notification."""
+        self.billed_as_of = self.clock.now()
+        next_month = (self.month_start + datetime.timedelta(days=32)).replace(day=1)
+        # standard layout: <report>/<billing period>/<assemblyId>/ files, the manifest in the billing period
+        period = f"reports/sim-cur/{self.month_start:%Y%m%d}-{next_month:%Y%m%d}"
+        assembly = sum(1 for _, key in self.aws.s3.objects if key.endswith('.csv.gz')) + 1
+        key = f"{period}/{assembly:08d}/sim-cur-00001.csv.gz"
+        self.aws.s3.put('sim-cur-bucket', key, self.cur_report())
+        self.aws.s3.put('sim-cur-bucket', f"{period}/sim-cur-Manifest.json", json.dumps({'reportKeys': [key]}).encode())
+        return {'Records': [{
+            'eventSource': 'aws:s3',
+            'eventName': 'ObjectCreated:Put',
+            's3': {'bucket': {'name': 'sim-cur-bucket'}, 'object': {'key': key}}
+        }]}
+
+    def poll_streams(self):
+        for table in self.aws.dynamodb.tables.values():
+            if table.stream_records and table.name in self.stream_consumers and not self.stream_poll_scheduled.get(table.name):
+                self.stream_poll_scheduled[table.name] = True
+                self.after(self.parameters['streamDelaySeconds'], self.deliver_stream_batch, table)
+
+    def deliver_stream_batch(self, table):
+        self.stream_poll_scheduled[table.name] = False
+        batch = table.stream_records[:100]
+        try:
+            self.invoke(self.stream_consumers[table.name], {'Records': batch})
+            del table.stream_records[:len(batch)]
+        except Exception:
+            pass   # records stay at the head of the shard and are retried on the next poll
+        self.poll_streams()
+
+    def invoke_async(self, function_name, event):
+        try:
+            self.invoke(function_name, event)
+        except Exception:
+            pass   # already recorded by invoke
+
+    def invoke(self, function_name, event):
+        calls_before = self.aws.meter.total_calls()
+        output = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(output):
+                result = self.handlers[function_name](json.loads(json.dumps(event, default=str)), None)
+            return json.loads(json.dumps(result, default=str))
+        except Exception as error:
+            self.errors.append({'at': self.clock.seconds, 'function': function_name,
+                'error': ''.join(traceback.format_exception_only(type(error), error)).strip()})
+            raise
+        finally:
+            calls = self.aws.meter.total_calls() - calls_before
+            duration = self.parameters['lambdaOverheadSeconds'] + calls * self.parameters['apiLatencySeconds'] + self.clock.offset
+            self.last_duration = duration
+            self.lambda_invocations += 1
+            self.lambda_gb_seconds += math.ceil(duration * 1000) / 1000 * self.parameters['lambdaMemoryMb'] / 1024
+            self.collect_metrics(output.getvalue())
+            self.clock.offset = 0.0
+            self.poll_streams()
+
+    def collect_metrics(self, output):
+        # Embedded Metric Format lines printed by the handlers
+        for line in output.splitlines():
+            if line.startswith('{') and '"_aws"' in line:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                for directive in record['_aws'].get('CloudWatchMetrics', []):
+                    for metric in directive.get('Metrics', []):
+                        self.metrics.append({'at': self.clock.seconds, 'name': metric['Name'], 'value': record.get(metric['Name'])})
+
+    # state machine
+
+    def start_execution(self, state_machine_arn, execution_input):
+        execution = {
+            'executionArn': f"{state_machine_arn.replace(':stateMachine:', ':execution:')}:{len(self.executions) + 1}",
+            'status': 'RUNNING',
+            'startedAt': self.clock.seconds
+        }
+        self.executions.append(execution)
+        self.after(0, self.enter_state, execution, self.definition()['StartAt'], execution_input)
+        return execution['executionArn']
+
+    def definition(self):
+        """Interpretation of the state machine built in ServerlessBatchCostGuardianStack."""
+        return {
+            'StartAt': 'guardian-startup',
+            'States': {
+                'guardian-startup': {'Type': 'Parallel', 'OutputPath': 2, 'Next': 'first_check_budget_met_choice_state', 'Branches': [
+                    {'StartAt': 'stop-new-batch-job-submissions', 'States': {
+                        'stop-new-batch-job-submissions': {'Type': 'Task', 'Function': 'stop-new-jobs-lambda-function', 'End': True}}},
+                    {'StartAt': 'write-batch-ecs-tasks-to-dynamo', 'States': {
+                        'write-batch-ecs-tasks-to-dynamo': {'Type': 'Task', 'Function': 'write-tasks-to-dynamo-lambda-function', 'End': True}}},
+                    {'StartAt': 'initialize-start-time-and-cost', 'States': {
+                        'initialize-start-time-and-cost': {'Type': 'PutItem', 'Table': 'sim-latest-timestamp-running-cost-table',
+                            'Item': lambda data: {'partition-key': 'pk', 'latestTimeStamp': data['startTime'], 'runningCost': data['startCost'],
+                                'budgetLimit': data['budgetLimit']},
+                            'Next': 'first-spend-check'},
+                        'first-spend-check': {'Type': 'Task', 'Function': 'high-velocity-batch-spend-checker-lambda-function',
+                            'Payload': lambda data: {'startTime': data['startTime'], 'startCost': data['startCost'],
+                                'budgetLimit': data['budgetLimit'], 'firstCheck': True},
+                            'Next': 'first_check_choice_state'},
+                        'first_check_choice_state': {'Type': 'Choice', 'Choices': [
+                            (lambda data: data.get('budgetMet') == 'YES', 'first-stop-running-batch-jobs'),
+                            (lambda data: data.get('actionsRequired') == 'YES', 'first-dispatch-guardian-actions')],
+                            'Default': 'first-check-no-action'},
+                        'first-stop-running-batch-jobs': {'Type': 'Task', 'Function': 'stop-running-batch-jobs-lambda-function',
+                            'ResultPath': 'stopResult', 'End': True},
+                        'first-dispatch-guardian-actions': {'Type': 'Task', 'Function': 'guardian-actions-lambda-function',
+                            'ResultPath': 'actionsResult', 'End': True},
+                        'first-check-no-action': {'Type': 'Pass', 'End': True}}}]},
+                'first_check_budget_met_choice_state': {'Type': 'Choice', 'Choices': [
+                    (lambda data: data.get('budgetMet') == 'YES', 'budget-met-on-first-check')],
+                    'Default': 'Wait'},
+                'budget-met-on-first-check': {'Type': 'Succeed', 'End': True},
+                'budget_met_choice_state': {'Type': 'Choice', 'Choices': [
+                    (lambda data: data.get('budgetMet') == 'YES', 'stop-running-batch-jobs'),
+                    (lambda data: data.get('actionsRequired') == 'YES', 'dispatch-guardian-actions'),
+                    (lambda data: data.get('budgetMet') == 'NO', 'Wait')]},
+                'dispatch-guardian-actions': {'Type': 'Task', 'Function': 'guardian-actions-lambda-function',
+                    'ResultPath': 'actionsResult', 'Next': 'Wait'},
+                'Wait': {'Type': 'Wait', 'Seconds': lambda data: float(data['waitSeconds']), 'Next': 'high-velocity-batch-spend-checker'},
+                'high-velocity-batch-spend-checker': {'Type': 'Task', 'Function': 'high-velocity-batch-spend-checker-lambda-function',
+                    'Next': 'budget_met_choice_state'},
+                'stop-running-batch-jobs': {'Type': 'Task', 'Function': 'stop-running-batch-jobs-lambda-function', 'End': True}
+            }
+        }
+
+    def enter_state(self, execution, name, data, machine=None, done=None):
+        # machine is the (branch) definition being run, done receives its output when it ends
+        if execution['status'] != 'RUNNING':
+            return
+        machine = machine or self.definition()
+        self.transitions += 1
+        state = machine['States'][name]
+        delay, output = 0.0, data
+        try:
+            if name in FIRST_ACTION_STATES:
+                execution.setdefault('firstActionAt', self.clock.seconds)
+            if state['Type'] == 'Task':
+                output = self.invoke(state['Function'], state['Payload'](data) if 'Payload' in state else data)
+                delay = self.last_duration
+                self.observe(name, output)
+                if 'ResultPath' in state:
+                    output = dict(data, **{state['ResultPath']: output})
+            elif state['Type'] == 'PutItem':
+                self.aws.dynamodb.Table(state['Table']).put_item(Item=state['Item'](data))
+            elif state['Type'] == 'Wait':
+                delay = state['Seconds'](output)
+            elif state['Type'] == 'Parallel':
+                self.start_branches(execution, state, data, machine, done)
+                return
+            elif state['Type'] == 'Choice':
+                for matches, target in state['Choices']:
+                    if matches(data):
+                        self.after(0, self.enter_state, execution, target, data, machine, done)
+                        return
+                if 'Default' in state:
+                    self.after(0, self.enter_state, execution, state['Default'], data, machine, done)
+                    return
+                raise RuntimeError(f"No choice rule matched in {name}")
+        except Exception:
+            execution['status'] = 'FAILED'
+            return
+        if state.get('End'):
+            self.after(delay, self.end_machine, execution, output, done)
+            return
+        self.after(delay, self.enter_state, execution, state['Next'], output, machine, done)
+
+    def start_branches(self, execution, state, data, machine, done):
+        outputs = [None] * len(state['Branches'])
+        remaining = [len(state['Branches'])]
+
+        def branch_done(index, output):
+            outputs[index] = output
+            remaining[0] -= 1
+            if remaining[0] == 0:
+                result = outputs if 'OutputPath' not in state else outputs[state['OutputPath']]
+                self.after(0, self.enter_state, execution, state['Next'], result, machine, done)
+
+        for index, branch in enumerate(state['Branches']):
+            self.after(0, self.enter_state, execution, branch['StartAt'], data, branch,
+                lambda output, index=index: branch_done(index, output))
+
+    def end_machine(self, execution, output, done):
+        if execution['status'] != 'RUNNING':
+            return
+        if done is None:
+            execution['status'] = 'SUCCEEDED'
+        else:
+            done(output)
+
+    def observe(self, state_name, output):
+        if state_name in ('first-spend-check', 'high-velocity-batch-spend-checker') and output.get('budgetMet') == 'YES':
+            self.detected_at = self.detected_at if self.detected_at is not None else self.clock.seconds
+        if state_name in ('first-spend-check', 'high-velocity-batch-spend-checker'):
+            self.backlog_forecast = max(self.backlog_forecast, float(output.get('backlogCost') or 0.0))
+        for action in output.get('actions', []) if state_name in ('first-spend-check', 'high-velocity-batch-spend-checker') else []:
+            if 'percent' in action:
+                self.escalations.append({'at': self.clock.seconds, 'percent': action['percent'], 'action': action['action']})
+        if state_name in ('stop-running-batch-jobs', 'first-stop-running-batch-jobs'):
+            self.terminate_issued_at = self.terminate_issued_at if self.terminate_issued_at is not None else self.clock.seconds
+
+    # reporting
+
+    def epoch_millis(self):
+        return int(self.clock.now().timestamp() * 1000)
+
+    def lost_job_hours(self):
+        # runtime of the jobs terminated while running, to be computed again when they rerun
+        return sum((job['stoppedAt'] - job['startedAt']) / 3600000 for job in self.aws.batch.jobs.values()
+            if job['status'] == 'FAILED' and 'startedAt' in job and job.get('statusReason', '').startswith(('nuke-jobs', 'job-cost-cap-reached')))
+
+    def guardian_cost(self):
+        meter = self.aws.meter
+        breakdown = {
+            'lambda': self.lambda_invocations * PRICES['lambda_request'] + self.lambda_gb_seconds * PRICES['lambda_gb_second'],
+            'stepfunctions': self.transitions * PRICES['state_transition'],
+            'dynamodb': meter.write_units * PRICES['dynamodb_write_unit'] + meter.read_units * PRICES['dynamodb_read_unit'],
+            'costexplorer': sum(count for (service, _), count in meter.calls.items() if service == 'ce') * PRICES['ce_request'],
+            'sns': sum(count for (service, _), count in meter.calls.items() if service == 'sns') * PRICES['sns_publish'],
+            'cloudwatch': meter.calls[('cloudwatch', 'PutMetricData')] * PRICES['cloudwatch_put_metric_data'],
+            's3': meter.calls[('s3', 'GetObject')] * PRICES['s3_get'] + meter.calls[('s3', 'ListObjectsV2')] * PRICES['s3_list'],
+            'sqs': sum(count for (service, _), count in meter.calls.items() if service == 'sqs') * PRICES['sqs_request']
+        }
+        return sum(breakdown.values()), breakdown
+
+    def report(self):
+        final_cost = self.accrued(self.clock.seconds)
+        guardian_cost, breakdown = self.guardian_cost()
+        stopped = [stop for _, stop, _ in self.ledger if stop is not None]
+        last_stop = max(stopped) if stopped and not self.running_tasks() else None
+        return {
+            'parameters': {key: self.parameters[key] for key in ('waitTime', 'desiredBudgetThresholdPercent', 'curIntervalHours', 'spendSourceOrder', 'costExplorerMode', 'anomalyAction', 'startOnProjection', 'jobCostCaps', 'runningJobCheckIntervalMinutes', 'queueBudgets', 'escalationPolicy', 'rateGovernorLimits', 'drainGraceSeconds')},
+            'budgetLimit': self.budget_limit,
+            'finalCost': round(final_cost, 4),
+            'overshootUsd': round(max(0.0, final_cost - self.budget_limit), 4),
+            'guardianStartedAt': self.executions[0]['startedAt'] if self.executions else None,
+            'budgetCrossedAt': self.crossed_at,
+            'detectedAt': self.detected_at,
+            'detectionLatencySeconds': None if self.crossed_at is None or self.detected_at is None else self.detected_at - self.crossed_at,
+            'timeToFirstActionSeconds': next((execution['firstActionAt'] - execution['startedAt'] for execution in self.executions
+                if 'firstActionAt' in execution), None),
+            'terminateIssuedAt': self.terminate_issued_at,
+            'cappedJobs': sum(1 for job in self.aws.batch.jobs.values() if job.get('statusReason') == 'job-cost-cap-reached'),
+            'stoppedQueues': sorted({job['jobQueue'] for job in self.aws.batch.jobs.values() if job.get('statusReason') == 'nuke-jobs-queue-budget-met'}),
+            'escalations': self.escalations,
+            'maxBacklogForecastUsd': round(self.backlog_forecast, 4),
+            'cancelledJobs': sum(1 for job in self.aws.batch.jobs.values() if job.get('statusReason') == 'nuke-jobs-escalation-cancel-queued'),
+            'drainedJobs': sum(1 for job in self.aws.batch.jobs.values() if 'drainSignalledAt' in job and job['status'] == 'SUCCEEDED'),
+            'lostJobHours': round(self.lost_job_hours(), 4),
+            'lastTaskStoppedAt': last_stop if self.terminate_issued_at is not None else None,
+            'simulatedSeconds': self.clock.seconds,
+            'executions': [dict(execution) for execution in self.executions],
+            'guardianCostUsd': round(guardian_cost, 6),
+            'guardianCostBreakdown': {key: round(value, 6) for key, value in breakdown.items()},
+            'stateTransitions': self.transitions,
+            'lambdaInvocations': self.lambda_invocations,
+            'apiCalls': {f"{service}:{operation}": count for (service, operation), count in sorted(self.aws.meter.calls.items())},
+            'metrics': summarize_metrics(self.metrics),
+            'errors': self.errors
+        }
+
+
+def summarize_metrics(metrics):
+    """Distribution of every Embedded Metric Format metric the handlers published."""
+    values = {}
+    for metric in metrics:
+        values.setdefault(metric['name'], []).append(float(metric['value']))
+    summary = {}
+    for name, series in values.items():
+        series.sort()
+        summary[name] = {
+            'count': len(series),
+            'min': series[0],
+            'p50': series[len(series) // 2],
+            'p90': series[min(len(series) - 1, int(len(series) * 0.9))],
+            'max': series[-1]
+        }
+    return summary
+
+
+def job_vcpu(job):
+    return float(resource_value(job['container']['resourceRequirements'], 'VCPU'))
+
+
+def job_memory_mib(job):
+    return float(resource_value(job['container']['resourceRequirements'], 'MEMORY'))
+
+
+def resource_value(requirements, resource_type):
+    return next(requirement['value'] for requirement in requirements if requirement['type'] == resource_type)
+
+
+def build_job_definitions(definitions):
+    built = {}
+    for name, spec in definitions.items():
+        built[name] = {
+            'jobDefinitionName': name,
+            'jobDefinitionArn': f"arn:aws:batch:{REGION}:{ACCOUNT_ID}:job-definition/{name}:1",
+            'revision': 1,
+            'status': 'ACTIVE',
+            'type': 'container',
+            'platformCapabilities': ['FARGATE'],
+            'containerProperties': {'resourceRequirements': [
+                {'type': 'VCPU', 'value': str(spec['vcpu'])},
+                {'type': 'MEMORY', 'value': str(int(float(spec['memoryGb']) * 1024))}
+            ]},
+            'tags': dict(spec.get('tags', {}))
+        }
+    return built
+
+
+def parse_time(value):
+    if isinstance(value, datetime.datetime):
+        return value
+    value = value.rstrip('Z')
+    for pattern in ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%d'):
+        try:
+            return datetime.datetime.strptime(value, pattern)
+        except ValueError:
+            continue
+    raise ValueError(f"Unrecognized time {value!r}")
+
+
+def synthetic_trace(seed=0, hours=48, jobs_per_hour=6, budget_limit=500.0, month_to_date_spend=300.0,
+        start='2022-10-20T00:00:00', vcpu_choices=(1, 2, 4, 8, 16), mean_duration_hours=6.0, job_queues=()):
+    """Poisson job arrivals with exponential runtimes over a handful of job definitions.
+
+    With job_queues, jobs are spread over those extra queues and the guardian's own queue."""
+    generator = random.Random(seed)
+    definitions = {f"sim-{vcpu}vcpu": {'vcpu': vcpu, 'memoryGb': vcpu * 2} for vcpu in vcpu_choices}
+    jobs = []
+    seconds = 0.0
+    while True:
+        seconds += generator.expovariate(jobs_per_hour / 3600)
+        if seconds > hours * 3600:
+            break
+        jobs.append({
+            'submitAt': round(seconds, 1),
+            'jobDefinition': generator.choice(list(definitions)),
+            'durationSeconds': round(generator.expovariate(1 / (mean_duration_hours * 3600)), 1)
+        })
+        if job_queues:
+            jobs[-1]['jobQueue'] = generator.choice([JOB_QUEUE_NAME] + list(job_queues))
+    return {
+        'start': start,
+        'budgetLimit': budget_limit,
+        'monthToDateSpend': month_to_date_spend,
+        'jobDefinitions': definitions,
+        'jobQueues': list(job_queues),
+        'jobs': jobs
+    }
+
+
+def trace_from_batch_jobs(jobs, budget_limit, month_to_date_spend=0.0):
+    """Build a trace from recorded Batch DescribeJobs output (times in epoch milliseconds)."""
+    recorded = [job for job in jobs if job.get('startedAt') and job.get('stoppedAt')]
+    first = min(job['createdAt'] for job in recorded)
+    definitions = {}
+    trace_jobs = []
+    for job in sorted(recorded, key=lambda job: job['createdAt']):
+        name = job['jobDefinition'].split('/')[-1].split(':')[0]
+        requirements = job['container']['resourceRequirements']
+        definitions[name] = {'vcpu': float(resource_value(requirements, 'VCPU')),
+            'memoryGb': float(resource_value(requirements, 'MEMORY')) / 1024}
+        trace_jobs.append({
+            'submitAt': (job['createdAt'] - first) / 1000,
+            'jobDefinition': name,
+            'durationSeconds': (job['stoppedAt'] - job['startedAt']) / 1000
+        })
+    return {
+        'start': datetime.datetime.utcfromtimestamp(first / 1000).strftime('%Y-%m-%dT%H:%M:%S'),
+        'budgetLimit': budget_limit,
+        'monthToDateSpend': month_to_date_spend,
+        'jobDefinitions': definitions,
+        'jobs': trace_jobs
+    }
+
+
+def run_simulation(trace, parameters=None):
+    return Simulation(trace, parameters).run()
+
+
+def sweep(trace, grid, workers=None):
+    """Run every combination of the parameter grid, one simulation per core at a time."""
+    names = sorted(grid)
+    combinations = [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return list(executor.map(run_simulation, itertools.repeat(trace), combinations))
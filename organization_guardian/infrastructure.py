@@ -0,0 +1,205 @@
+# Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy of
+# this software and associated documentation files (the "Software"), to deal in
+# the Software without restriction, including without limitation the rights to
+# use, copy, modify, merge, publish, distribute, sublicense, and/or sell copies of
+# the Software, and to permit persons to whom the Software is furnished to do so.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY, FITNESS
+# FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE AUTHORS OR
+# COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY, WHETHER
+# IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM, OUT OF OR IN
+# CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE SOFTWARE.
+
+import aws_cdk as core
+from constructs import Construct
+from aws_cdk import aws_lambda as lambda_ # lambda is system reserved name
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_dynamodb as dynamodb
+from aws_cdk import aws_events as aws_events
+from aws_cdk import aws_events_targets as aws_targets
+from aws_cdk import aws_sns as sns
+from aws_cdk import aws_sns_subscriptions as subscriptions
+from aws_cdk import aws_kms as kms
+from cdk_common.function_settings import function_settings
+from cdk_common.bundling import function_code
+
+# Management account stack: a registry of member account targets (account, region, Batch
+# compute environment) checked on a schedule by one Lambda that assumes a role in each
+# member account. The member role stack is deployed in every member account (e.g. with
+# CloudFormation StackSets) and trusts only that Lambda's role.
+
+ORGANIZATION_STACK_PREFIX = "serverless-batch-cost-guardian-organization"
+
+MANAGEMENT_LAMBDA_IAM_ROLE_NAME = "organization-guardian-lambda-iam-role"
+MEMBER_ROLE_NAME = "serverless-batch-cost-guardian-member-role"
+
+class OrganizationGuardianStack(core.Stack):
+
+    def __init__(self, scope: Construct, id: str, **kwargs) -> None:
+        super().__init__(scope, id, **kwargs)
+        
+        # KMS CMK for SNS Topic SSE at rest
+        kms_key = kms.Key(self, "OrganizationSnsKmsKey",
+            enable_key_rotation=True,
+            pending_window=core.Duration.days(7),
+            removal_policy=core.RemovalPolicy.DESTROY,
+            alias="alias/organization_sns_kms_key",
+            description='KMS key for encrypting organization guardian SNS topic messages at rest',
+        )
+        
+        # SNS Topic and Subscription for the rolled up report
+        sns_email = core.CfnParameter(self, 'snsEmail',
+          type='String',
+          description='email for the organization-wide Batch spend report'
+        )
+        
+        sns_topic = sns.Topic(self, ORGANIZATION_STACK_PREFIX + "-sns-topic",
+          display_name="SNS Organization Batch Spend Topic",
+          master_key=kms_key
+        )
+        
+        topic_policy = sns.TopicPolicy(self, "TopicPolicy",
+            topics=[sns_topic]
+        )
+        
+        # Ensure encryption in transit 
+        topic_policy.document.add_statements(iam.PolicyStatement(
+            actions=["SNS:Publish"],
+            effect=iam.Effect.DENY,
+            principals=[iam.AnyPrincipal()],
+            resources=[sns_topic.topic_arn],
+            conditions={"Bool": {
+              "aws:SecureTransport": "false"}}
+        ))
+
+        sns_topic.add_subscription(subscriptions.EmailSubscription(sns_email.value_as_string))
+        
+        # DynamoDB Registry Table (one item per account/region/compute environment target)
+        registry_table = dynamodb.Table(self, "organization-registry-table",
+            partition_key=dynamodb.Attribute(name="targetId", type=dynamodb.AttributeType.STRING)
+        )
+        
+        # Input Parameters as Lambda Environment Variables
+        desired_budget_threshold_percent = core.CfnParameter(self, 'desiredBudgetThresholdPercent',
+          type='String',
+          default='80',
+          description='Budget threshold at which new Batch submissions are stopped in a member account (overridable per target).'
+        )
+        
+        enforcement_mode = core.CfnParameter(self, 'enforcementMode',
+          type='String',
+          default='TERMINATE',
+          allowed_values=['REPORT', 'STOP_NEW', 'TERMINATE'],
+          description='REPORT only reports, STOP_NEW disables the compute environment and job queue at the threshold, TERMINATE also terminates running jobs once the Budget is met.'
+        )
+        
+        max_concurrency = core.CfnParameter(self, 'maxConcurrency',
+          type='Number',
+          default=10,
+          description='Member account targets checked concurrently.'
+        )
+        
+        check_interval_minutes = core.CfnParameter(self, 'checkIntervalMinutes',
+          type='Number',
+          default=60,
+          min_value=2,
+          # the rate expression pluralizes the unit, so 1 would render as 'rate(1 minutes)'
+          description='Minutes between organization-wide checks (at least 2).'
+        )
+        
+        # Organization Guardian Lambda IAM Role
+        organization_guardian_lambda_role = iam.Role(scope=self, id='organization-guardian-lambda-iam-role',
+            assumed_by = iam.ServicePrincipal('lambda.amazonaws.com'),
+            role_name=MANAGEMENT_LAMBDA_IAM_ROLE_NAME,
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole') 
+            ])
+        
+        # Scoped down customer managed policy to allow Lambda access to the registry, SNS and the member account roles
+        organization_guardian_lambda_role.attach_inline_policy(iam.Policy(self, "registry-sns-assume-role-policy",
+            statements=[iam.PolicyStatement(
+                actions=["dynamodb:Scan"],
+                resources=[registry_table.table_arn]),
+                iam.PolicyStatement(
+                actions=["sns:Publish"],
+                resources=[sns_topic.topic_arn]),
+                iam.PolicyStatement(
+                actions=[
+                  "kms:GenerateDataKey",
+                  "kms:Decrypt"
+                ],
+                resources=[kms_key.key_arn]),
+                iam.PolicyStatement(
+                actions=["sts:AssumeRole"],
+                resources=["arn:aws:iam::*:role/" + MEMBER_ROLE_NAME])]
+            ))
+        
+        organization_guardian_lambda_role.node.add_dependency(registry_table)
+        organization_guardian_lambda_role.node.add_dependency(sns_topic)
+        
+        # Organization Guardian Lambda Function
+        organization_guardian_lambda_function = lambda_.Function(
+            self, 'organization-guardian-lambda-function',
+            code=function_code(self, 'organization-guardian-lambda-function', './organization_guardian/lambdas', 'organization_guardian.lambda_handler'),
+            handler='organization_guardian.lambda_handler',
+            role=organization_guardian_lambda_role,
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'organization-guardian-lambda-function'),
+            environment={
+                'REGISTRY_TABLE_NAME': registry_table.table_name,
+                'SNS_ARN': sns_topic.topic_arn,
+                'MEMBER_ROLE_NAME': MEMBER_ROLE_NAME,
+                'DESIRED_BUDGET_THRESHOLD_PERCENT': desired_budget_threshold_percent.value_as_string,
+                'ENFORCEMENT_MODE': enforcement_mode.value_as_string,
+                'MAX_CONCURRENCY': max_concurrency.value_as_string
+            }
+        )
+        
+        organization_guardian_lambda_function.node.add_dependency(organization_guardian_lambda_role)
+        
+        # EventBridge Schedule for the organization-wide check
+        organization_guardian_schedule_rule = aws_events.Rule(self, "organization-guardian-schedule-rule",
+            schedule=aws_events.Schedule.rate(core.Duration.minutes(check_interval_minutes.value_as_number))
+        )
+        
+        organization_guardian_schedule_rule.add_target(aws_targets.LambdaFunction(organization_guardian_lambda_function))
+
+class OrganizationMemberRoleStack(core.Stack):
+
+    def __init__(self, scope: Construct, id: str, **kwargs) -> None:
+        super().__init__(scope, id, **kwargs)
+        
+        management_account_id = core.CfnParameter(self, 'managementAccountId',
+          type='String',
+          description='AWS Account ID of the account running the organization guardian stack.'
+        )
+        
+        # Member Role assumed by the organization guardian Lambda only
+        member_role = iam.Role(scope=self, id='organization-guardian-member-iam-role',
+            assumed_by=iam.ArnPrincipal('arn:aws:iam::' + management_account_id.value_as_string + ':role/' + MANAGEMENT_LAMBDA_IAM_ROLE_NAME),
+            role_name=MEMBER_ROLE_NAME
+            )
+        
+        # Scoped down customer managed policy to allow reading Budgets and enforcing them on Batch
+        member_role.attach_inline_policy(iam.Policy(self, "budgets-batch-policy",
+            statements=[iam.PolicyStatement(
+                actions=["budgets:ViewBudget"],
+                resources=['arn:aws:budgets::' + core.Aws.ACCOUNT_ID + ':budget/*']),
+                iam.PolicyStatement(
+                actions=[
+                  "batch:UpdateComputeEnvironment",
+                  "batch:UpdateJobQueue",
+                  "batch:TerminateJob"
+                ],
+                resources=[
+                    'arn:aws:batch:*:' + core.Aws.ACCOUNT_ID + ':compute-environment/*',
+                    'arn:aws:batch:*:' + core.Aws.ACCOUNT_ID + ':job-queue/*',
+                    'arn:aws:batch:*:' + core.Aws.ACCOUNT_ID + ':job/*'
+                ]),
+                iam.PolicyStatement(
+                actions=["batch:ListJobs", "batch:DescribeJobQueues"],
+                resources=["*"])]
+            ))
@@ -0,0 +1,173 @@
+import json
+import boto3
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import sts_sessions
+
+# Management account mode: checks the Batch budget of every registered member account
+# target (account, region, compute environment) concurrently and enforces it there:
+# new submissions are stopped at the target's threshold and running jobs are terminated
+# once the budget is met. Results are rolled up into one report.
+
+dynamodb_resource = boto3.resource('dynamodb')
+registry_table = dynamodb_resource.Table(os.environ['REGISTRY_TABLE_NAME'])
+sns_client = boto3.client('sns')
+session_cache = sts_sessions.SessionCache(boto3.client('sts'), 'serverless-batch-cost-guardian')
+
+max_concurrency = int(os.environ.get('MAX_CONCURRENCY', '10'))
+enforcement_mode = os.environ.get('ENFORCEMENT_MODE', 'TERMINATE')
+default_threshold_percent = float(os.environ.get('DESIRED_BUDGET_THRESHOLD_PERCENT', '80'))
+default_role_name = os.environ['MEMBER_ROLE_NAME']
+statuses = ['SUBMITTED','PENDING','RUNNABLE','STARTING','RUNNING']
+
+def lambda_handler(event, context):
+
+    started = time.time()
+    targets = registry_targets()
+
+    # one worker per target up to max_concurrency: runtime grows with targets / concurrency
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(targets)))) as executor:
+        results = list(executor.map(check_target, targets))
+
+    report = rollup(results, time.time() - started)
+    print(json.dumps(report, default=str))
+
+    sns_client.publish(
+        TopicArn=os.environ['SNS_ARN'],
+        Subject="AWS Batch Spend across the Organization.",
+        Message=report_message(report)
+    )
+
+    return report
+
+def registry_targets():
+    targets = []
+    kwargs = {}
+    while True:
+        response = registry_table.scan(**kwargs)
+        targets.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return [target for target in targets if target.get('enabled', True)]
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def check_target(target):
+    started = time.time()
+    result = {
+        'targetId': target['targetId'],
+        'accountId': target['accountId'],
+        'region': target['region'],
+        'computeEnvName': target['computeEnvName'],
+        'actions': []
+    }
+    try:
+        session = session_cache.session(target['accountId'], target.get('roleName', default_role_name), target['region'])
+
+        budgets_client = session.client('budgets')
+        response = budgets_client.describe_budget(
+            AccountId=target['accountId'],
+            BudgetName=target['budgetName']
+        )
+        budget_limit = float(response['Budget']['BudgetLimit']['Amount'])
+        actual_spend = float(response['Budget'].get('CalculatedSpend', {}).get('ActualSpend', {}).get('Amount', 0))
+        if budget_limit > 0:
+            percent_used = 100 * actual_spend / budget_limit
+        else:
+            # a zero spend Budget is met by any spend at all
+            percent_used = 100.0 if actual_spend > 0 else 0.0
+        threshold = float(target.get('desiredBudgetThresholdPercent', default_threshold_percent))
+        result.update(budgetLimit=budget_limit, actualSpend=actual_spend, percentUsed=round(percent_used, 2))
+
+        if percent_used >= 100:
+            result['status'] = 'BUDGET_MET'
+        elif percent_used >= threshold:
+            result['status'] = 'THRESHOLD_REACHED'
+        else:
+            result['status'] = 'OK'
+
+        if result['status'] != 'OK' and enforcement_mode in ('STOP_NEW', 'TERMINATE'):
+            batch_client = session.client('batch')
+            stop_new_submissions(batch_client, target)
+            result['actions'].append('STOP_NEW')
+            if result['status'] == 'BUDGET_MET' and enforcement_mode == 'TERMINATE':
+                result['terminatedJobs'] = terminate_jobs(batch_client, target)
+                result['actions'].append('TERMINATE')
+    except Exception as e:
+        # one unreachable account must not hide the others from the report
+        print(f"Target {target['targetId']} failed: {e}")
+        result['status'] = 'ERROR'
+        result['error'] = str(e)
+    result['durationSeconds'] = round(time.time() - started, 3)
+    return result
+
+def stop_new_submissions(batch_client, target):
+    batch_client.update_compute_environment(
+        computeEnvironment=target['computeEnvName'],
+        state='DISABLED'
+    )
+    if target.get('jobQueueName'):
+        batch_client.update_job_queue(
+            jobQueue=target['jobQueueName'],
+            state='DISABLED'
+        )
+
+def terminate_jobs(batch_client, target):
+    # every job queue sharing the compute environment runs on the budget being enforced,
+    # as in single account mode
+    terminated_jobs = 0
+    job_queues = compute_environment_queues(batch_client, target['computeEnvName'])
+    if target.get('jobQueueName'):
+        job_queues.add(target['jobQueueName'])
+    paginator = batch_client.get_paginator('list_jobs')
+    for job_queue in sorted(job_queues):
+        for status in statuses:
+            for page in paginator.paginate(jobQueue=job_queue, jobStatus=status):
+                for x in page['jobSummaryList']:
+                    batch_client.terminate_job(
+                        jobId=x['jobId'],
+                        reason='nuke-jobs-budget-met'
+                    )
+                    terminated_jobs += 1
+    return terminated_jobs
+
+def compute_environment_queues(batch_client, compute_env_name):
+    # names of the job queues placing jobs on the compute environment
+    job_queues = set()
+    paginator = batch_client.get_paginator('describe_job_queues')
+    for page in paginator.paginate():
+        for job_queue in page['jobQueues']:
+            if any(order['computeEnvironment'].split('/')[-1] == compute_env_name for order in job_queue['computeEnvironmentOrder']):
+                job_queues.add(job_queue['jobQueueName'])
+    return job_queues
+
+def rollup(results, elapsed_seconds):
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    checked = [result for result in results if result['status'] != 'ERROR']
+    return {
+        'targets': len(results),
+        'statusCounts': counts,
+        'totalActualSpend': round(sum(result['actualSpend'] for result in checked), 3),
+        'totalBudgetLimit': round(sum(result['budgetLimit'] for result in checked), 3),
+        'elapsedSeconds': round(elapsed_seconds, 3),
+        # with enough concurrency elapsed time stays close to the slowest target, not the sum
+        'sumOfTargetSeconds': round(sum(result['durationSeconds'] for result in results), 3),
+        'results': sorted(results, key=lambda result: (result['status'] == 'OK', -result.get('percentUsed', 0)))
+    }
+
+def report_message(report):
+    lines = [
+        f"Checked {report['targets']} Batch targets in {report['elapsedSeconds']} seconds: " +
+        ", ".join(f"{count} {status}" for status, count in sorted(report['statusCounts'].items())) + ".",
+        f"Total spend ${report['totalActualSpend']:.3f} (USD) out of Budget limits ${report['totalBudgetLimit']:.3f} (USD).",
+        ""
+    ]
+    for result in report['results']:
+        if result['status'] == 'ERROR':
+            lines.append(f"{result['targetId']}: ERROR {result['error']}")
+        else:
+            actions = f" Actions: {', '.join(result['actions'])}." if result['actions'] else ""
+            lines.append(f"{result['targetId']}: {result['status']} ${result['actualSpend']:.3f} of ${result['budgetLimit']:.3f} "
+                f"(USD, {result['percentUsed']}%).{actions}")
+    return "\n".join(lines)
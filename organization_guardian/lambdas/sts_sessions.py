@@ -0,0 +1,50 @@
+import threading
+import datetime
+import boto3
+
+# Member account credentials cached per (account, role) until shortly before they expire.
+# Concurrent workers asking for the same account wait on one AssumeRole call instead of
+# each making their own; the cache lives in the module so warm invocations reuse it.
+
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+class SessionCache:
+
+    def __init__(self, sts_client, session_name, duration_seconds=3600):
+        self.sts_client = sts_client
+        self.session_name = session_name
+        self.duration_seconds = duration_seconds
+        self.credentials = {}
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def session(self, account_id, role_name, region):
+        # a new boto3 session per caller: sessions are not thread safe, credentials are shared
+        credentials = self.get_credentials(account_id, role_name)
+        return boto3.session.Session(
+            aws_access_key_id=credentials['AccessKeyId'],
+            aws_secret_access_key=credentials['SecretAccessKey'],
+            aws_session_token=credentials['SessionToken'],
+            region_name=region
+        )
+
+    def get_credentials(self, account_id, role_name):
+        key = (account_id, role_name)
+        with self.lock:
+            key_lock = self.locks.setdefault(key, threading.Lock())
+        with key_lock:
+            credentials = self.credentials.get(key)
+            if credentials is None or expires_soon(credentials):
+                response = self.sts_client.assume_role(
+                    RoleArn=f"arn:aws:iam::{account_id}:role/{role_name}",
+                    RoleSessionName=self.session_name,
+                    DurationSeconds=self.duration_seconds
+                )
+                credentials = response['Credentials']
+                self.credentials[key] = credentials
+            return credentials
+
+def expires_soon(credentials):
+    expiration = credentials['Expiration']
+    now = datetime.datetime.now(expiration.tzinfo) if expiration.tzinfo else datetime.datetime.utcnow()
+    return expiration - now < REFRESH_MARGIN
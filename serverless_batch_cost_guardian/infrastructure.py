@@ -23,6 +23,9 @@ from aws_cdk import aws_events as aws_events
 from aws_cdk import aws_events_targets as aws_targets
 from aws_cdk import aws_stepfunctions as sfn
 from aws_cdk import aws_stepfunctions_tasks as tasks
+from aws_cdk import aws_sqs as sqs
+from cdk_common.function_settings import function_settings
+from cdk_common.bundling import function_code
 
 GUARDIAN_STACK_PREFIX = "serverless-batch-cost-guardian"
 
@@ -35,6 +38,27 @@ class ServerlessBatchCostGuardianStack(core.Stack):
         
         ###
         
+        # DynamoDB API Rate Governor Table (token buckets shared by every Batch and ECS caller, see lambdas/rate_governor.py)
+        api_rate_governor_table = dynamodb.Table(self, "api-rate-governor-table",
+            partition_key=dynamodb.Attribute(name="bucket", type=dynamodb.AttributeType.STRING)
+        )
+        
+        # Input parameter optional API rate governor limits (JSON)
+        rate_governor_limits_parameter = core.CfnParameter(self, 'rateGovernorLimits',
+          type='String',
+          default='',
+          description='Optional token bucket limits of the shared API rate governor as JSON, tokens per second and burst per service, e.g. {"batch": [10, 40], "ecs": [20, 100]}; defaults to these values'
+        )
+        
+        rate_governor_policy_statement = iam.PolicyStatement(
+            actions=[
+              "dynamodb:GetItem",
+              "dynamodb:PutItem"
+            ],
+            resources=[
+                api_rate_governor_table.table_arn
+            ])
+        
         # Stop New Jobs Lambda IAM Role
         stop_new_jobs_lambda_role = iam.Role(scope=self, id='stop-new-jobs-lambda-iam-role',
             assumed_by = iam.ServicePrincipal('lambda.amazonaws.com'),
@@ -54,6 +78,13 @@ class ServerlessBatchCostGuardianStack(core.Stack):
           description='Name of Batch Job Queue'
         )
         
+        # Input parameter optional tiered escalation policy (JSON), evaluated by the high velocity checker
+        escalation_policy_parameter = core.CfnParameter(self, 'escalationPolicy',
+          type='String',
+          default='',
+          description='Optional escalation tiers as JSON, e.g. [{"percent": 70, "action": "NOTIFY"}, {"percent": 85, "action": "REDUCE_MAX_VCPUS", "maxvCpusPercent": 50, "waitSeconds": 60}, {"percent": 95, "action": "CANCEL_QUEUED"}]; each tier fires once when spend reaches its percentage of the budget'
+        )
+        
         account_id = self.account
         region = self.region
         
@@ -67,28 +98,66 @@ class ServerlessBatchCostGuardianStack(core.Stack):
                 resources=[batch_compute_env_arn]),
                 iam.PolicyStatement(
                 actions=["batch:UpdateJobQueue"],
-                resources=[batch_job_queue_arn])]
+                resources=[batch_job_queue_arn]),
+                rate_governor_policy_statement]
             ))
         
+        stop_new_jobs_lambda_role.node.add_dependency(api_rate_governor_table)
+        
         # Stop New Jobs Lambda Function
         stop_new_jobs_lambda_function = lambda_.Function(
             self, 'stop-new-jobs-lambda-function',
-            code=lambda_.Code.from_asset('./serverless_batch_cost_guardian/lambdas'),
+            code=function_code(self, 'stop-new-jobs-lambda-function', './serverless_batch_cost_guardian/lambdas', 'stop_new_batch_job_submissions.lambda_handler'),
             handler='stop_new_batch_job_submissions.lambda_handler',
             role=stop_new_jobs_lambda_role,
             runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'stop-new-jobs-lambda-function'),
             environment={
                 'BATCH_COMPUTE_ENV_NAME': batch_compute_env_name.value_as_string, 
-                'BATCH_JOB_QUEUE_NAME': batch_job_queue_name.value_as_string 
+                'BATCH_JOB_QUEUE_NAME': batch_job_queue_name.value_as_string,
+                'ESCALATION_POLICY': escalation_policy_parameter.value_as_string,
+                'RATE_GOVERNOR_TABLE_NAME': api_rate_governor_table.table_name,
+                'RATE_GOVERNOR_LIMITS': rate_governor_limits_parameter.value_as_string
             }
         )
         
         ###
         
         # DynamoDB Batch ECS Running Task Table
+        # (stopped tasks are kept as tombstones until they expire, see lambdas/running_tasks.py)
         batch_ecs_running_tasks_table = dynamodb.Table(self, "batch-ecs-running-tasks-table",
             partition_key=dynamodb.Attribute(name="taskArn", type=dynamodb.AttributeType.STRING),
-            stream=dynamodb.StreamViewType.NEW_AND_OLD_IMAGES
+            stream=dynamodb.StreamViewType.NEW_AND_OLD_IMAGES,
+            time_to_live_attribute="expiresAt"
+        )
+        
+        # Sparse index over the tasks of capped jobs, ordered by the time they reach their cost cap
+        batch_ecs_running_tasks_table.add_global_secondary_index(
+            index_name="cap-breach-index",
+            partition_key=dynamodb.Attribute(name="capQueue", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="capBreachAt", type=dynamodb.AttributeType.STRING)
+        )
+        
+        # Input parameter optional per-job cost caps (JSON), enforced by the high velocity checker
+        # while the guardian runs and by the running batch jobs schedule otherwise
+        job_cost_caps_parameter = core.CfnParameter(self, 'jobCostCaps',
+          type='String',
+          default='',
+          description='Optional per-job cost caps in USD as JSON, e.g. {"jobDefinitions": {"my-job-def": 25}, "tags": {"team=research": 10}}; jobs reaching their cap are terminated individually'
+        )
+        
+        # Input parameter minutes between the scheduled checks of per-job cost caps and job queue budgets
+        running_job_check_interval_minutes = core.CfnParameter(self, 'runningJobCheckIntervalMinutes',
+          type='Number',
+          default=5,
+          description='Minutes between the scheduled checks of the running jobs against the per-job cost caps and job queue budgets, which also run while the guardian is not running'
+        )
+        
+        # Input parameter optional budgets of job queues sharing the compute environment (JSON)
+        queue_budgets_parameter = core.CfnParameter(self, 'queueBudgets',
+          type='String',
+          default='',
+          description='Optional monthly budgets in USD of job queues sharing the compute environment as JSON, e.g. {"team-a-queue": 150}; a queue whose jobs accrue more than its budget in the month is disabled and drained on its own'
         )
                 
         # DynamoDB Batch ECS Aggregate Table
@@ -96,6 +165,11 @@ class ServerlessBatchCostGuardianStack(core.Stack):
             partition_key=dynamodb.Attribute(name="aggregate_key", type=dynamodb.AttributeType.STRING)
         )
         
+        # DynamoDB Latest Timestamp and Running Cost Table (also holds the enforcement timeline item)
+        latest_timestamp_running_cost_table = dynamodb.Table(self, "latest-timestamp-running-cost-table",
+            partition_key=dynamodb.Attribute(name="partition-key", type=dynamodb.AttributeType.STRING)
+        )
+        
         # Write Tasks to Dynamo Lambda IAM Role
         write_tasks_to_dynamo_lambda_role = iam.Role(scope=self, id='write-tasks-to-dynamo-lambda-iam-role',
             assumed_by = iam.ServicePrincipal('lambda.amazonaws.com'),
@@ -113,7 +187,10 @@ class ServerlessBatchCostGuardianStack(core.Stack):
         # Scoped down customer managed policy to allow Lambda access to Batch, DynamoDB, and ECS
         write_tasks_to_dynamo_lambda_role.attach_inline_policy(iam.Policy(self, "batch-dynamo-ecs-policy",
             statements=[iam.PolicyStatement(
-                actions=["batch:DescribeComputeEnvironments"],
+                actions=[
+                  "batch:DescribeComputeEnvironments",
+                  "batch:DescribeJobs"
+                ],
                 resources=["*"]),
                 iam.PolicyStatement(
                 actions=[
@@ -124,27 +201,41 @@ class ServerlessBatchCostGuardianStack(core.Stack):
                 conditions={"ArnEquals": { # maybe StringEquals
                     "ecs:cluster": ecs_cluster_arn.value_as_string}}),  
                 iam.PolicyStatement(
-                actions=["dynamodb:PutItem"],
+                actions=[
+                  "dynamodb:PutItem",
+                  "dynamodb:Scan"
+                ],
+                resources=[
+                    batch_ecs_running_tasks_table.table_arn
+                ]),
+                iam.PolicyStatement(
+                actions=["dynamodb:UpdateItem"],
                 resources=[
-                    batch_ecs_running_tasks_table.table_arn,
                     batch_ecs_aggregate_table.table_arn 
-                ])] 
+                ]),
+                rate_governor_policy_statement] 
             ))
             
+        write_tasks_to_dynamo_lambda_role.node.add_dependency(api_rate_governor_table)
         write_tasks_to_dynamo_lambda_role.node.add_dependency(batch_ecs_running_tasks_table)
         write_tasks_to_dynamo_lambda_role.node.add_dependency(batch_ecs_aggregate_table)
         
         # Write Tasks to Dynamo Lambda Function
         write_tasks_to_dynamo_lambda_function = lambda_.Function(
             self, 'write-tasks-to-dynamo-lambda-function',
-            code=lambda_.Code.from_asset('./serverless_batch_cost_guardian/lambdas'),
+            code=function_code(self, 'write-tasks-to-dynamo-lambda-function', './serverless_batch_cost_guardian/lambdas', 'write_batch_ecs_tasks_to_dynamo.lambda_handler'),
             handler='write_batch_ecs_tasks_to_dynamo.lambda_handler',
             role=write_tasks_to_dynamo_lambda_role,
             runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'write-tasks-to-dynamo-lambda-function'),
             environment={
                 'BATCH_COMPUTE_ENV_NAME': batch_compute_env_name.value_as_string, 
                 'RUNNING_TABLE_NAME': batch_ecs_running_tasks_table.table_name,
-                'AGGREGATE_TABLE_NAME': batch_ecs_aggregate_table.table_name 
+                'AGGREGATE_TABLE_NAME': batch_ecs_aggregate_table.table_name,
+                'JOB_COST_CAPS': job_cost_caps_parameter.value_as_string,
+                'QUEUE_BUDGETS': queue_budgets_parameter.value_as_string,
+                'RATE_GOVERNOR_TABLE_NAME': api_rate_governor_table.table_name,
+                'RATE_GOVERNOR_LIMITS': rate_governor_limits_parameter.value_as_string
             }
         )
         
@@ -166,20 +257,31 @@ class ServerlessBatchCostGuardianStack(core.Stack):
                 actions=["dynamodb:UpdateItem"],
                 resources=[
                     batch_ecs_aggregate_table.table_arn 
+                ]),
+                iam.PolicyStatement(
+                actions=[
+                  "dynamodb:GetItem",
+                  "dynamodb:UpdateItem"
+                ],
+                resources=[
+                    latest_timestamp_running_cost_table.table_arn
                 ])] 
             ))
             
         update_aggregate_ecs_task_table_lambda_role.node.add_dependency(batch_ecs_aggregate_table)
+        update_aggregate_ecs_task_table_lambda_role.node.add_dependency(latest_timestamp_running_cost_table)
         
         # Update Aggregate ECS Task Table Lambda Function
         update_aggregate_ecs_task_table_lambda_function = lambda_.Function(
             self, 'update-aggregate-ecs-task-table-lambda-function',
-            code=lambda_.Code.from_asset('./serverless_batch_cost_guardian/lambdas'),
+            code=function_code(self, 'update-aggregate-ecs-task-table-lambda-function', './serverless_batch_cost_guardian/lambdas', 'update_aggregate_ecs_task_table.lambda_handler'),
             handler='update_aggregate_ecs_task_table.lambda_handler',
             role=update_aggregate_ecs_task_table_lambda_role,
             runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'update-aggregate-ecs-task-table-lambda-function'),
             environment={
-                'AGGREGATE_TABLE_NAME': batch_ecs_aggregate_table.table_name 
+                'AGGREGATE_TABLE_NAME': batch_ecs_aggregate_table.table_name,
+                'LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME': latest_timestamp_running_cost_table.table_name
             }
         )
         
@@ -204,29 +306,72 @@ class ServerlessBatchCostGuardianStack(core.Stack):
         # Scoped down customer managed policy to allow Lambda access to DynamoDB
         delete_ecs_task_from_dynamo_lambda_role.attach_inline_policy(iam.Policy(self, "dynamo-delete-policy",
             statements=[iam.PolicyStatement(
-                actions=["dynamodb:DeleteItem"],
+                actions=["dynamodb:BatchWriteItem"],
                 resources=[
                     batch_ecs_running_tasks_table.table_arn 
+                ]),
+                iam.PolicyStatement(
+                actions=[
+                  "dynamodb:GetItem",
+                  "dynamodb:UpdateItem"
+                ],
+                resources=[
+                    latest_timestamp_running_cost_table.table_arn
+                ]),
+                iam.PolicyStatement(
+                actions=["dynamodb:GetItem"],
+                resources=[
+                    batch_ecs_aggregate_table.table_arn
                 ])] 
             ))
         
         delete_ecs_task_from_dynamo_lambda_role.node.add_dependency(batch_ecs_running_tasks_table)
+        delete_ecs_task_from_dynamo_lambda_role.node.add_dependency(latest_timestamp_running_cost_table)
+        delete_ecs_task_from_dynamo_lambda_role.node.add_dependency(batch_ecs_aggregate_table)
         
         # Delete ECS Task From Dynamo Lambda Function
         delete_ecs_task_from_dynamo_lambda_function = lambda_.Function(
             self, 'delete-ecs-task-from-dynamo-lambda-function',
-            code=lambda_.Code.from_asset('./serverless_batch_cost_guardian/lambdas'),
+            code=function_code(self, 'delete-ecs-task-from-dynamo-lambda-function', './serverless_batch_cost_guardian/lambdas', 'delete_ecs_task_from_dynamo.lambda_handler'),
             handler='delete_ecs_task_from_dynamo.lambda_handler',
             role=delete_ecs_task_from_dynamo_lambda_role,
             runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'delete-ecs-task-from-dynamo-lambda-function'),
             environment={
-                'RUNNING_TABLE_NAME': batch_ecs_running_tasks_table.table_name 
+                'RUNNING_TABLE_NAME': batch_ecs_running_tasks_table.table_name,
+                'AGGREGATE_TABLE_NAME': batch_ecs_aggregate_table.table_name,
+                'LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME': latest_timestamp_running_cost_table.table_name
             }
         )
         
         delete_ecs_task_from_dynamo_lambda_function.node.add_dependency(delete_ecs_task_from_dynamo_lambda_role)
         
-        # EventBridge Trigger for Delete ECS Task From Dynamo Lambda Function
+        # SQS buffer for ECS STOPPED events, drained in batches so a termination wave does not
+        # fan out into one concurrent Lambda invocation per stopped task
+        deleted_ecs_tasks_dead_letter_queue = sqs.Queue(self, "deleted-ecs-tasks-dead-letter-queue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            retention_period=core.Duration.days(14)
+        )
+        
+        # visibility timeout of six times the consumer timeout (Lambda default 3 seconds), as recommended for Lambda event sources
+        delete_ecs_task_timeout = delete_ecs_task_from_dynamo_lambda_function.timeout or core.Duration.seconds(3)
+        
+        deleted_ecs_tasks_queue = sqs.Queue(self, "deleted-ecs-tasks-queue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            visibility_timeout=core.Duration.seconds(6 * delete_ecs_task_timeout.to_seconds()),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=5,
+                queue=deleted_ecs_tasks_dead_letter_queue
+            )
+        )
+        
+        delete_ecs_task_from_dynamo_lambda_function.add_event_source(lambda_events.SqsEventSource(deleted_ecs_tasks_queue,
+            batch_size=100,
+            max_batching_window=core.Duration.seconds(5),
+            report_batch_item_failures=True
+        ))
+        
+        # EventBridge Trigger for Delete ECS Task From Dynamo Lambda Function (through the SQS buffer)
         eventbridge_catch_deleted_ecs_tasks_rule = aws_events.Rule(self, "eventbridge-catch-deleted-ecs-tasks-rule",
             event_pattern=aws_events.EventPattern(
                 detail_type=["ECS Task State Change"],
@@ -238,13 +383,94 @@ class ServerlessBatchCostGuardianStack(core.Stack):
             )
         )
         
-        eventbridge_catch_deleted_ecs_tasks_rule.add_target(aws_targets.LambdaFunction(delete_ecs_task_from_dynamo_lambda_function))
+        eventbridge_catch_deleted_ecs_tasks_rule.add_target(aws_targets.SqsQueue(deleted_ecs_tasks_queue))
 
         ###
         
-        # DynamoDB Latest Timestamp and Running Cost Table
-        latest_timestamp_running_cost_table = dynamodb.Table(self, "latest-timestamp-running-cost-table",
-            partition_key=dynamodb.Attribute(name="partition-key", type=dynamodb.AttributeType.STRING)
+        # DynamoDB Runtime Sketch Table (one runtime percentile sketch per job definition)
+        runtime_sketch_table = dynamodb.Table(self, "runtime-sketch-table",
+            partition_key=dynamodb.Attribute(name="jobDefinition", type=dynamodb.AttributeType.STRING)
+        )
+        
+        # Record Job Runtimes Lambda IAM Role
+        record_job_runtimes_lambda_role = iam.Role(scope=self, id='record-job-runtimes-lambda-iam-role',
+            assumed_by = iam.ServicePrincipal('lambda.amazonaws.com'),
+            role_name='record-job-runtimes-lambda-iam-role',
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole') 
+            ])
+        
+        # Scoped down customer managed policy to allow Lambda access to DynamoDB
+        record_job_runtimes_lambda_role.attach_inline_policy(iam.Policy(self, "dynamo-sketch-policy",
+            statements=[iam.PolicyStatement(
+                actions=[
+                  "dynamodb:GetItem",
+                  "dynamodb:PutItem"
+                ],
+                resources=[
+                    runtime_sketch_table.table_arn
+                ])] 
+            ))
+        
+        record_job_runtimes_lambda_role.node.add_dependency(runtime_sketch_table)
+        
+        # Record Job Runtimes Lambda Function
+        record_job_runtimes_lambda_function = lambda_.Function(
+            self, 'record-job-runtimes-lambda-function',
+            code=function_code(self, 'record-job-runtimes-lambda-function', './serverless_batch_cost_guardian/lambdas', 'record_job_runtimes.lambda_handler'),
+            handler='record_job_runtimes.lambda_handler',
+            role=record_job_runtimes_lambda_role,
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'record-job-runtimes-lambda-function'),
+            environment={
+                'RUNTIME_SKETCH_TABLE_NAME': runtime_sketch_table.table_name
+            }
+        )
+        
+        record_job_runtimes_lambda_function.node.add_dependency(record_job_runtimes_lambda_role)
+        
+        # SQS buffer for Batch job state change events, folded into the sketches in batches
+        finished_batch_jobs_dead_letter_queue = sqs.Queue(self, "finished-batch-jobs-dead-letter-queue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            retention_period=core.Duration.days(14)
+        )
+        
+        record_job_runtimes_timeout = record_job_runtimes_lambda_function.timeout or core.Duration.seconds(3)
+        
+        finished_batch_jobs_queue = sqs.Queue(self, "finished-batch-jobs-queue",
+            encryption=sqs.QueueEncryption.SQS_MANAGED,
+            visibility_timeout=core.Duration.seconds(6 * record_job_runtimes_timeout.to_seconds()),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=5,
+                queue=finished_batch_jobs_dead_letter_queue
+            )
+        )
+        
+        record_job_runtimes_lambda_function.add_event_source(lambda_events.SqsEventSource(finished_batch_jobs_queue,
+            batch_size=100,
+            max_batching_window=core.Duration.seconds(30),
+            report_batch_item_failures=True
+        ))
+        
+        # EventBridge Trigger for Record Job Runtimes Lambda Function (through the SQS buffer)
+        eventbridge_catch_finished_batch_jobs_rule = aws_events.Rule(self, "eventbridge-catch-finished-batch-jobs-rule",
+            event_pattern=aws_events.EventPattern(
+                detail_type=["Batch Job State Change"],
+                source=["aws.batch"],
+                detail={
+                    "status": ["SUCCEEDED", "FAILED"]
+                }
+            )
+        )
+        
+        eventbridge_catch_finished_batch_jobs_rule.add_target(aws_targets.SqsQueue(finished_batch_jobs_queue))
+        
+        ###
+        
+        # DynamoDB Spend History Table (delta-encoded sample chunks per billing period)
+        spend_history_table = dynamodb.Table(self, "spend-history-table",
+            partition_key=dynamodb.Attribute(name="series_key", type=dynamodb.AttributeType.STRING),
+            sort_key=dynamodb.Attribute(name="chunk_start", type=dynamodb.AttributeType.NUMBER)
         )
         
         # High Velocity Batch Spend Checker Lambda IAM Role
@@ -260,32 +486,139 @@ class ServerlessBatchCostGuardianStack(core.Stack):
             statements=[iam.PolicyStatement(
                 actions=[
                   "dynamodb:UpdateItem",
-                  "dynamodb:GetItem"
+                  "dynamodb:GetItem",
+                  "dynamodb:PutItem"
                 ],
                 resources=[
                     batch_ecs_aggregate_table.table_arn,
                     latest_timestamp_running_cost_table.table_arn
-                ])] 
+                ]),
+                iam.PolicyStatement(
+                actions=[
+                  "dynamodb:Query",
+                  "dynamodb:PutItem",
+                  "dynamodb:UpdateItem"
+                ],
+                resources=[
+                    spend_history_table.table_arn
+                ]),
+                iam.PolicyStatement(
+                actions=[
+                  "dynamodb:Query",
+                  "dynamodb:UpdateItem"
+                ],
+                resources=[
+                    batch_ecs_running_tasks_table.table_arn,
+                    batch_ecs_running_tasks_table.table_arn + "/index/cap-breach-index"
+                ]),
+                iam.PolicyStatement(
+                actions=["dynamodb:GetItem"],
+                resources=[
+                    runtime_sketch_table.table_arn
+                ]),
+                iam.PolicyStatement(
+                actions=[
+                  "batch:TerminateJob",
+                  "batch:ListJobs",
+                  "batch:DescribeJobQueues",
+                  "batch:DescribeJobDefinitions"
+                ],
+                resources=["*"]),
+                rate_governor_policy_statement] 
             ))
         
+        high_velocity_batch_spend_checker_lambda_role.node.add_dependency(api_rate_governor_table)
+        high_velocity_batch_spend_checker_lambda_role.node.add_dependency(runtime_sketch_table)
+        high_velocity_batch_spend_checker_lambda_role.node.add_dependency(batch_ecs_running_tasks_table)
         high_velocity_batch_spend_checker_lambda_role.node.add_dependency(batch_ecs_aggregate_table)
         high_velocity_batch_spend_checker_lambda_role.node.add_dependency(latest_timestamp_running_cost_table)
+        high_velocity_batch_spend_checker_lambda_role.node.add_dependency(spend_history_table)
+        
+        # Input parameter configurable polling rate for high frequcency Batch spend checker 
+        wait_time_parameter = core.CfnParameter(self, 'waitTime',
+          type='Number',
+          description='Configurable polling rate (in seconds) for high frequcency Batch spend checker'
+        )
+        
+        # Input parameter action taken when the checker flags a burn rate anomaly
+        anomaly_action_parameter = core.CfnParameter(self, 'anomalyAction',
+          type='String',
+          default='SHORTEN_WAIT',
+          allowed_values=['SHORTEN_WAIT', 'TERMINATE'],
+          description='On a burn rate spike or increase after new submissions are stopped, poll again sooner (SHORTEN_WAIT) or stop running jobs immediately (TERMINATE)'
+        )
+        
+        # Input parameter optional drain grace window, 0 terminates running jobs without draining
+        drain_grace_seconds_parameter = core.CfnParameter(self, 'drainGraceSeconds',
+          type='Number',
+          default=0,
+          min_value=0,
+          description='Optional longest grace window (in seconds) running jobs get to checkpoint and exit before they are terminated; draining starts once the budget left only pays for this many seconds at the current burn rate'
+        )
         
         # High Velocity Batch Spend Checker Lambda Function
         high_velocity_batch_spend_checker_lambda_function = lambda_.Function(
             self, 'high-velocity-batch-spend-checker-lambda-function',
-            code=lambda_.Code.from_asset('./serverless_batch_cost_guardian/lambdas'),
+            code=function_code(self, 'high-velocity-batch-spend-checker-lambda-function', './serverless_batch_cost_guardian/lambdas', 'high_velocity_batch_spend_checker.lambda_handler'),
             handler='high_velocity_batch_spend_checker.lambda_handler',
             role=high_velocity_batch_spend_checker_lambda_role,
             runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'high-velocity-batch-spend-checker-lambda-function'),
             environment={
                 'AGGREGATE_TABLE_NAME': batch_ecs_aggregate_table.table_name,
-                'LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME': latest_timestamp_running_cost_table.table_name
+                'LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME': latest_timestamp_running_cost_table.table_name,
+                'SPEND_HISTORY_TABLE_NAME': spend_history_table.table_name,
+                'WAIT_TIME_SECONDS': wait_time_parameter.value_as_string,
+                'ANOMALY_ACTION': anomaly_action_parameter.value_as_string,
+                'RUNNING_TABLE_NAME': batch_ecs_running_tasks_table.table_name,
+                'JOB_COST_CAPS': job_cost_caps_parameter.value_as_string,
+                'QUEUE_BUDGETS': queue_budgets_parameter.value_as_string,
+                'ESCALATION_POLICY': escalation_policy_parameter.value_as_string,
+                'RUNTIME_SKETCH_TABLE_NAME': runtime_sketch_table.table_name,
+                'BATCH_COMPUTE_ENV_NAME': batch_compute_env_name.value_as_string,
+                'BATCH_JOB_QUEUE_NAME': batch_job_queue_name.value_as_string,
+                'DRAIN_GRACE_SECONDS': drain_grace_seconds_parameter.value_as_string,
+                'RATE_GOVERNOR_TABLE_NAME': api_rate_governor_table.table_name,
+                'RATE_GOVERNOR_LIMITS': rate_governor_limits_parameter.value_as_string
             }
         )
         
         high_velocity_batch_spend_checker_lambda_function.node.add_dependency(high_velocity_batch_spend_checker_lambda_role)
         
+        # Get Spend History Lambda IAM Role
+        get_spend_history_lambda_role = iam.Role(scope=self, id='get-spend-history-lambda-iam-role',
+            assumed_by = iam.ServicePrincipal('lambda.amazonaws.com'),
+            role_name='get-spend-history-lambda-iam-role',
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole') 
+            ])
+        
+        # Scoped down customer managed policy to allow Lambda read access to DynamoDB
+        get_spend_history_lambda_role.attach_inline_policy(iam.Policy(self, "dynamo-query-policy",
+            statements=[iam.PolicyStatement(
+                actions=["dynamodb:Query"],
+                resources=[
+                    spend_history_table.table_arn
+                ])] 
+            ))
+        
+        get_spend_history_lambda_role.node.add_dependency(spend_history_table)
+        
+        # Get Spend History Lambda Function (reader for a billing period's spend series)
+        get_spend_history_lambda_function = lambda_.Function(
+            self, 'get-spend-history-lambda-function',
+            code=function_code(self, 'get-spend-history-lambda-function', './serverless_batch_cost_guardian/lambdas', 'get_spend_history.lambda_handler'),
+            handler='get_spend_history.lambda_handler',
+            role=get_spend_history_lambda_role,
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'get-spend-history-lambda-function'),
+            environment={
+                'SPEND_HISTORY_TABLE_NAME': spend_history_table.table_name
+            }
+        )
+        
+        get_spend_history_lambda_function.node.add_dependency(get_spend_history_lambda_role)
+        
         ###
         
         # Stop Running Batch Jobs Lambda IAM Role
@@ -305,18 +638,42 @@ class ServerlessBatchCostGuardianStack(core.Stack):
                 ],
                 resources=[
                     "*"
-                ])] 
+                ]),
+                iam.PolicyStatement(
+                actions=["batch:DescribeJobQueues"],
+                resources=["*"]),
+                iam.PolicyStatement(
+                actions=["dynamodb:GetItem"],
+                resources=[
+                    batch_ecs_aggregate_table.table_arn
+                ]),
+                iam.PolicyStatement(
+                actions=["dynamodb:UpdateItem"],
+                resources=[
+                    latest_timestamp_running_cost_table.table_arn
+                ]),
+                rate_governor_policy_statement] 
             ))
             
+        stop_running_batch_jobs_lambda_role.node.add_dependency(api_rate_governor_table)
+        stop_running_batch_jobs_lambda_role.node.add_dependency(batch_ecs_aggregate_table)
+        stop_running_batch_jobs_lambda_role.node.add_dependency(latest_timestamp_running_cost_table)
+            
         # Stop Running Batch Jobs Lambda Function
         stop_running_batch_jobs_lambda_function = lambda_.Function(
             self, 'stop-running-batch-jobs-lambda-function',
-            code=lambda_.Code.from_asset('./serverless_batch_cost_guardian/lambdas'),
+            code=function_code(self, 'stop-running-batch-jobs-lambda-function', './serverless_batch_cost_guardian/lambdas', 'stop_running_batch_jobs.lambda_handler'),
             handler='stop_running_batch_jobs.lambda_handler',
             role=stop_running_batch_jobs_lambda_role,
             runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'stop-running-batch-jobs-lambda-function'),
             environment={
-                'BATCH_JOB_QUEUE_NAME': batch_job_queue_name.value_as_string
+                'BATCH_JOB_QUEUE_NAME': batch_job_queue_name.value_as_string,
+                'AGGREGATE_TABLE_NAME': batch_ecs_aggregate_table.table_name,
+                'LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME': latest_timestamp_running_cost_table.table_name,
+                'BATCH_COMPUTE_ENV_NAME': batch_compute_env_name.value_as_string,
+                'RATE_GOVERNOR_TABLE_NAME': api_rate_governor_table.table_name,
+                'RATE_GOVERNOR_LIMITS': rate_governor_limits_parameter.value_as_string
             }
         )
         
@@ -324,6 +681,195 @@ class ServerlessBatchCostGuardianStack(core.Stack):
         
         ###
         
+        # Check Running Batch Jobs Lambda IAM Role
+        check_running_batch_jobs_lambda_role = iam.Role(scope=self, id='check-running-batch-jobs-lambda-iam-role',
+            assumed_by = iam.ServicePrincipal('lambda.amazonaws.com'),
+            role_name='check-running-batch-jobs-lambda-iam-role',
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole') 
+            ])
+        
+        # Scoped down customer managed policy to allow Lambda access to Batch and the job queue month-to-date items
+        check_running_batch_jobs_lambda_role.attach_inline_policy(iam.Policy(self, "batch-running-jobs-policy",
+            statements=[iam.PolicyStatement(
+                actions=[
+                  "batch:DescribeJobQueues",
+                  "batch:ListJobs",
+                  "batch:DescribeJobs",
+                  "batch:TerminateJob",
+                  "batch:UpdateJobQueue"
+                ],
+                resources=[
+                    "*"
+                ]),
+                iam.PolicyStatement(
+                actions=[
+                  "dynamodb:GetItem",
+                  "dynamodb:UpdateItem"
+                ],
+                resources=[
+                    latest_timestamp_running_cost_table.table_arn
+                ]),
+                rate_governor_policy_statement] 
+            ))
+            
+        check_running_batch_jobs_lambda_role.node.add_dependency(api_rate_governor_table)
+        check_running_batch_jobs_lambda_role.node.add_dependency(latest_timestamp_running_cost_table)
+            
+        # Check Running Batch Jobs Lambda Function
+        check_running_batch_jobs_lambda_function = lambda_.Function(
+            self, 'check-running-batch-jobs-lambda-function',
+            code=function_code(self, 'check-running-batch-jobs-lambda-function', './serverless_batch_cost_guardian/lambdas', 'check_running_batch_jobs.lambda_handler'),
+            handler='check_running_batch_jobs.lambda_handler',
+            role=check_running_batch_jobs_lambda_role,
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'check-running-batch-jobs-lambda-function'),
+            environment={
+                'BATCH_JOB_QUEUE_NAME': batch_job_queue_name.value_as_string,
+                'BATCH_COMPUTE_ENV_NAME': batch_compute_env_name.value_as_string,
+                'LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME': latest_timestamp_running_cost_table.table_name,
+                'JOB_COST_CAPS': job_cost_caps_parameter.value_as_string,
+                'QUEUE_BUDGETS': queue_budgets_parameter.value_as_string,
+                'RATE_GOVERNOR_TABLE_NAME': api_rate_governor_table.table_name,
+                'RATE_GOVERNOR_LIMITS': rate_governor_limits_parameter.value_as_string
+            }
+        )
+        
+        check_running_batch_jobs_lambda_function.node.add_dependency(check_running_batch_jobs_lambda_role)
+        
+        # EventBridge Schedule for the per-job cost caps and job queue budgets, independent of the guardian's executions
+        check_running_batch_jobs_schedule_rule = aws_events.Rule(self, "check-running-batch-jobs-schedule-rule",
+            schedule=aws_events.Schedule.rate(core.Duration.minutes(running_job_check_interval_minutes.value_as_number))
+        )
+        
+        check_running_batch_jobs_schedule_rule.add_target(aws_targets.LambdaFunction(check_running_batch_jobs_lambda_function))
+        
+        ###
+        
+        # Guardian Actions Lambda IAM Role
+        guardian_actions_lambda_role = iam.Role(scope=self, id='guardian-actions-lambda-iam-role',
+            assumed_by = iam.ServicePrincipal('lambda.amazonaws.com'),
+            role_name='guardian-actions-lambda-iam-role',
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole') 
+            ])
+        
+        # Input parameter optional SNS topic notified by NOTIFY escalation tiers
+        escalation_topic_arn_parameter = core.CfnParameter(self, 'escalationTopicArn',
+          type='String',
+          default='',
+          description='Optional ARN of an SNS topic published to by NOTIFY escalation tiers (e.g. the Event-Driven Budget Checker topic)'
+        )
+        
+        # Scoped down customer managed policy to allow Lambda access to Batch and SNS
+        guardian_actions_lambda_role.attach_inline_policy(iam.Policy(self, "batch-escalation-policy",
+            statements=[iam.PolicyStatement(
+                actions=[
+                  "batch:ListJobs",
+                  "batch:CancelJob",
+                  "batch:TerminateJob",
+                  "batch:DescribeJobQueues",
+                  "batch:DescribeComputeEnvironments"
+                ],
+                resources=["*"]),
+                iam.PolicyStatement(
+                actions=["batch:UpdateComputeEnvironment"],
+                resources=[batch_compute_env_arn]),
+                iam.PolicyStatement(
+                actions=["batch:UpdateJobQueue"],
+                resources=['arn:aws:batch:' + str(region) + ':' + str(account_id) + ':job-queue/*']),
+                iam.PolicyStatement(
+                actions=["batch:TagResource"],
+                resources=['arn:aws:batch:' + str(region) + ':' + str(account_id) + ':job/*']),
+                iam.PolicyStatement(
+                actions=["sns:Publish"],
+                resources=['arn:aws:sns:' + str(region) + ':' + str(account_id) + ':*']),
+                rate_governor_policy_statement]
+            ))
+        
+        guardian_actions_lambda_role.node.add_dependency(api_rate_governor_table)
+        
+        # Guardian Actions Lambda Function (dispatches the actions returned by the checker)
+        guardian_actions_lambda_function = lambda_.Function(
+            self, 'guardian-actions-lambda-function',
+            code=function_code(self, 'guardian-actions-lambda-function', './serverless_batch_cost_guardian/lambdas', 'guardian_actions.lambda_handler'),
+            handler='guardian_actions.lambda_handler',
+            role=guardian_actions_lambda_role,
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'guardian-actions-lambda-function'),
+            environment={
+                'BATCH_COMPUTE_ENV_NAME': batch_compute_env_name.value_as_string,
+                'BATCH_JOB_QUEUE_NAME': batch_job_queue_name.value_as_string,
+                'ESCALATION_TOPIC_ARN': escalation_topic_arn_parameter.value_as_string,
+                'RATE_GOVERNOR_TABLE_NAME': api_rate_governor_table.table_name,
+                'RATE_GOVERNOR_LIMITS': rate_governor_limits_parameter.value_as_string
+            }
+        )
+        
+        guardian_actions_lambda_function.node.add_dependency(guardian_actions_lambda_role)
+        
+        ###
+        
+        # Admission Control Lambda IAM Role
+        admission_control_lambda_role = iam.Role(scope=self, id='admission-control-lambda-iam-role',
+            assumed_by = iam.ServicePrincipal('lambda.amazonaws.com'),
+            role_name='admission-control-lambda-iam-role',
+            managed_policies=[
+                iam.ManagedPolicy.from_aws_managed_policy_name('service-role/AWSLambdaBasicExecutionRole') 
+            ])
+        
+        # Scoped down customer managed policy to allow Lambda read access to DynamoDB and job submission
+        admission_control_lambda_role.attach_inline_policy(iam.Policy(self, "dynamo-get-batch-submit-policy",
+            statements=[iam.PolicyStatement(
+                actions=["dynamodb:GetItem"],
+                resources=[
+                    latest_timestamp_running_cost_table.table_arn
+                ]),
+                iam.PolicyStatement(
+                actions=["batch:DescribeJobDefinitions"],
+                resources=["*"]),
+                iam.PolicyStatement(
+                actions=["batch:SubmitJob"],
+                resources=[
+                    'arn:aws:batch:' + str(region) + ':' + str(account_id) + ':job-queue/*',
+                    'arn:aws:batch:' + str(region) + ':' + str(account_id) + ':job-definition/*'
+                ]),
+                rate_governor_policy_statement]
+            ))
+        
+        admission_control_lambda_role.node.add_dependency(api_rate_governor_table)
+        admission_control_lambda_role.node.add_dependency(latest_timestamp_running_cost_table)
+        
+        # Admission Control Lambda Function (admit or reject submissions against the remaining budget)
+        admission_control_lambda_function = lambda_.Function(
+            self, 'admission-control-lambda-function',
+            code=function_code(self, 'admission-control-lambda-function', './serverless_batch_cost_guardian/lambdas', 'admission_control.lambda_handler'),
+            handler='admission_control.lambda_handler',
+            role=admission_control_lambda_role,
+            runtime=lambda_.Runtime.PYTHON_3_9,
+            **function_settings(self, 'admission-control-lambda-function'),
+            environment={
+                'LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME': latest_timestamp_running_cost_table.table_name,
+                'WAIT_TIME_SECONDS': wait_time_parameter.value_as_string,
+                'RATE_GOVERNOR_TABLE_NAME': api_rate_governor_table.table_name,
+                'RATE_GOVERNOR_LIMITS': rate_governor_limits_parameter.value_as_string
+            }
+        )
+        
+        admission_control_lambda_function.node.add_dependency(admission_control_lambda_role)
+        
+        # Function URL for submitters and SubmitJob wrappers, callers need lambda:InvokeFunctionUrl
+        admission_control_function_url = admission_control_lambda_function.add_function_url(
+            auth_type=lambda_.FunctionUrlAuthType.AWS_IAM
+        )
+        
+        core.CfnOutput(self, 'admissionControlUrl',
+          value=admission_control_function_url.url,
+          description='Admission control function URL (IAM auth)'
+        )
+        
+        ###
+        
         # Step Functions State Machine IAM Role
         step_functions_state_machine_iam_role = iam.Role(scope=self, id='step-functions-state-machine-iam-role',
             assumed_by = iam.ServicePrincipal('states.amazonaws.com'),
@@ -347,7 +893,8 @@ class ServerlessBatchCostGuardianStack(core.Stack):
                     stop_new_jobs_lambda_function.function_arn,
                     write_tasks_to_dynamo_lambda_function.function_arn,
                     high_velocity_batch_spend_checker_lambda_function.function_arn,
-                    stop_running_batch_jobs_lambda_function.function_arn
+                    stop_running_batch_jobs_lambda_function.function_arn,
+                    guardian_actions_lambda_function.function_arn
                 ])] 
             ))
         
@@ -356,6 +903,7 @@ class ServerlessBatchCostGuardianStack(core.Stack):
         step_functions_state_machine_iam_role.node.add_dependency(write_tasks_to_dynamo_lambda_function)
         step_functions_state_machine_iam_role.node.add_dependency(high_velocity_batch_spend_checker_lambda_function)
         step_functions_state_machine_iam_role.node.add_dependency(stop_running_batch_jobs_lambda_function)
+        step_functions_state_machine_iam_role.node.add_dependency(guardian_actions_lambda_function)
         
         stop_new_batch_job_submissions = tasks.LambdaInvoke(self, "stop-new-batch-job-submissions",
             lambda_function=stop_new_jobs_lambda_function,
@@ -371,12 +919,53 @@ class ServerlessBatchCostGuardianStack(core.Stack):
             item={
                 "partition-key": tasks.DynamoAttributeValue.from_string("pk"),
                 "latestTimeStamp": tasks.DynamoAttributeValue.from_string(sfn.JsonPath.string_at("$.startTime")),
-                "runningCost": tasks.DynamoAttributeValue.from_string(sfn.JsonPath.string_at("$.startCost"))
+                "runningCost": tasks.DynamoAttributeValue.from_string(sfn.JsonPath.string_at("$.startCost")),
+                "budgetLimit": tasks.DynamoAttributeValue.from_string(sfn.JsonPath.string_at("$.budgetLimit"))
             },
             table=latest_timestamp_running_cost_table,
             result_path=sfn.JsonPath.DISCARD
         )
         
+        # first check against the initial accrual, run while the ECS snapshot is still being written
+        first_spend_check = tasks.LambdaInvoke(self, "first-spend-check",
+            lambda_function=high_velocity_batch_spend_checker_lambda_function,
+            payload=sfn.TaskInput.from_object({
+                "startTime": sfn.JsonPath.string_at("$.startTime"),
+                "startCost": sfn.JsonPath.string_at("$.startCost"),
+                "budgetLimit": sfn.JsonPath.string_at("$.budgetLimit"),
+                "firstCheck": True
+            }),
+            output_path="$.Payload"
+        )
+        
+        # the first check's decision is acted on inside its branch, so terminating jobs or dispatching
+        # guardian actions does not wait for the ECS snapshot of a large cluster to complete
+        first_stop_running_batch_jobs = tasks.LambdaInvoke(self, "first-stop-running-batch-jobs",
+            lambda_function=stop_running_batch_jobs_lambda_function,
+            result_path="$.stopResult"
+        )
+        
+        first_dispatch_guardian_actions = tasks.LambdaInvoke(self, "first-dispatch-guardian-actions",
+            lambda_function=guardian_actions_lambda_function,
+            result_selector={"results.$": "$.Payload.results"},
+            result_path="$.actionsResult"
+        )
+        
+        first_check_choice_state = sfn.Choice(self, "first_check_choice_state")
+        first_check_choice_state \
+            .when(sfn.Condition.string_matches("$.budgetMet", "YES"), first_stop_running_batch_jobs) \
+            .when(sfn.Condition.string_matches("$.actionsRequired", "YES"), first_dispatch_guardian_actions) \
+            .otherwise(sfn.Pass(self, "first-check-no-action"))
+        
+        # disable submissions, snapshot running tasks and initialize state concurrently;
+        # the output of the last branch (the first check) decides whether to keep polling
+        guardian_startup = sfn.Parallel(self, "guardian-startup",
+            output_path="$[2]"
+        )
+        guardian_startup.branch(stop_new_batch_job_submissions)
+        guardian_startup.branch(write_batch_ecs_tasks_to_dynamo)
+        guardian_startup.branch(initialize_start_time_and_cost.next(first_spend_check).next(first_check_choice_state))
+        
         budget_met_choice_state = sfn.Choice(self, "budget_met_choice_state")
         
         high_velocity_batch_spend_checker = tasks.LambdaInvoke(self, "high-velocity-batch-spend-checker",
@@ -384,15 +973,9 @@ class ServerlessBatchCostGuardianStack(core.Stack):
             output_path="$.Payload"
         )
         
-        # Input parameter configurable polling rate for high frequcency Batch spend checker 
-        wait_time_parameter = core.CfnParameter(self, 'waitTime',
-          type='Number',
-          description='Configurable polling rate (in seconds) for high frequcency Batch spend checker'
-        )
-        
+        # the checker returns the next wait: waitTime, shorter after a burn rate anomaly, 0 once the budget is met
         wait_time = sfn.Wait(self, "Wait",
-            time=sfn.WaitTime.duration(
-                core.Duration.seconds(wait_time_parameter.value_as_number))
+            time=sfn.WaitTime.seconds_path("$.waitSeconds")
         )
  
         stop_running_batch_jobs = tasks.LambdaInvoke(self, "stop-running-batch-jobs",
@@ -400,12 +983,24 @@ class ServerlessBatchCostGuardianStack(core.Stack):
             output_path="$.Payload"
         )
         
-        definition = stop_new_batch_job_submissions \
-            .next(write_batch_ecs_tasks_to_dynamo) \
-            .next(initialize_start_time_and_cost) \
-            .next(budget_met_choice_state \
-             .when(sfn.Condition.string_matches("$.budgetMet", "YES"), stop_running_batch_jobs) \
-             .when(sfn.Condition.string_matches("$.budgetMet", "NO"), high_velocity_batch_spend_checker.next(wait_time).next(budget_met_choice_state)))
+        # escalation tiers and job queues over their own budget are acted on, then polling continues
+        dispatch_guardian_actions = tasks.LambdaInvoke(self, "dispatch-guardian-actions",
+            lambda_function=guardian_actions_lambda_function,
+            result_selector={"results.$": "$.Payload.results"},
+            result_path="$.actionsResult"
+        )
+        
+        wait_time.next(high_velocity_batch_spend_checker).next(budget_met_choice_state)
+        
+        definition = guardian_startup \
+            .next(sfn.Choice(self, "first_check_budget_met_choice_state") \
+             .when(sfn.Condition.string_matches("$.budgetMet", "YES"), sfn.Succeed(self, "budget-met-on-first-check")) \
+             .otherwise(wait_time))
+        
+        budget_met_choice_state \
+            .when(sfn.Condition.string_matches("$.budgetMet", "YES"), stop_running_batch_jobs) \
+            .when(sfn.Condition.string_matches("$.actionsRequired", "YES"), dispatch_guardian_actions.next(wait_time)) \
+            .when(sfn.Condition.string_matches("$.budgetMet", "NO"), wait_time)
             
         serverless_batch_cost_guardian_state_machine = sfn.StateMachine(self, "serverless-batch-cost-guardian-state-machine",
             definition=definition,
@@ -0,0 +1,144 @@
+import base64
+import json
+import boto3
+import datetime
+import math
+import os
+import time
+import fargate_pricing
+import guardian_metrics
+import rate_governor
+
+# Budget-aware admission control for Batch job submissions, served by a function URL
+# (IAM auth) that submitters or a SubmitJob wrapper call with the job's resources:
+#
+#   {"jobDefinition": "my-job-def", "expectedDurationHours": 2}
+#   {"vcpu": 4, "memoryGb": 8, "expectedDurationHours": 2}
+#
+# The guardian's state is a single eventually consistent GetItem of the latest timestamp
+# and running cost item, cached for ADMISSION_CACHE_SECONDS in each warm Lambda, so tens
+# of calls per second cost a few reads per second. A job is admitted when its projected
+# cost, plus what the running jobs burn at the current rate over the same duration, fits
+# in the budget left. With "submitJob" (SubmitJob parameters) an admitted job is submitted.
+# The item outlives the execution that wrote it, so it is only enforced while the checker
+# keeps polling: written this month, within ADMISSION_STALE_POLLS poll intervals.
+
+dynamodb_resource = boto3.resource('dynamodb')
+batch_client = rate_governor.install(boto3.client('batch'), rate_governor.BOOKKEEPING)
+latest_timestamp_running_cost_table = dynamodb_resource.Table(os.environ['LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME'])
+cache_seconds = float(os.environ.get('ADMISSION_CACHE_SECONDS', '5'))
+default_duration_hours = float(os.environ.get('DEFAULT_JOB_DURATION_HOURS', '1'))
+default_wait_seconds = float(os.environ.get('WAIT_TIME_SECONDS', '60'))
+stale_polls = float(os.environ.get('ADMISSION_STALE_POLLS', '3'))
+
+# (monotonic time read, guardian state item or None) and job definition resources, per warm Lambda
+_state_cache = [None, None]
+_job_definition_resources = {}
+
+def lambda_handler(event, context):
+
+    # malformed requests (not JSON, non-numeric fields) are the caller's error, not the Lambda's
+    try:
+        request, vcpu, memory_gb, duration_hours = parse_request(event)
+    except (ValueError, TypeError) as error:
+        return response(400, {'error': str(error)})
+    job_cost = fargate_pricing.hourly_cost(vcpu, memory_gb) * duration_hours
+
+    decision = decide(guardian_state(), job_cost, duration_hours, datetime.datetime.now())
+    guardian_metrics.emit({'AdmissionRejected' if decision['decision'] == 'REJECT' else 'AdmissionAdmitted': 1}, unit='Count')
+
+    if decision['decision'] == 'ADMIT' and 'submitJob' in request:
+        try:
+            submitted = batch_client.submit_job(**request['submitJob'])
+        except batch_client.exceptions.ClientError as error:
+            # admitted but not submitted, e.g. the job queue is disabled while the guardian runs
+            decision['error'] = error.response['Error']['Message']
+            decision['errorCode'] = error.response['Error']['Code']
+            return response(409, decision)
+        decision['jobId'] = submitted['jobId']
+
+    return response(200, decision)
+
+def parse_request(event):
+    # function URL events carry the request as a JSON body, direct invocations as the event
+    if 'body' in event:
+        body = base64.b64decode(event['body']) if event.get('isBase64Encoded') else event['body']
+        request = json.loads(body)
+    else:
+        request = event
+    if not isinstance(request, dict):
+        raise ValueError('request must be a JSON object')
+    if not isinstance(request.get('submitJob', {}), dict):
+        raise ValueError('submitJob must be a JSON object of SubmitJob parameters')
+    vcpu, memory_gb = job_resources(request)
+    duration_hours = float(request.get('expectedDurationHours', default_duration_hours))
+    if not all(math.isfinite(value) and value >= 0 for value in (vcpu, memory_gb, duration_hours)):
+        raise ValueError('vcpu, memoryGb and expectedDurationHours must be non-negative numbers')
+    return request, vcpu, memory_gb, duration_hours
+
+def job_resources(request):
+    # (vCPUs, memory GB) from the request or the job definition's resource requirements
+    if 'vcpu' in request:
+        return float(request['vcpu']), float(request.get('memoryGb', 0))
+    job_definition = request.get('jobDefinition') or request.get('submitJob', {}).get('jobDefinition')
+    if not job_definition:
+        raise ValueError('vcpu and memoryGb or jobDefinition required')
+    if job_definition not in _job_definition_resources:
+        try:
+            definitions = batch_client.describe_job_definitions(jobDefinitions=[job_definition])['jobDefinitions']
+        except batch_client.exceptions.ClientError as error:
+            raise ValueError(f"Job definition {job_definition} could not be described: {error.response['Error']['Message']}")
+        if not definitions:
+            raise ValueError(f"Job definition {job_definition} not found")
+        # multi-node and EKS job definitions have no containerProperties
+        requirements = {requirement['type']: float(requirement['value'])
+            for requirement in definitions[0].get('containerProperties', {}).get('resourceRequirements', [])}
+        if 'VCPU' not in requirements:
+            raise ValueError(f"Job definition {job_definition} has no container resources, pass vcpu and memoryGb")
+        _job_definition_resources[job_definition] = (requirements['VCPU'], requirements.get('MEMORY', 0.0) / 1024)
+    return _job_definition_resources[job_definition]
+
+def guardian_state():
+    # the latest timestamp and running cost item, None while the guardian has not run
+    read_at, item = _state_cache
+    if read_at is None or time.monotonic() - read_at > cache_seconds:
+        item = latest_timestamp_running_cost_table.get_item(Key={
+            'partition-key': 'pk'
+        }).get('Item')
+        _state_cache[:] = [time.monotonic(), item]
+    return item
+
+def guardian_active(state, now):
+    # the checker refreshes latestTimeStamp on every poll; an item from an earlier month, or one
+    # not refreshed for a few poll intervals, was left by an execution that has ended
+    if state is None or 'budgetLimit' not in state:
+        return False
+    last_poll = guardian_metrics.parse_timestamp(state['latestTimeStamp'])
+    if (last_poll.year, last_poll.month) != (now.year, now.month):
+        return False
+    wait_seconds = float(state.get('waitSeconds', default_wait_seconds))
+    return (now - last_poll).total_seconds() <= stale_polls * wait_seconds
+
+def decide(state, job_cost, duration_hours, now):
+    if not guardian_active(state, now):
+        return {'decision': 'ADMIT', 'reason': 'guardian-inactive', 'projectedJobCost': job_cost}
+    # accrue the running cost to now at the last polled burn rate
+    hourly_rate = float(state.get('hourlyRate', 0))
+    elapsed_hours = max((now - guardian_metrics.parse_timestamp(state['latestTimeStamp'])).total_seconds(), 0) / 3600
+    spend = float(state['runningCost']) + elapsed_hours * hourly_rate
+    remaining = float(state['budgetLimit']) - spend - hourly_rate * duration_hours
+    return {
+        'decision': 'ADMIT' if job_cost <= remaining else 'REJECT',
+        'reason': 'fits-remaining-budget' if job_cost <= remaining else 'exceeds-remaining-budget',
+        'projectedJobCost': job_cost,
+        'remainingBudget': remaining,
+        'accruedSpend': spend,
+        'hourlyRate': hourly_rate
+    }
+
+def response(status_code, body):
+    return {
+        'statusCode': status_code,
+        'headers': {'Content-Type': 'application/json'},
+        'body': json.dumps(body)
+    }
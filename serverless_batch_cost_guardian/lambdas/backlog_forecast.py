@@ -0,0 +1,62 @@
+import time
+import batch_actions
+import fargate_pricing
+import runtime_sketch
+
+# Forecast of what the queued jobs (SUBMITTED, PENDING and RUNNABLE) will cost once they
+# start: per job definition, the queued count times the Fargate rate of its resources
+# times a runtime percentile from its sketch (see runtime_sketch.py). Queued jobs only
+# become a cost while the compute environment can still place them, i.e. until new
+# submissions are stopped.
+
+SKETCH_CACHE_SECONDS = 300
+
+# per warm Lambda: job definition ARN -> (vCPUs, memory GB), name -> (time read, runtime hours)
+_resources = {}
+_runtimes = {}
+
+def queued_counts(batch_client, job_queues):
+    # queued jobs per job definition ARN across the job queues
+    counts = {}
+    for job_queue in job_queues:
+        for status in batch_actions.QUEUED_STATUSES:
+            paginator = batch_client.get_paginator('list_jobs')
+            for page in paginator.paginate(jobQueue=job_queue, jobStatus=status):
+                for job in page['jobSummaryList']:
+                    counts[job['jobDefinition']] = counts.get(job['jobDefinition'], 0) + 1
+    return counts
+
+def job_resources(batch_client, job_definition_arn):
+    # a job definition revision never changes, so its resources are cached for good. None for
+    # the definitions without containerProperties (multi-node and EKS), which are not priced
+    if job_definition_arn not in _resources:
+        definitions = batch_client.describe_job_definitions(jobDefinitions=[job_definition_arn])['jobDefinitions']
+        container_definitions = [definition for definition in definitions if 'containerProperties' in definition]
+        if not container_definitions:
+            _resources[job_definition_arn] = None
+        else:
+            requirements = {requirement['type']: float(requirement['value'])
+                for requirement in container_definitions[0]['containerProperties'].get('resourceRequirements', [])}
+            _resources[job_definition_arn] = (requirements.get('VCPU', 0.0), requirements.get('MEMORY', 0.0) / 1024)
+    return _resources[job_definition_arn]
+
+def runtime_hours(sketch_table, definition_name, runtime_quantile, default_hours):
+    read_at, hours = _runtimes.get(definition_name, (None, None))
+    if read_at is None or time.monotonic() - read_at > SKETCH_CACHE_SECONDS:
+        item = sketch_table.get_item(Key={'jobDefinition': definition_name}).get('Item')
+        hours = runtime_sketch.quantile(runtime_sketch.decode(item['sketch']), runtime_quantile) if item else None
+        _runtimes[definition_name] = (time.monotonic(), hours)
+    # job definitions without finished runs yet fall back to the default runtime
+    return default_hours if hours is None else hours
+
+def backlog_cost(batch_client, sketch_table, job_queues, runtime_quantile, default_hours):
+    cost = 0.0
+    for job_definition_arn, count in queued_counts(batch_client, job_queues).items():
+        resources = job_resources(batch_client, job_definition_arn)
+        if resources is None:
+            print(f"Skipping {count} queued jobs of {job_definition_arn}: no container resources to price")
+            continue
+        cpu, memory_gb = resources
+        definition_name = job_definition_arn.split('/')[-1].split(':')[0]
+        cost += count * fargate_pricing.hourly_cost(cpu, memory_gb) * runtime_hours(sketch_table, definition_name, runtime_quantile, default_hours)
+    return cost
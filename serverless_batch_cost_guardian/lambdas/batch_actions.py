@@ -0,0 +1,74 @@
+# Batch enforcement actions shared by the stop running jobs Lambda and the guardian
+# actions Lambda, from the gentlest (lowering maxvCpus) to terminating running jobs.
+
+QUEUED_STATUSES = ['SUBMITTED', 'PENDING', 'RUNNABLE']
+ACTIVE_STATUSES = ['STARTING', 'RUNNING']
+STATUSES = QUEUED_STATUSES + ACTIVE_STATUSES
+
+# tag a draining job gets, its value the time (UTC, ISO 8601) it is terminated if still running
+DRAIN_TAG = 'batch-cost-guardian:drain-deadline'
+
+def compute_environment_queues(batch_client, compute_env_name):
+    # names of the job queues placing jobs on the compute environment
+    job_queues = set()
+    paginator = batch_client.get_paginator('describe_job_queues')
+    for page in paginator.paginate():
+        for job_queue in page['jobQueues']:
+            if any(order['computeEnvironment'].split('/')[-1] == compute_env_name for order in job_queue['computeEnvironmentOrder']):
+                job_queues.add(job_queue['jobQueueName'])
+    return job_queues
+
+def disable_compute_environment(batch_client, compute_env_name):
+    batch_client.update_compute_environment(
+        computeEnvironment=compute_env_name,
+        state='DISABLED'
+    )
+
+def disable_job_queues(batch_client, job_queues):
+    for job_queue in job_queues:
+        batch_client.update_job_queue(
+            jobQueue=job_queue,
+            state='DISABLED'
+        )
+
+def reduce_max_vcpus(batch_client, compute_env_name, percent):
+    # running jobs keep their vCPUs, fewer queued jobs are placed; returns the new maxvCpus
+    response = batch_client.describe_compute_environments(computeEnvironments=[compute_env_name])
+    max_vcpus = response['computeEnvironments'][0]['computeResources']['maxvCpus']
+    reduced = max(1, int(max_vcpus * percent / 100))
+    if reduced < max_vcpus:
+        batch_client.update_compute_environment(
+            computeEnvironment=compute_env_name,
+            computeResources={'maxvCpus': reduced}
+        )
+    return reduced
+
+def cancel_queued_jobs(batch_client, job_queues, reason):
+    return stop_jobs(batch_client, job_queues, QUEUED_STATUSES, reason, batch_client.cancel_job)
+
+def terminate_jobs(batch_client, job_queues, reason):
+    return stop_jobs(batch_client, job_queues, STATUSES, reason, batch_client.terminate_job)
+
+def signal_drain(batch_client, job_queues, deadline):
+    # running jobs that watch their own tags (DescribeJobs) checkpoint and exit before the deadline
+    signalled_jobs = 0
+    for x in job_summaries(batch_client, job_queues, ACTIVE_STATUSES):
+        batch_client.tag_resource(resourceArn=x['jobArn'], tags={DRAIN_TAG: deadline})
+        signalled_jobs += 1
+    return signalled_jobs
+
+def stop_jobs(batch_client, job_queues, statuses, reason, stop):
+    stopped_jobs = 0
+    for x in job_summaries(batch_client, job_queues, statuses):
+        print(x['jobId'])
+        stop(jobId=x['jobId'], reason=reason)
+        stopped_jobs += 1
+    return stopped_jobs
+
+def job_summaries(batch_client, job_queues, statuses):
+    for job_queue in job_queues:
+        for status in statuses:
+            # list_jobs returns at most 100 jobs per page
+            paginator = batch_client.get_paginator('list_jobs')
+            for page in paginator.paginate(jobQueue=job_queue, jobStatus=status):
+                yield from page['jobSummaryList']
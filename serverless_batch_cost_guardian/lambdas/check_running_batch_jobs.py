@@ -0,0 +1,87 @@
+import json
+import boto3
+import datetime
+import os
+import time
+import batch_actions
+import guardian_metrics
+import job_cost_caps
+import queue_budgets
+import rate_governor
+
+batch_client = rate_governor.install(boto3.client('batch'), rate_governor.BOOKKEEPING, {'TerminateJob': rate_governor.ENFORCEMENT})
+dynamodb_resource = boto3.resource('dynamodb')
+latest_timestamp_running_cost_table = dynamodb_resource.Table(os.environ['LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME'])
+job_caps = job_cost_caps.load_caps(os.environ.get('JOB_COST_CAPS', ''))
+budgets_by_queue = queue_budgets.load_budgets(os.environ.get('QUEUE_BUDGETS', ''))
+
+def lambda_handler(event, context):
+    # runs on its own schedule, so a runaway job or queue is stopped long before the budget checker
+    # starts the guardian (whose polls only see the tasks it snapshotted)
+    if not job_cost_caps.enabled(job_caps) and not budgets_by_queue:
+        return {
+            'statusCode': 200,
+            'body': json.dumps('No job cost caps or job queue budgets')
+        }
+
+    time_now = datetime.datetime.now()
+    jobs = running_jobs()
+    capped_jobs = enforce_job_caps(jobs) if job_cost_caps.enabled(job_caps) else 0
+    stopped_queues = enforce_queue_budgets(jobs, time_now) if budgets_by_queue else []
+
+    return {
+        'statusCode': 200,
+        'body': json.dumps(f"{capped_jobs} jobs capped, job queues stopped: {stopped_queues}")
+    }
+
+def running_jobs():
+    # describe_jobs entries of the running jobs on every job queue of the compute environment
+    job_queues = batch_actions.compute_environment_queues(batch_client, os.environ['BATCH_COMPUTE_ENV_NAME']) | {os.environ['BATCH_JOB_QUEUE_NAME']}
+    job_ids = [x['jobId'] for x in batch_actions.job_summaries(batch_client, sorted(job_queues), ['RUNNING'])]
+    jobs = []
+    # describe_jobs takes 100 ids per call
+    for start in range(0, len(job_ids), 100):
+        response = batch_client.describe_jobs(jobs=job_ids[start:start + 100])
+        jobs.extend(job for job in response['jobs'] if job['status'] == 'RUNNING' and 'startedAt' in job)
+    return jobs
+
+def enforce_job_caps(jobs):
+    capped_jobs = 0
+    now_millis = time.time() * 1000
+    for job in jobs:
+        cap = job_cost_caps.cap_for(job, job_caps)
+        if cap is None:
+            continue
+        accrued = job_cost_caps.job_accrued_cost(job, now_millis)
+        if accrued < cap:
+            continue
+        print(f"Job {job['jobId']} reached its cost cap: ${accrued:.4f} of ${cap:.4f}")
+        batch_client.terminate_job(
+            jobId=job['jobId'],
+            reason='job-cost-cap-reached'
+        )
+        capped_jobs += 1
+
+    if capped_jobs:
+        guardian_metrics.emit({'JobCapTerminations': capped_jobs}, unit='Count')
+    return capped_jobs
+
+def enforce_queue_budgets(jobs, time_now):
+    # charge each budgeted queue the cost of its running jobs since the queue's accruedAt
+    # (from the start of the month for a new month item)
+    now_millis = time.time() * 1000
+    jobs_by_queue = {}
+    for job in jobs:
+        jobs_by_queue.setdefault(queue_budgets.queue_name(job['jobQueue']), []).append(job)
+
+    def cost_since(queue, since):
+        since_millis = (since or queue_budgets.month_start(time_now)).timestamp() * 1000
+        return sum(job_cost_caps.job_accrued_cost(dict(job, startedAt=max(job['startedAt'], since_millis)), now_millis)
+            for job in jobs_by_queue.get(queue, []))
+
+    overrun_queues = queue_budgets.overrun(latest_timestamp_running_cost_table, budgets_by_queue, time_now, cost_since)
+    if overrun_queues:
+        # as the STOP_QUEUES guardian action does inside an execution
+        batch_actions.disable_job_queues(batch_client, overrun_queues)
+        batch_actions.terminate_jobs(batch_client, overrun_queues, 'nuke-jobs-queue-budget-met')
+    return overrun_queues
@@ -1,19 +1,140 @@
 import json
 import boto3
+import datetime
+from decimal import Decimal
 import os 
+import time
+import fargate_pricing
+import guardian_metrics
+import running_tasks
 
 dynamodb_resource = boto3.resource('dynamodb')
 table_name =  os.environ['RUNNING_TABLE_NAME']
+latest_timestamp_running_cost_table_name = os.environ['LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME']
+latest_timestamp_running_cost_table = dynamodb_resource.Table(latest_timestamp_running_cost_table_name)
+aggregate_table = dynamodb_resource.Table(os.environ['AGGREGATE_TABLE_NAME'])
+
+# BatchWriteItem accepts at most 25 requests
+BATCH_WRITE_LIMIT = 25
+UNPROCESSED_RETRIES = 3
 
 def lambda_handler(event, context):
     
-    taskArn = event['detail']['taskArn']
+    # ECS STOPPED events are buffered in SQS by the EventBridge rule; EventBridge delivers
+    # at least once and a task can be reported stopped more than once, so dedupe by task ARN
+    message_ids_by_task = {}
+    details = {}
+    failures = []
+    for record in event['Records']:
+        try:
+            detail = json.loads(record['body'])['detail']
+            task_arn = detail['taskArn']
+        except (ValueError, KeyError) as e:
+            print(f"Malformed message {record['messageId']}: {e}")
+            failures.append(record['messageId'])
+            continue
+        message_ids_by_task.setdefault(task_arn, []).append(record['messageId'])
+        details.setdefault(task_arn, detail)
     
-    table = dynamodb_resource.Table(table_name)
+    task_arns = list(message_ids_by_task)
+    tombstoned = []
+    for chunk_start in range(0, len(task_arns), BATCH_WRITE_LIMIT):
+        chunk = task_arns[chunk_start:chunk_start + BATCH_WRITE_LIMIT]
+        failed = tombstone_tasks([details[task_arn] for task_arn in chunk])
+        for task_arn in chunk:
+            if task_arn in failed:
+                failures.extend(message_ids_by_task[task_arn])
+            else:
+                tombstoned.append(details[task_arn])
     
-    response = table.delete_item(Key = {'taskArn': taskArn})
-
+    # timestamp the stops on the enforcement timeline once their tombstones are written: the
+    # failed tasks return to the queue and are counted when a redelivery tombstones them, so
+    # the ADDs below never count a stop twice
+    record_stops(tombstoned)
+    
+    print(f"Tombstoned {len(task_arns)} tasks from {len(event['Records'])} messages, {len(failures)} failed")
+    
+    # only the failed messages return to the queue
     return {
-        'statusCode': 200,
-        'body': json.dumps('Hello from Lambda!')
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]
     }
+
+def tombstone_tasks(details):
+    # replace the tasks' items with tombstones rather than deleting them, so a snapshot
+    # running at the same time cannot re-insert a stopped task; the stream aggregator
+    # subtracts the replaced live items. Returns the task ARNs that could not be written
+    requests = [{'PutRequest': {'Item': running_tasks.tombstone_item(detail['taskArn'], stopped_at(detail))}}
+        for detail in details]
+    for attempt in range(UNPROCESSED_RETRIES + 1):
+        if attempt > 0:
+            time.sleep(0.05 * 2 ** attempt)
+        try:
+            response = dynamodb_resource.batch_write_item(RequestItems={table_name: requests})
+        except dynamodb_resource.meta.client.exceptions.ClientError as e:
+            print(f"BatchWriteItem failed: {e}")
+            continue
+        requests = response.get('UnprocessedItems', {}).get(table_name, [])
+        if not requests:
+            return []
+    return [request['PutRequest']['Item']['taskArn'] for request in requests]
+
+def stopped_at(detail):
+    return guardian_metrics.parse_event_timestamp(detail['stoppedAt']) if 'stoppedAt' in detail else datetime.datetime.now()
+
+def record_stops(details):
+    
+    if not details:
+        return
+    
+    response = latest_timestamp_running_cost_table.get_item(Key={
+      "partition-key": guardian_metrics.ENFORCEMENT_KEY
+    })
+    enforcement = response.get("Item")
+    
+    # only stops between budget detection and the last task stopping are measured
+    if enforcement is None or 'lastTaskStoppedAt' in enforcement:
+        return
+    
+    detected_at = guardian_metrics.parse_timestamp(enforcement['detectedAt'])
+    stops = []
+    window_spend = 0.0
+    for detail in details:
+        task_stopped_at = stopped_at(detail)
+        stops.append(task_stopped_at)
+        
+        # spend up to detection was already counted by the checker
+        task_hourly_cost = fargate_pricing.hourly_cost(int(detail['cpu'])/1024, int(detail['memory'])/1024)
+        window_spend += max(0.0, (task_stopped_at - detected_at).total_seconds()) / 3600 * task_hourly_cost
+    
+    # one update for the whole batch keeps writes to the timeline item bounded during stop storms
+    try:
+        response = latest_timestamp_running_cost_table.update_item(
+        Key={
+            'partition-key': guardian_metrics.ENFORCEMENT_KEY
+        },
+        UpdateExpression='set lastStoppedAt = :stopped_at add windowSpend :window_spend, stoppedTasks :stopped_tasks',
+            ConditionExpression='attribute_exists(detectedAt) AND attribute_not_exists(lastTaskStoppedAt)',
+            ExpressionAttributeValues={
+                ':stopped_at': guardian_metrics.format_timestamp(max(stops)),
+                ':window_spend': Decimal(str(window_spend)),
+                ':stopped_tasks': len(stops)
+            },
+            ReturnValues='ALL_NEW'
+        )
+    except latest_timestamp_running_cost_table.meta.client.exceptions.ConditionalCheckFailedException:
+        return
+    
+    # the stream aggregator closes the timeline when the last tracked task is gone; if it already
+    # processed these tombstones before the stops were recorded, close it here instead
+    aggregate_item = aggregate_table.get_item(Key={
+      "aggregate_key": "aggregate_key"
+    }).get("Item", {})
+    if 'terminateIssuedAt' in enforcement and aggregate_item.get('taskCount', 1) <= 0:
+        guardian_metrics.complete_enforcement(latest_timestamp_running_cost_table, response['Attributes']['lastStoppedAt'])
+    
+    if 'terminateIssuedAt' in enforcement:
+        terminate_issued_at = guardian_metrics.parse_timestamp(enforcement['terminateIssuedAt'])
+        for task_stopped_at in stops:
+            guardian_metrics.emit({
+                'TaskStopLatency': max(0.0, (task_stopped_at - terminate_issued_at).total_seconds())
+            })
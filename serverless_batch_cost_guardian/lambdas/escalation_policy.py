@@ -0,0 +1,63 @@
+import json
+
+# Optional tiered escalation policy: a table mapping percentages of the budget to
+# actions, so gentler and cheaper actions are taken before running jobs are killed.
+#
+#   [{"percent": 70, "action": "NOTIFY"},
+#    {"percent": 80, "action": "STOP_NEW"},
+#    {"percent": 85, "action": "REDUCE_MAX_VCPUS", "maxvCpusPercent": 50, "waitSeconds": 120},
+#    {"percent": 95, "action": "CANCEL_QUEUED", "waitSeconds": 30},
+#    {"percent": 100, "action": "TERMINATE"}]
+#
+# Tiers are sorted by percent and the index of the next tier to fire is kept in the
+# latest timestamp and running cost item (reset at the start of each execution), so a
+# poll compares the spend with a single tier unless tiers fire, and every tier fires
+# at most once. A tier's waitSeconds is the poll interval from the moment it fires.
+# Crossing the budget always terminates running jobs, with or without a TERMINATE tier.
+
+NOTIFY = 'NOTIFY'
+STOP_NEW = 'STOP_NEW'
+REDUCE_MAX_VCPUS = 'REDUCE_MAX_VCPUS'
+CANCEL_QUEUED = 'CANCEL_QUEUED'
+TERMINATE = 'TERMINATE'
+ACTIONS = (NOTIFY, STOP_NEW, REDUCE_MAX_VCPUS, CANCEL_QUEUED, TERMINATE)
+
+DEFAULT_MAX_VCPUS_PERCENT = 50
+
+def load_policy(policy_json):
+    tiers = []
+    for tier in json.loads(policy_json) if policy_json else []:
+        if tier.get('action') not in ACTIONS:
+            raise ValueError(f"Unknown escalation action {tier.get('action')}, expected one of {', '.join(ACTIONS)}")
+        tier = dict(tier, percent=float(tier['percent']))
+        if tier['action'] == REDUCE_MAX_VCPUS:
+            tier['maxvCpusPercent'] = float(tier.get('maxvCpusPercent', DEFAULT_MAX_VCPUS_PERCENT))
+        if 'waitSeconds' in tier:
+            tier['waitSeconds'] = int(tier['waitSeconds'])
+        tiers.append(tier)
+    return sorted(tiers, key=lambda tier: tier['percent'])
+
+def defers_stop_new(tiers):
+    # new submissions are only stopped by the policy, not when the guardian starts
+    return any(tier['action'] == STOP_NEW for tier in tiers)
+
+def submissions_stopped(tiers, tier_index):
+    # until a deferred STOP_NEW tier fires the burn rate can still rise legitimately
+    return not defers_stop_new(tiers) or any(tier['action'] == STOP_NEW for tier in tiers[:tier_index])
+
+def stop_new_percent(tiers):
+    return min(tier['percent'] for tier in tiers if tier['action'] == STOP_NEW)
+
+def crossed(tiers, tier_index, percent_used):
+    # tiers fired by reaching percent_used, and the index of the next tier to fire
+    fired = []
+    while tier_index < len(tiers) and percent_used >= tiers[tier_index]['percent']:
+        fired.append(tiers[tier_index])
+        tier_index += 1
+    return fired, tier_index
+
+def wait_seconds(tiers, tier_index, default_wait_seconds):
+    # poll interval of the last tier fired
+    if tier_index == 0:
+        return default_wait_seconds
+    return tiers[tier_index - 1].get('waitSeconds', default_wait_seconds)
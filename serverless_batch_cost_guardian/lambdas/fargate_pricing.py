@@ -0,0 +1,7 @@
+# Fargate Linux/x86 on-demand rates (USD)
+# TODO: Leverage AWS Price List API Query with boto3 to avoid hardcoding in price
+VCPU_HOUR_PRICE = 0.04048
+GB_HOUR_PRICE = 0.004445
+
+def hourly_cost(cpu_count, memory_gb):
+    return float(cpu_count) * VCPU_HOUR_PRICE + float(memory_gb) * GB_HOUR_PRICE
@@ -0,0 +1,21 @@
+import boto3
+import datetime
+import os
+import spend_history
+
+dynamodb_resource = boto3.resource('dynamodb')
+spend_history_table_name = os.environ['SPEND_HISTORY_TABLE_NAME']
+spend_history_table = dynamodb_resource.Table(spend_history_table_name)
+
+def lambda_handler(event, context):
+    
+    # billing period as "YYYY-MM", defaults to the current month
+    series_key = event.get('billingPeriod', spend_history.billing_period(datetime.datetime.now()))
+    
+    series = spend_history.read_series(spend_history_table, series_key)
+    
+    return {
+        'statusCode': 200,
+        'billingPeriod': series_key,
+        'samples': [dict(sample, timestamp=str(sample['timestamp'])) for sample in series]
+    }
@@ -0,0 +1,73 @@
+import json
+import boto3
+import os
+import batch_actions
+import escalation_policy
+import guardian_metrics
+import rate_governor
+
+batch_client = rate_governor.install(boto3.client('batch'), rate_governor.ENFORCEMENT)
+compute_env_name = os.environ['BATCH_COMPUTE_ENV_NAME']
+job_queue_name = os.environ['BATCH_JOB_QUEUE_NAME']
+escalation_topic_arn = os.environ.get('ESCALATION_TOPIC_ARN', '')
+if escalation_topic_arn:
+    sns_client = boto3.client('sns')
+
+def lambda_handler(event, context):
+
+    # Dispatch the actions returned by the high velocity Batch spend checker: escalation
+    # tiers reached since the last poll and job queues over their own budget
+    guardian_metrics.emit_time_to_first_action(event)
+    results = []
+    for action in event.get('actions', []):
+        results.append(dict(action, result=dispatch(action, event)))
+        print(f"{action['action']}: {results[-1]['result']}")
+
+    return {
+        'statusCode': 200,
+        'results': results
+    }
+
+def dispatch(action, event):
+    if action['action'] == escalation_policy.NOTIFY:
+        return notify(action, event)
+    if action['action'] == escalation_policy.STOP_NEW:
+        batch_actions.disable_compute_environment(batch_client, compute_env_name)
+        batch_actions.disable_job_queues(batch_client, [job_queue_name])
+        return 'submissions stopped'
+    if action['action'] == escalation_policy.REDUCE_MAX_VCPUS:
+        max_vcpus = batch_actions.reduce_max_vcpus(batch_client, compute_env_name, action['maxvCpusPercent'])
+        return f"maxvCpus {max_vcpus}"
+    if action['action'] == escalation_policy.CANCEL_QUEUED:
+        cancelled_jobs = batch_actions.cancel_queued_jobs(batch_client, job_queues(), 'nuke-jobs-escalation-cancel-queued')
+        guardian_metrics.emit({'EscalationCancelledJobs': cancelled_jobs}, unit='Count')
+        return f"{cancelled_jobs} queued jobs cancelled"
+    if action['action'] == 'DRAIN':
+        # running jobs get the drain deadline as a tag, the checker terminates the jobs left at the deadline
+        signalled_jobs = batch_actions.signal_drain(batch_client, job_queues(), action['drainDeadline'])
+        guardian_metrics.emit({'DrainSignalledJobs': signalled_jobs}, unit='Count')
+        return f"{signalled_jobs} running jobs signalled to drain by {action['drainDeadline']}"
+    if action['action'] == 'STOP_QUEUES':
+        # a job queue over its own budget is disabled and its jobs terminated while the rest
+        # of the compute environment keeps running
+        batch_actions.disable_job_queues(batch_client, action['jobQueues'])
+        terminated_jobs = batch_actions.terminate_jobs(batch_client, action['jobQueues'], 'nuke-jobs-queue-budget-met')
+        return f"{terminated_jobs} jobs terminated"
+    raise ValueError(f"Unknown guardian action {action['action']}")
+
+def notify(action, event):
+    guardian_metrics.emit({'EscalationTier': action['percent']}, unit='Percent')
+    if not escalation_topic_arn:
+        return 'no escalation topic'
+    msg = "Batch Compute Environment " + compute_env_name + " reached " + f"{action['percent']:g}" + "% of its Budget: $" \
+        + f"{float(event['runningCost']):.2f}" + " (USD) out of Budget limit $" + f"{float(event['budgetLimit']):.2f}" + " (USD)."
+    sns_client.publish(
+        TopicArn=escalation_topic_arn,
+        Message=msg,
+        Subject="AWS Batch Cost Guardian escalation."
+    )
+    return 'notified'
+
+def job_queues():
+    # every job queue sharing the compute environment
+    return [job_queue_name] + sorted(batch_actions.compute_environment_queues(batch_client, compute_env_name) - {job_queue_name})
@@ -0,0 +1,71 @@
+import datetime
+import json
+import time
+
+# Enforcement metrics are published with CloudWatch Embedded Metric Format: one
+# structured log line per data point, extracted by CloudWatch Logs without any
+# PutMetricData calls (or IAM permissions) from the Lambdas.
+
+NAMESPACE = 'ServerlessBatchCostGuardian'
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# key of the enforcement timeline item in the latest timestamp running cost table
+ENFORCEMENT_KEY = 'enforcement'
+
+def emit(metrics, unit='Seconds'):
+    record = {
+        '_aws': {
+            'Timestamp': int(time.time() * 1000),
+            'CloudWatchMetrics': [{
+                'Namespace': NAMESPACE,
+                'Dimensions': [[]],
+                'Metrics': [{'Name': name, 'Unit': unit} for name in metrics]
+            }]
+        }
+    }
+    record.update({name: float(value) for name, value in metrics.items()})
+    print(json.dumps(record))
+
+def emit_time_to_first_action(event):
+    # the first check's decision takes effect in the state it dispatches to (terminating jobs or
+    # dispatching guardian actions), or in the checker itself when it needs no action
+    if event.get('firstDecision'):
+        emit({'TimeToFirstAction': (datetime.datetime.now() - parse_timestamp(event['startTime'])).total_seconds()})
+
+def format_timestamp(timestamp):
+    # str() drops the fractional part when it is zero, strptime with %f would then fail
+    return timestamp.strftime(TIMESTAMP_FORMAT)
+
+def parse_timestamp(timestamp_str):
+    return datetime.datetime.strptime(timestamp_str, TIMESTAMP_FORMAT)
+
+def parse_event_timestamp(timestamp_str):
+    # ECS events carry ISO 8601 UTC timestamps, e.g. 2022-10-20T10:15:30.123Z
+    return datetime.datetime.strptime(timestamp_str.rstrip('Z')[:26], '%Y-%m-%dT%H:%M:%S.%f' if '.' in timestamp_str else '%Y-%m-%dT%H:%M:%S')
+
+def seconds_between(start_str, end_str):
+    return (parse_timestamp(end_str) - parse_timestamp(start_str)).total_seconds()
+
+def complete_enforcement(table, last_task_stopped_at):
+    # close the enforcement timeline exactly once and publish the end-to-end phases
+    try:
+        response = table.update_item(
+        Key={
+            'partition-key': ENFORCEMENT_KEY
+        },
+        UpdateExpression='set lastTaskStoppedAt = :last_task_stopped_at',
+            ConditionExpression='attribute_exists(terminateIssuedAt) AND attribute_not_exists(lastTaskStoppedAt)',
+            ExpressionAttributeValues={
+                ':last_task_stopped_at': last_task_stopped_at
+            },
+            ReturnValues='ALL_NEW'
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return
+
+    enforcement = response['Attributes']
+    emit({
+        'TerminationCompleteLatency': max(0.0, seconds_between(enforcement['terminateIssuedAt'], last_task_stopped_at)),
+        'EndToEndLatency': seconds_between(enforcement['crossedAt'], last_task_stopped_at)
+    })
+    emit({'EnforcementWindowSpend': enforcement['windowSpend']}, unit='None')
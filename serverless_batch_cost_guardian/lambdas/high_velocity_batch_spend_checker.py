@@ -2,14 +2,62 @@ import json
 import boto3
 import datetime
 from decimal import Decimal
+import math
 import os
+import backlog_forecast
+import batch_actions
+import escalation_policy
+import fargate_pricing
+import guardian_metrics
+import job_cost_caps
+import queue_budgets
+import rate_anomaly
+import rate_governor
+import spend_history
 
 # run these environment variable seetings on cold start (outside handler) only since they are static
 dynamodb_resource = boto3.resource('dynamodb')
+# cost cap terminations take priority over the backlog forecast's Batch calls
+batch_client = rate_governor.install(boto3.client('batch'), rate_governor.BOOKKEEPING, {'TerminateJob': rate_governor.ENFORCEMENT})
 aggregate_table_name = os.environ['AGGREGATE_TABLE_NAME']
 latest_timestamp_running_cost_table_name = os.environ['LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME']
 aggregate_table = dynamodb_resource.Table(aggregate_table_name)
+spend_history_table_name = os.environ['SPEND_HISTORY_TABLE_NAME']
 latest_timestamp_running_cost_table = dynamodb_resource.Table(latest_timestamp_running_cost_table_name)
+spend_history_table = dynamodb_resource.Table(spend_history_table_name)
+wait_time_seconds = int(os.environ['WAIT_TIME_SECONDS'])
+
+# burn rate anomaly detection: on a flagged poll either SHORTEN_WAIT (poll again after
+# ANOMALY_WAIT_SECONDS) or TERMINATE (stop running jobs without waiting for the budget)
+anomaly_action = os.environ.get('ANOMALY_ACTION', 'SHORTEN_WAIT')
+anomaly_wait_seconds = int(os.environ.get('ANOMALY_WAIT_SECONDS', '10'))
+rate_ewma_alpha = float(os.environ.get('RATE_EWMA_ALPHA', '0.3'))
+rate_window = int(os.environ.get('RATE_WINDOW', '5'))
+rate_increase_tolerance = float(os.environ.get('RATE_INCREASE_TOLERANCE', '0.01'))
+rate_spike_z_score = float(os.environ.get('RATE_SPIKE_Z_SCORE', '3'))
+rate_warmup_samples = int(os.environ.get('RATE_WARMUP_SAMPLES', '3'))
+
+# optional per-job cost caps: capped tasks are kept on a priority queue ordered by cap breach time
+job_caps = job_cost_caps.load_caps(os.environ.get('JOB_COST_CAPS', ''))
+if job_cost_caps.enabled(job_caps):
+    running_table = dynamodb_resource.Table(os.environ['RUNNING_TABLE_NAME'])
+
+# optional per-job-queue budgets for queues sharing the compute environment
+budgets_by_queue = queue_budgets.load_budgets(os.environ.get('QUEUE_BUDGETS', ''))
+
+# optional tiered escalation policy: gentler actions at percentages of the budget
+escalation_tiers = escalation_policy.load_policy(os.environ.get('ESCALATION_POLICY', ''))
+
+# backlog forecast from the runtime sketches of finished jobs, while queued jobs can still start
+runtime_sketch_table_name = os.environ.get('RUNTIME_SKETCH_TABLE_NAME')
+if runtime_sketch_table_name:
+    runtime_sketch_table = dynamodb_resource.Table(runtime_sketch_table_name)
+backlog_runtime_quantile = float(os.environ.get('BACKLOG_RUNTIME_QUANTILE', '0.5'))
+backlog_default_runtime_hours = float(os.environ.get('BACKLOG_DEFAULT_RUNTIME_HOURS', '1'))
+
+# optional drain mode: once the budget left only pays for DRAIN_GRACE_SECONDS of the burn rate,
+# running jobs are signalled to checkpoint and the jobs still running at the deadline are terminated
+drain_grace_seconds = int(os.environ.get('DRAIN_GRACE_SECONDS', '0'))
 
 def lambda_handler(event, context):
     
@@ -17,8 +65,18 @@ def lambda_handler(event, context):
       "aggregate_key": "aggregate_key"
     })
     
-    total_cpu = response["Item"]["totalCpu"]
-    total_memory = response["Item"]["totalMemory"]
+    # the first check runs alongside the ECS snapshot: until this execution's aggregate is
+    # written, only the initial accrual (startCost) is known. Later polls always use the
+    # aggregate, which an overlapping newer execution re-stamps with its own startTime
+    aggregate_item = response.get("Item", {})
+    snapshot_pending = bool(event.get("firstCheck")) and aggregate_item.get("startTime") != event.get("startTime")
+    if snapshot_pending:
+        total_cpu = 0
+        total_memory = 0
+    else:
+        # the stream aggregator creates the totals with the first task it adds
+        total_cpu = response["Item"].get("totalCpu", 0)
+        total_memory = response["Item"].get("totalMemory", 0)
     
     budget_limit = float(event["budgetLimit"])
 
@@ -30,43 +88,288 @@ def lambda_handler(event, context):
     
     # initialize a DDB with start_cost in previous step SFN and get item here 
     running_cost = response["Item"]["runningCost"]
+    state_item = response["Item"]
     
     time_now = datetime.datetime.now()
     last_timestamp = datetime.datetime.strptime(last_timestamp_str, "%Y-%m-%d %H:%M:%S.%f")
     
     time_delta = time_now - last_timestamp
     time_since_last_poll = get_hours(time_delta)
-    current_cpu_cost = time_since_last_poll * float(total_cpu) * 0.04048 # TODO: Leverage AWS Price List API Query with boto3 to avoid hardcoding in price
-    current_memory_cost = time_since_last_poll * float(total_memory) * 0.004445 # TODO: Leverage AWS Price List API Query with boto3 to avoid hardcoding in price
+    hourly_rate = fargate_pricing.hourly_cost(total_cpu, total_memory)
+    
+    current_cost = float(running_cost) + time_since_last_poll * hourly_rate
     
-    current_cost = float(running_cost) + current_cpu_cost + current_memory_cost
+    if not snapshot_pending:
+        # append this poll to the billing period's spend history
+        spend_history.append_sample(spend_history_table, time_now, total_cpu, total_memory, hourly_rate, current_cost)
     
-    if (current_cost > budget_limit):
-        # nuke remaining jobs
+    # what this poll knows, shared by the checks below. Each check returns the actions it needs
+    # and its wait before the next poll (None when it has none); the checks that escalate move
+    # tierIndex and the ones with state of their own add attributes to updates
+    poll = {
+        'timeNow': time_now,
+        'hoursSinceLastPoll': time_since_last_poll,
+        'currentCost': current_cost,
+        'accruedCost': current_cost - float(running_cost),
+        'budgetLimit': budget_limit,
+        'hourlyRate': hourly_rate,
+        'snapshotPending': snapshot_pending,
+        'aggregateItem': aggregate_item,
+        'stateItem': state_item,
+        'rateState': rate_anomaly.state_from_item(state_item),
+        'tierIndex': int(state_item.get('tierIndex', 0)),
+        'anomaly': None,
+        'backlogCost': 0.0,
+        'cappedJobs': 0,
+        'updates': {}
+    }
+    
+    anomaly_actions, anomaly_wait = check_rate_anomaly(poll)
+    tier_actions, tier_wait = check_escalation_tiers(poll)
+    backlog_actions, backlog_wait = check_backlog_forecast(poll)
+    anomaly = poll['anomaly']
+    terminate_tier = any(action['action'] == escalation_policy.TERMINATE for action in tier_actions + backlog_actions)
+    deadline = drain_deadline(poll)
+    drain_expired = deadline is not None and time_now >= deadline
+    
+    # running jobs are terminated when the budget is crossed, on a burn rate anomaly in TERMINATE
+    # mode, by a TERMINATE tier or at the drain deadline
+    trigger = None
+    if anomaly and anomaly_action == 'TERMINATE':
+        trigger = anomaly
+    elif current_cost > budget_limit:
+        # a crossing on a poll that also flagged an anomaly is recorded as the anomaly
+        trigger = anomaly or 'budget'
+    elif terminate_tier:
+        trigger = 'escalation'
+    elif drain_expired:
+        trigger = 'drain'
+    
+    if trigger:
+        record_detection(last_timestamp, float(running_cost), time_now, current_cost, budget_limit, hourly_rate, trigger)
+        # nuke remaining jobs (no wait before the stop running jobs state)
         return {
             'budgetMet': 'YES',
-            'budgetLimit': budget_limit
+            'budgetLimit': budget_limit,
+            'startTime': event.get('startTime'),
+            'firstDecision': bool(event.get('firstCheck')),
+            'anomaly': anomaly,
+            'backlogCost': poll['backlogCost'],
+            'actionsRequired': 'NO',
+            'waitSeconds': 0
         }
-        
+    
+    drain_actions, drain_wait = check_drain(poll)
+    queue_actions, queue_wait = check_queue_budgets(poll)
+    # the poll interval of the last tier fired, which the other checks can only shorten
+    wait_seconds = backlog_wait if backlog_wait is not None else tier_wait
+    wait_seconds = min([wait_seconds] + [wait for wait in (anomaly_wait, drain_wait, queue_wait) if wait is not None])
+    # the cap queue is read up to the next poll, so the caps are checked once the wait is known
+    cap_actions, cap_wait = check_job_caps(poll, wait_seconds)
+    if cap_wait is not None:
+        wait_seconds = min(wait_seconds, cap_wait)
+    
     # update item running cost to DDB with new current cost value
     # update item last timestamp to DDB with new datetime now
+    # (not while the snapshot is pending: nothing was charged, the next poll charges that time)
+    rate_state = poll['rateState']
+    attributes = {} if snapshot_pending else {
+        'latestTimeStamp': guardian_metrics.format_timestamp(time_now),
+        'runningCost': Decimal(str(current_cost))
+    }
+    attributes.update({
+        'rateEwma': Decimal(str(rate_state['rateEwma'])),
+        'rateVariance': Decimal(str(rate_state['rateVariance'])),
+        'recentRates': [Decimal(str(rate)) for rate in rate_state['recentRates']],
+        'rateSamples': rate_state['rateSamples'],
+        'tierIndex': poll['tierIndex'],
+        'hourlyRate': Decimal(str(hourly_rate)),
+        # admission control stops enforcing the item once polls stop refreshing it
+        'waitSeconds': wait_seconds
+    }, **poll['updates'])
+    # per-queue attribute names contain '#', so every attribute goes through a name placeholder
     response = latest_timestamp_running_cost_table.update_item(
     Key={
         'partition-key': "pk"
     },
-    UpdateExpression='set latestTimeStamp = :time_now, runningCost = :current_cost',
-        ExpressionAttributeValues={
-            ':current_cost': Decimal(str(current_cost)),
-            ':time_now': str(time_now)
-        }    
+    UpdateExpression='set ' + ', '.join(f"#attribute{index} = :attribute{index}" for index in range(len(attributes))),
+        ExpressionAttributeNames={f"#attribute{index}": name for index, name in enumerate(attributes)},
+        ExpressionAttributeValues={f":attribute{index}": value for index, value in enumerate(attributes.values())}
     )
     
+    # dispatched by the guardian actions Lambda before the next wait
+    actions = anomaly_actions + tier_actions + backlog_actions + drain_actions + queue_actions + cap_actions
+    if event.get("firstCheck") and not actions:
+        # nothing to dispatch: the first check's decision is to keep polling
+        guardian_metrics.emit({'TimeToFirstAction': (time_now - last_timestamp).total_seconds()})
+    
     return {
         'statusCode': 200,
         'budgetLimit': budget_limit,
-        'budgetMet': 'NO'
+        'startTime': event.get('startTime'),
+        'firstDecision': bool(event.get('firstCheck')),
+        'budgetMet': 'NO',
+        'runningCost': current_cost,
+        'backlogCost': poll['backlogCost'],
+        'anomaly': anomaly,
+        'cappedJobs': poll['cappedJobs'],
+        'actionsRequired': 'YES' if actions else 'NO',
+        'actions': actions,
+        'waitSeconds': wait_seconds
     }
 
+def check_rate_anomaly(poll):
+    # the spend per hour should only fall once new submissions are stopped
+    if poll['snapshotPending'] or poll['hoursSinceLastPoll'] <= 0:
+        return [], None
+    # the cost accrued since the last poll, per hour of the poll interval
+    rate = poll['accruedCost'] / poll['hoursSinceLastPoll']
+    if escalation_policy.submissions_stopped(escalation_tiers, poll['tierIndex']):
+        poll['anomaly'] = rate_anomaly.detect(poll['rateState'], rate, rate_increase_tolerance, rate_spike_z_score, rate_warmup_samples)
+    poll['rateState'] = rate_anomaly.update(poll['rateState'], rate, rate_ewma_alpha, rate_window)
+    if not poll['anomaly']:
+        return [], None
+    print(f"Burn rate anomaly ({poll['anomaly']}): ${rate:.4f}/hour accrued against EWMA ${poll['rateState']['rateEwma']:.4f}/hour")
+    guardian_metrics.emit({'RateAnomaly': 1}, unit='Count')
+    # SHORTEN_WAIT polls again sooner, TERMINATE ends the wait altogether
+    return [], anomaly_wait_seconds
+
+def check_escalation_tiers(poll):
+    # tiers reached since the last poll, each fires once per execution
+    fired_tiers, poll['tierIndex'] = escalation_policy.crossed(escalation_tiers, poll['tierIndex'], 100 * poll['currentCost'] / poll['budgetLimit'])
+    for tier in fired_tiers:
+        print(f"Escalation tier {tier['percent']:g}% ({tier['action']}) reached: ${poll['currentCost']:.4f} of ${poll['budgetLimit']:.4f}")
+    return [dict(tier) for tier in fired_tiers], escalation_policy.wait_seconds(escalation_tiers, poll['tierIndex'], wait_time_seconds)
+
+def escalate_to_stop_new(poll):
+    # fire the deferred STOP_NEW tier, and the tiers below it, before the spend reaches it
+    fired_tiers, poll['tierIndex'] = escalation_policy.crossed(escalation_tiers, poll['tierIndex'], escalation_policy.stop_new_percent(escalation_tiers))
+    return [dict(tier) for tier in fired_tiers]
+
+def check_backlog_forecast(poll):
+    # queued jobs are a future cost as long as they can start: a backlog forecast to overrun
+    # the budget escalates to the deferred STOP_NEW tier (and the tiers below it) right away
+    if not runtime_sketch_table_name or escalation_policy.submissions_stopped(escalation_tiers, poll['tierIndex']):
+        return [], None
+    job_queues = {os.environ['BATCH_JOB_QUEUE_NAME']} | batch_actions.compute_environment_queues(batch_client, os.environ['BATCH_COMPUTE_ENV_NAME'])
+    poll['backlogCost'] = backlog_forecast.backlog_cost(batch_client, runtime_sketch_table, sorted(job_queues),
+        backlog_runtime_quantile, backlog_default_runtime_hours)
+    print(f"Queued jobs are forecast to cost ${poll['backlogCost']:.4f}")
+    forecast_cost = poll['currentCost'] + poll['backlogCost']
+    if forecast_cost <= poll['budgetLimit']:
+        return [], None
+    print(f"Forecast ${forecast_cost:.4f} overruns the budget, stopping new submissions")
+    guardian_metrics.emit({'BacklogForecastEscalation': 1}, unit='Count')
+    actions = escalate_to_stop_new(poll)
+    return actions, escalation_policy.wait_seconds(escalation_tiers, poll['tierIndex'], wait_time_seconds)
+
+def drain_deadline(poll):
+    # set by the poll that started draining, for the rest of the execution
+    state_item = poll['stateItem']
+    return guardian_metrics.parse_timestamp(state_item['drainDeadline']) if 'drainDeadline' in state_item else None
+
+def check_drain(poll):
+    # once the budget left only pays for drain_grace_seconds of the burn rate, running jobs
+    # are signalled to checkpoint; the jobs still running at the deadline are terminated
+    deadline = drain_deadline(poll)
+    if deadline is not None:
+        return [], max(1, math.ceil((deadline - poll['timeNow']).total_seconds()))
+    if drain_grace_seconds <= 0 or poll['snapshotPending'] or poll['hourlyRate'] <= 0:
+        return [], None
+    # seconds of the current burn rate the budget left pays for
+    budget_left = poll['budgetLimit'] - poll['currentCost']
+    budget_seconds = budget_left / poll['hourlyRate'] * 3600
+    if budget_seconds > drain_grace_seconds:
+        # poll again when the drain should start instead of a full wait later
+        return [], max(1, math.ceil(budget_seconds - drain_grace_seconds))
+    deadline = poll['timeNow'] + datetime.timedelta(seconds=budget_seconds)
+    print(f"Draining running jobs: ${budget_left:.4f} left pays for {budget_seconds:.0f} seconds at ${poll['hourlyRate']:.4f}/hour")
+    guardian_metrics.emit({'DrainGraceSeconds': budget_seconds})
+    poll['updates']['drainDeadline'] = guardian_metrics.format_timestamp(deadline)
+    actions = []
+    # no new job may start while the running ones drain
+    if not escalation_policy.submissions_stopped(escalation_tiers, poll['tierIndex']):
+        actions = escalate_to_stop_new(poll)
+    actions.append({'action': 'DRAIN', 'graceSeconds': budget_seconds, 'drainDeadline': deadline.strftime('%Y-%m-%dT%H:%M:%SZ')})
+    return actions, max(1, math.ceil(budget_seconds))
+
+def check_job_caps(poll, wait_seconds):
+    # capped jobs are terminated here, ahead of the actions dispatched after the poll
+    if not job_cost_caps.enabled(job_caps):
+        return [], None
+    poll['cappedJobs'], next_breach_seconds = enforce_job_caps(poll['timeNow'], wait_seconds)
+    if next_breach_seconds is None:
+        return [], None
+    # wake up when the next capped job reaches its cap instead of a full wait later
+    return [], max(1, math.ceil(next_breach_seconds))
+
+def check_queue_budgets(poll):
+    # per-queue rates from the aggregate, charged to the queues' month-to-date items for this
+    # poll's interval (the scheduled running jobs check charges the time between executions)
+    if not budgets_by_queue or poll['snapshotPending']:
+        return [], None
+    rates = queue_budgets.queue_rates(poll['aggregateItem'])
+    last_poll = poll['timeNow'] - datetime.timedelta(hours=poll['hoursSinceLastPoll'])
+
+    def cost_since(queue, since):
+        start = max(since, last_poll) if since else last_poll
+        return rates.get(queue, 0.0) * get_hours(poll['timeNow'] - start)
+
+    overrun_queues = queue_budgets.overrun(latest_timestamp_running_cost_table, budgets_by_queue, poll['timeNow'], cost_since)
+    if not overrun_queues:
+        return [], None
+    return [{'action': 'STOP_QUEUES', 'jobQueues': overrun_queues}], None
+
+def enforce_job_caps(time_now, wait_seconds):
+    # terminate the jobs whose accrued cost reached their cap; only the head of the queue
+    # (tasks breaching before the next poll) is read
+    due = job_cost_caps.breaching_before(running_table, time_now + datetime.timedelta(seconds=wait_seconds))
+    capped_jobs = 0
+    next_breach_seconds = None
+    for item in due:
+        breach_at = guardian_metrics.parse_timestamp(item['capBreachAt'])
+        if breach_at > time_now:
+            next_breach_seconds = (breach_at - time_now).total_seconds()
+            break
+        accrued = job_cost_caps.accrued_cost(item, time_now)
+        print(f"Job {item['jobId']} reached its cost cap: ${accrued:.4f} of ${float(item['costCap']):.4f}")
+        batch_client.terminate_job(
+            jobId=item['jobId'],
+            reason='job-cost-cap-reached'
+        )
+        job_cost_caps.dequeue(running_table, item['taskArn'], time_now)
+        capped_jobs += 1
+    if capped_jobs:
+        guardian_metrics.emit({'JobCapTerminations': capped_jobs}, unit='Count')
+    return capped_jobs, next_breach_seconds
+
+def record_detection(last_timestamp, running_cost, time_now, current_cost, budget_limit, hourly_rate, trigger):
+    
+    # cost accrues linearly between polls, so interpolate when it actually crossed the limit
+    # (an anomaly escalation has not crossed it: the timeline starts at detection)
+    if current_cost <= budget_limit:
+        crossed_at = time_now
+    elif running_cost >= budget_limit or current_cost <= running_cost:
+        crossed_at = last_timestamp
+    else:
+        crossed_at = last_timestamp + (time_now - last_timestamp) * ((budget_limit - running_cost) / (current_cost - running_cost))
+    
+    # start a new enforcement timeline; the stop and delete Lambdas add their phases to it
+    latest_timestamp_running_cost_table.put_item(
+    Item = {
+        'partition-key': guardian_metrics.ENFORCEMENT_KEY,
+        'crossedAt': guardian_metrics.format_timestamp(crossed_at),
+        'detectedAt': guardian_metrics.format_timestamp(time_now),
+        'budgetLimit': Decimal(str(budget_limit)),
+        'hourlyRateAtDetection': Decimal(str(hourly_rate)),
+        'windowSpend': Decimal(str(max(current_cost - budget_limit, 0))),
+        'stoppedTasks': 0,
+        'trigger': trigger
+        }
+    )
+    
+    guardian_metrics.emit({'DetectionLatency': (time_now - crossed_at).total_seconds()})
+
 def get_hours(time):
     duration_in_s = time.total_seconds()
     old_result = divmod(duration_in_s, 3600)[0]
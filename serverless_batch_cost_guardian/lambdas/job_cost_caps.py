@@ -0,0 +1,96 @@
+import datetime
+import json
+import fargate_pricing
+import guardian_metrics
+
+# Optional per-job cost caps, so one oversized or hung job is terminated on its own
+# before it burns through the compute environment's budget. Caps are configured as
+#
+#   {"jobDefinitions": {"<job definition name>": 25.0}, "tags": {"<key>=<value>": 10.0}}
+#
+# and the lowest matching cap applies. The snapshot stores each capped task's start
+# time, hourly cost and the time its accrued cost reaches the cap (capBreachAt) on its
+# running tasks table item. A sparse index keyed by a constant capQueue and capBreachAt
+# orders those items like a priority queue, so each poll reads only the head of the
+# queue: the tasks breaching before the next poll. Outside guardian executions, when
+# nothing is snapshotted, check_running_batch_jobs.py checks the running jobs on a schedule.
+
+CAP_BREACH_INDEX = 'cap-breach-index'
+CAP_QUEUE = 'cap'
+
+def load_caps(caps_json):
+    caps = json.loads(caps_json) if caps_json else {}
+    return {
+        'jobDefinitions': {name: float(cap) for name, cap in caps.get('jobDefinitions', {}).items()},
+        'tags': {tag: float(cap) for tag, cap in caps.get('tags', {}).items()}
+    }
+
+def enabled(caps):
+    return bool(caps['jobDefinitions'] or caps['tags'])
+
+def cap_for(job, caps):
+    # job is a describe_jobs entry: jobDefinition is an ARN ending in <name>:<revision>
+    definition_name = job['jobDefinition'].split('/')[-1].split(':')[0]
+    matched = []
+    if definition_name in caps['jobDefinitions']:
+        matched.append(caps['jobDefinitions'][definition_name])
+    for key, value in job.get('tags', {}).items():
+        if f"{key}={value}" in caps['tags']:
+            matched.append(caps['tags'][f"{key}={value}"])
+    return min(matched) if matched else None
+
+def task_started_at(task, now):
+    # ECS returns timezone aware UTC datetimes; tasks still provisioning accrue from now
+    started_at = task.get('startedAt') or now
+    if started_at.tzinfo is not None:
+        started_at = started_at.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return started_at
+
+def cap_attributes(job_id, started_at, cpu_count, memory_gb, cap):
+    hourly_cost = fargate_pricing.hourly_cost(cpu_count, memory_gb)
+    breach_at = started_at + datetime.timedelta(hours=cap / hourly_cost) if hourly_cost > 0 else datetime.datetime.max
+    return {
+        'jobId': job_id,
+        'startedAt': guardian_metrics.format_timestamp(started_at),
+        'costCap': str(cap),
+        'capQueue': CAP_QUEUE,
+        'capBreachAt': guardian_metrics.format_timestamp(breach_at)
+    }
+
+def accrued_cost(item, now):
+    elapsed_hours = (now - guardian_metrics.parse_timestamp(item['startedAt'])).total_seconds() / 3600
+    return max(elapsed_hours, 0) * fargate_pricing.hourly_cost(item['taskCpuCount'], item['taskMemoryGb'])
+
+def job_accrued_cost(job, now_millis):
+    # describe_jobs entry of a running job: startedAt in epoch milliseconds, MEMORY in MiB
+    requirements = {requirement['type']: float(requirement['value'])
+        for requirement in job.get('container', {}).get('resourceRequirements', [])}
+    elapsed_hours = max(now_millis - job['startedAt'], 0) / 3600000
+    return elapsed_hours * fargate_pricing.hourly_cost(requirements.get('VCPU', 0.0), requirements.get('MEMORY', 0.0) / 1024)
+
+def breaching_before(running_table, until):
+    # head of the priority queue: capped tasks reaching their cap at or before until, earliest first
+    items = []
+    kwargs = {
+        'IndexName': CAP_BREACH_INDEX,
+        'KeyConditionExpression': 'capQueue = :cap_queue AND capBreachAt <= :until',
+        'ExpressionAttributeValues': {':cap_queue': CAP_QUEUE, ':until': guardian_metrics.format_timestamp(until)}
+    }
+    while True:
+        response = running_table.query(**kwargs)
+        items.extend(response['Items'])
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def dequeue(running_table, task_arn, now):
+    # drop a terminated task from the queue; its item becomes a tombstone anyway once the task stops
+    try:
+        running_table.update_item(
+            Key={'taskArn': task_arn},
+            UpdateExpression='remove capQueue set capTerminatedAt = :now',
+            ConditionExpression='attribute_exists(taskArn) AND attribute_not_exists(stoppedAt)',
+            ExpressionAttributeValues={':now': guardian_metrics.format_timestamp(now)}
+        )
+    except running_table.meta.client.exceptions.ConditionalCheckFailedException:
+        pass
@@ -0,0 +1,99 @@
+import json
+from decimal import Decimal
+import fargate_pricing
+import guardian_metrics
+
+# Optional per-job-queue budgets for job queues sharing the monitored compute environment,
+# configured as {"<job queue name>": 150.0} (USD accrued by the queue's tasks in the month).
+# The snapshot attributes every task to its job queue (the Batch job id is the task's
+# startedBy) and the stream aggregator keeps per-queue totals next to the global ones.
+# Each queue's month-to-date cost is its own item in the latest timestamp table,
+# "queueCost#<queue>#<YYYY-MM>", which guardian executions do not reset. It is accrued up
+# to accruedAt by the checker's polls (from the aggregate's per-queue rates) and, between
+# executions, by the scheduled running jobs check (from the jobs' start times); accruedAt
+# is the watermark that keeps the two from charging the same time twice. stoppedAt marks
+# a queue stopped for the rest of the month.
+
+QUEUE_CPU_PREFIX = 'queueCpu#'
+QUEUE_MEMORY_PREFIX = 'queueMemory#'
+QUEUE_TASKS_PREFIX = 'queueTasks#'
+QUEUE_COST_PREFIX = 'queueCost#'
+
+def load_budgets(budgets_json):
+    return {queue: float(budget) for queue, budget in (json.loads(budgets_json) if budgets_json else {}).items()}
+
+def queue_name(job_queue):
+    # describe_jobs returns the queue ARN: arn:aws:batch:<region>:<account>:job-queue/<name>
+    return job_queue.split('/')[-1]
+
+def aggregate_update(deltas):
+    # ADD clauses and values for per-queue deltas {queue: (cpu, memory GB, tasks)}
+    clauses, names, values = [], {}, {}
+    for index, (queue, (cpu, memory, tasks)) in enumerate(sorted(deltas.items())):
+        for prefix, kind, value in ((QUEUE_CPU_PREFIX, 'c', cpu), (QUEUE_MEMORY_PREFIX, 'm', memory), (QUEUE_TASKS_PREFIX, 'n', tasks)):
+            names[f"#q{kind}{index}"] = prefix + queue
+            values[f":q{kind}{index}"] = value
+            clauses.append(f"#q{kind}{index} :q{kind}{index}")
+    return clauses, names, values
+
+def queue_rates(aggregate_item):
+    # hourly rate of every queue with tasks in the aggregate item
+    rates = {}
+    for name, cpu in aggregate_item.items():
+        if name.startswith(QUEUE_CPU_PREFIX):
+            queue = name[len(QUEUE_CPU_PREFIX):]
+            rates[queue] = fargate_pricing.hourly_cost(cpu, aggregate_item.get(QUEUE_MEMORY_PREFIX + queue, 0))
+    return rates
+
+def month_key(queue, now):
+    return f"{QUEUE_COST_PREFIX}{queue}#{now:%Y-%m}"
+
+def month_start(now):
+    return now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def accrue_month(table, queue, now, cost_since):
+    # charge cost_since(accruedAt) to the queue's month item (accruedAt is None for a new item).
+    # Returns the month-to-date cost and the item read; when another writer moved accruedAt
+    # first, its accrual covers the window and this one is dropped
+    key = {'partition-key': month_key(queue, now)}
+    item = table.get_item(Key=key, ConsistentRead=True).get('Item', {})
+    since = guardian_metrics.parse_timestamp(item['accruedAt']) if 'accruedAt' in item else None
+    cost = float(item.get('cost', 0)) + max(cost_since(since), 0.0)
+    try:
+        table.update_item(
+            Key=key,
+            UpdateExpression='set cost = :cost, accruedAt = :now',
+            ConditionExpression='attribute_not_exists(accruedAt) OR accruedAt = :since',
+            ExpressionAttributeValues={
+                ':cost': Decimal(str(cost)),
+                ':now': guardian_metrics.format_timestamp(now),
+                ':since': item.get('accruedAt', '')
+            }
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return float(item.get('cost', 0)), item
+    return cost, item
+
+def mark_stopped(table, queue, now):
+    # True for the one caller that stops the queue this month
+    try:
+        table.update_item(
+            Key={'partition-key': month_key(queue, now)},
+            UpdateExpression='set stoppedAt = :now',
+            ConditionExpression='attribute_not_exists(stoppedAt)',
+            ExpressionAttributeValues={':now': guardian_metrics.format_timestamp(now)}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+def overrun(table, budgets, now, cost_since_by_queue):
+    # budgeted queues going over their budget for the first time this month; cost_since_by_queue
+    # returns the cost accrued by a queue since a given time
+    overrun_queues = []
+    for queue, budget in sorted(budgets.items()):
+        cost, item = accrue_month(table, queue, now, lambda since: cost_since_by_queue(queue, since))
+        if cost > budget and 'stoppedAt' not in item and mark_stopped(table, queue, now):
+            print(f"Job queue {queue} overran its budget: ${cost:.4f} of ${budget:.4f}")
+            overrun_queues.append(queue)
+    return overrun_queues
@@ -0,0 +1,50 @@
+import math
+
+# Streaming statistics of the cost the high velocity checker accrues per poll, per hour
+# of the poll interval (polls are not evenly spaced). Once new submissions are stopped
+# the spend per hour can only fall, so one above any of the last few polls (or far above
+# its moving average) means jobs are leaking in through another path or the aggregate
+# is corrupted. Comparing with the lowest recent poll catches a slow rise that stays
+# within the tolerance from one poll to the next. The state is a fixed number of
+# attributes on the "pk" item (rateEwma, rateVariance, recentRates, rateSamples),
+# reset whenever an execution re-initializes that item.
+
+def initial_state():
+    return {'rateEwma': 0.0, 'rateVariance': 0.0, 'recentRates': [], 'rateSamples': 0}
+
+def state_from_item(item):
+    if 'rateSamples' not in item:
+        return initial_state()
+    return {
+        'rateEwma': float(item['rateEwma']),
+        'rateVariance': float(item['rateVariance']),
+        'recentRates': [float(rate) for rate in item['recentRates']],
+        'rateSamples': int(item['rateSamples'])
+    }
+
+def detect(state, rate, increase_tolerance, spike_z_score, warmup_samples):
+    # returns 'increase', 'spike' or None, comparing the new rate with the state before it
+    if state['recentRates']:
+        lowest = min(state['recentRates'])
+        if rate > lowest * (1 + increase_tolerance) + 1e-9:
+            return 'increase'
+    if state['rateSamples'] >= warmup_samples and state['rateVariance'] > 0:
+        if (rate - state['rateEwma']) / math.sqrt(state['rateVariance']) > spike_z_score:
+            return 'spike'
+    return None
+
+def update(state, rate, alpha, window):
+    # exponentially weighted mean and variance (incremental form), plus the last few rates
+    if state['rateSamples'] == 0:
+        ewma, variance = rate, 0.0
+    else:
+        diff = rate - state['rateEwma']
+        increment = alpha * diff
+        ewma = state['rateEwma'] + increment
+        variance = (1 - alpha) * (state['rateVariance'] + diff * increment)
+    return {
+        'rateEwma': ewma,
+        'rateVariance': variance,
+        'recentRates': (state['recentRates'] + [rate])[-window:],
+        'rateSamples': state['rateSamples'] + 1
+    }
@@ -0,0 +1,106 @@
+import json
+import os
+import time
+from decimal import Decimal
+import boto3
+import guardian_metrics
+
+# Shared token buckets for the regional Batch and ECS API rate limits, so the guardian's
+# Lambdas do not throttle each other. Every Batch and ECS call of an installed client
+# takes a token from its service's bucket first (a botocore before-call hook). Bucket
+# state lives in DynamoDB: tokens and the time they were counted, refilled on read and
+# written back with an optimistic check. Each Lambda leases a few tokens per write, so
+# a termination storm adds one DynamoDB round trip per LEASE_TOKENS calls.
+#
+# Priority classes keep capacity for the calls that stop spend: ENFORCEMENT calls
+# (terminating, cancelling, disabling) may empty a bucket, BOOKKEEPING calls (snapshots,
+# forecasts) only take tokens above a reserve. The governor fails open: without a table,
+# on DynamoDB errors or after MAX_WAIT_SECONDS the call proceeds, relying on botocore's
+# retries as before.
+
+ENFORCEMENT = 'enforcement'
+BOOKKEEPING = 'bookkeeping'
+# share of a bucket's burst only ENFORCEMENT calls may use
+RESERVE = {ENFORCEMENT: 0.0, BOOKKEEPING: 0.5}
+
+# tokens per second and burst per service, override with RATE_GOVERNOR_LIMITS, e.g. {"batch": [10, 40]}
+DEFAULT_LIMITS = {'batch': (10.0, 40.0), 'ecs': (20.0, 100.0)}
+LEASE_TOKENS = 5
+MAX_WAIT_SECONDS = 10
+CONDITIONAL_RETRIES = 5
+
+table_name = os.environ.get('RATE_GOVERNOR_TABLE_NAME')
+if table_name:
+    governor_table = boto3.resource('dynamodb').Table(table_name)
+limits = dict(DEFAULT_LIMITS, **{service: tuple(float(value) for value in limit)
+    for service, limit in json.loads(os.environ.get('RATE_GOVERNOR_LIMITS') or '{}').items()})
+
+# tokens leased by this Lambda environment per (service, priority)
+_leased = {}
+
+def install(client, priority, overrides=None):
+    # govern every call of a Batch or ECS client; overrides map operation names to another priority
+    service = client.meta.service_model.service_name
+    if not table_name or service not in limits:
+        return client
+    overrides = overrides or {}
+
+    def before_call(model, **kwargs):
+        acquire(service, overrides.get(model.name, priority), model.name)
+
+    client.meta.events.register(f"before-call.{service}", before_call)
+    return client
+
+def acquire(service, priority, operation):
+    key = (service, priority)
+    if _leased.get(key, 0) <= 0:
+        waited = lease(service, priority)
+        if waited > 0:
+            print(f"Rate governor held {service}:{operation} ({priority}) for {waited:.3f} seconds")
+            guardian_metrics.emit({'GovernorWait': waited})
+    _leased[key] = _leased.get(key, 0) - 1
+
+def lease(service, priority):
+    # takes up to LEASE_TOKENS tokens, waiting for at least one; returns the seconds waited
+    rate, burst = limits[service]
+    reserve = RESERVE[priority] * burst
+    waited = 0.0
+    retries = 0
+    while True:
+        try:
+            item = governor_table.get_item(Key={'bucket': service}, ConsistentRead=True).get('Item')
+        except governor_table.meta.client.exceptions.ClientError as e:
+            print(f"Rate governor unavailable, not waiting: {e}")
+            _leased[(service, priority)] = LEASE_TOKENS
+            return waited
+        now = time.time()
+        tokens, counted_at = (float(item['tokens']), item['countedAt']) if item else (burst, None)
+        if counted_at is not None:
+            tokens = min(burst, tokens + max(0.0, now - float(counted_at)) * rate)
+        taken = min(LEASE_TOKENS, int(tokens - reserve))
+        if taken < 1:
+            wait = (reserve + 1 - tokens) / rate
+            if waited + wait > MAX_WAIT_SECONDS:
+                _leased[(service, priority)] = 1
+                return waited
+            time.sleep(wait)
+            waited += wait
+            continue
+        try:
+            governor_table.put_item(
+                Item={'bucket': service, 'tokens': Decimal(str(tokens - taken)), 'countedAt': Decimal(str(now))},
+                ConditionExpression='attribute_not_exists(countedAt) OR countedAt = :counted_at',
+                ExpressionAttributeValues={':counted_at': counted_at if counted_at is not None else Decimal(0)}
+            )
+        except governor_table.meta.client.exceptions.ConditionalCheckFailedException:
+            retries += 1
+            if retries > CONDITIONAL_RETRIES:
+                _leased[(service, priority)] = 1
+                return waited
+            continue
+        except governor_table.meta.client.exceptions.ClientError as e:
+            print(f"Rate governor unavailable, not waiting: {e}")
+            _leased[(service, priority)] = LEASE_TOKENS
+            return waited
+        _leased[(service, priority)] = taken
+        return waited
@@ -0,0 +1,73 @@
+import json
+import boto3
+import os
+import batch_actions
+import runtime_sketch
+
+dynamodb_resource = boto3.resource('dynamodb')
+runtime_sketch_table = dynamodb_resource.Table(os.environ['RUNTIME_SKETCH_TABLE_NAME'])
+
+# jobs stopped by the guardian or a cost cap, or drained by it (checkpointed), did not run to completion
+TRUNCATED_REASONS = ('nuke-jobs', 'job-cost-cap-reached')
+CONDITIONAL_RETRIES = 3
+
+def lambda_handler(event, context):
+
+    # Batch Job State Change events (SUCCEEDED and FAILED) are buffered in SQS by the
+    # EventBridge rule; each batch is folded into one sketch update per job definition
+    runtimes = {}
+    failures = []
+    message_ids = {}
+    seen_jobs = set()
+    for record in event['Records']:
+        try:
+            detail = json.loads(record['body'])['detail']
+            job_id = detail['jobId']
+        except (ValueError, KeyError) as e:
+            print(f"Malformed message {record['messageId']}: {e}")
+            failures.append(record['messageId'])
+            continue
+        if job_id in seen_jobs or 'startedAt' not in detail or 'stoppedAt' not in detail \
+                or detail.get('statusReason', '').startswith(TRUNCATED_REASONS) or batch_actions.DRAIN_TAG in detail.get('tags', {}):
+            continue
+        seen_jobs.add(job_id)
+        definition = job_definition_name(detail['jobDefinition'])
+        runtimes.setdefault(definition, []).append((detail['stoppedAt'] - detail['startedAt']) / 3600000)
+        message_ids.setdefault(definition, []).append(record['messageId'])
+
+    for definition, hours in runtimes.items():
+        if not update_sketch(definition, hours):
+            failures.extend(message_ids[definition])
+
+    print(f"Recorded {sum(len(hours) for hours in runtimes.values())} runtimes for {len(runtimes)} job definitions, {len(failures)} failed")
+
+    # only the failed messages return to the queue
+    return {
+        'batchItemFailures': [{'itemIdentifier': message_id} for message_id in failures]
+    }
+
+def job_definition_name(job_definition):
+    # arn:aws:batch:<region>:<account>:job-definition/<name>:<revision>, runtimes are kept across revisions
+    return job_definition.split('/')[-1].split(':')[0]
+
+def update_sketch(definition, hours):
+    # optimistic read-modify-write, concurrent batches retry on the version check
+    for attempt in range(CONDITIONAL_RETRIES):
+        item = runtime_sketch_table.get_item(Key={'jobDefinition': definition}, ConsistentRead=True).get('Item')
+        sketch = runtime_sketch.decode(item['sketch']) if item else runtime_sketch.new()
+        version = int(item['version']) if item else 0
+        try:
+            runtime_sketch_table.put_item(
+                Item={
+                    'jobDefinition': definition,
+                    'sketch': runtime_sketch.encode(runtime_sketch.add(sketch, hours)),
+                    'version': version + 1
+                },
+                ConditionExpression='attribute_not_exists(jobDefinition) OR version = :version',
+                ExpressionAttributeValues={':version': version}
+            )
+            return True
+        except runtime_sketch_table.meta.client.exceptions.ConditionalCheckFailedException:
+            continue
+    print(f"Sketch update for {definition} lost {CONDITIONAL_RETRIES} races, retrying the messages")
+    return False
@@ -0,0 +1,52 @@
+import datetime
+import guardian_metrics
+
+# Items of the running tasks table are written concurrently by the snapshot (one
+# conditional put per task, tagged with the guardian epoch: the execution's startTime)
+# and by the STOPPED event consumer, which replaces a task's item with a tombstone
+# instead of deleting it. The aggregate is only ever changed by the stream aggregator,
+# which adds live(new image) - live(old image) for every record, so the three paths
+# need no locks and any interleaving leaves the aggregate equal to the live items:
+#
+#   - a snapshot put for a task whose STOPPED event was already processed is rejected
+#     by the tombstone, so stopped tasks cannot come back as ghosts
+#   - re-snapshotting a live task is a live -> live change and adds nothing
+#   - a put from an older epoch cannot overwrite one from a newer epoch
+#   - tombstones expire with the table's TTL (a REMOVE of a tombstone adds nothing)
+
+TOMBSTONE_ATTRIBUTE = 'stoppedAt'
+SNAPSHOT_CONDITION = 'attribute_not_exists(stoppedAt) AND (attribute_not_exists(snapshotEpoch) OR snapshotEpoch <= :epoch)'
+# live items last written by an earlier snapshot
+STALE_CONDITION = 'attribute_not_exists(stoppedAt) AND (attribute_not_exists(snapshotEpoch) OR snapshotEpoch < :epoch)'
+# tombstones only need to outlive a snapshot that could race with the STOPPED event
+TOMBSTONE_TTL_HOURS = 24
+
+def put_snapshot_item(table, item, epoch):
+    # returns False when the task already has a tombstone or a newer snapshot
+    try:
+        table.put_item(
+            Item=dict(item, snapshotEpoch=epoch),
+            ConditionExpression=SNAPSHOT_CONDITION,
+            ExpressionAttributeValues={':epoch': epoch}
+        )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+def tombstone_item(task_arn, stopped_at):
+    expires_at = stopped_at + datetime.timedelta(hours=TOMBSTONE_TTL_HOURS)
+    return {
+        'taskArn': task_arn,
+        TOMBSTONE_ATTRIBUTE: guardian_metrics.format_timestamp(stopped_at),
+        'expiresAt': int((expires_at - datetime.datetime(1970, 1, 1)).total_seconds())
+    }
+
+def live_resources(image):
+    # (cpu, memory GB, tasks) a stream image contributes to the aggregate
+    if not image or TOMBSTONE_ATTRIBUTE in image or 'taskCpuCount' not in image:
+        return 0.0, 0.0, 0
+    return float(image['taskCpuCount']['S']), float(image['taskMemoryGb']['S']), 1
+
+def job_queue(image):
+    # job queue name the snapshot attributed the task to, if any
+    return (image or {}).get('jobQueue', {}).get('S')
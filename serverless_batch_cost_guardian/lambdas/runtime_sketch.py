@@ -0,0 +1,83 @@
+import math
+import struct
+
+# Compact runtime percentile sketches in the style of t-digest (merging digest), one per
+# job definition, built from the start and stop times of finished jobs. Runtimes are
+# kept as weighted centroids, small near the tails and large around the median, so
+# a sketch of any number of runs keeps fewer than COMPRESSION centroids. Encoded as
+# float32 pairs it fits in a few hundred bytes of a DynamoDB binary attribute.
+
+COMPRESSION = 50
+# total weight, min, max, then (mean, weight) per centroid
+HEADER = struct.Struct('<dff')
+CENTROID = struct.Struct('<ff')
+
+def new():
+    return {'count': 0.0, 'min': float('inf'), 'max': float('-inf'), 'centroids': []}
+
+def add(sketch, values):
+    # sketch with values merged in
+    values = [float(value) for value in values]
+    if not values:
+        return sketch
+    centroids = sketch['centroids'] + [(value, 1.0) for value in values]
+    return {
+        'count': sketch['count'] + len(values),
+        'min': min(sketch['min'], min(values)),
+        'max': max(sketch['max'], max(values)),
+        'centroids': compress(centroids)
+    }
+
+def compress(centroids, compression=COMPRESSION):
+    # merge neighbouring centroids while a centroid spans at most one unit of the k1 scale
+    # function k(q) = compression / (2 pi) * asin(2q - 1), which is steep near the tails
+    centroids = sorted(centroids)
+    total = sum(weight for _, weight in centroids)
+    merged = []
+    cumulative = 0.0   # weight before the last merged centroid
+    for mean, weight in centroids:
+        if merged:
+            last_mean, last_weight = merged[-1]
+            proposed = last_weight + weight
+            if scale(min(1.0, (cumulative + proposed) / total), compression) - scale(cumulative / total, compression) <= 1:
+                merged[-1] = ((last_mean * last_weight + mean * weight) / proposed, proposed)
+                continue
+            cumulative += last_weight
+        merged.append((mean, weight))
+    return merged
+
+def scale(q, compression):
+    return compression / (2 * math.pi) * math.asin(2 * q - 1)
+
+def quantile(sketch, q):
+    # runtime at quantile q, interpolated between centroid centres; None for an empty sketch
+    centroids = sketch['centroids']
+    if not centroids:
+        return None
+    if len(centroids) == 1:
+        return centroids[0][0]
+    target = q * sketch['count']
+    cumulative = 0.0
+    previous_mean, previous_center = sketch['min'], 0.0
+    for mean, weight in centroids:
+        center = cumulative + weight / 2
+        if target <= center:
+            if center == previous_center:
+                return mean
+            return previous_mean + (mean - previous_mean) * (target - previous_center) / (center - previous_center)
+        previous_mean, previous_center = mean, center
+        cumulative += weight
+    if cumulative == previous_center:
+        return sketch['max']
+    return previous_mean + (sketch['max'] - previous_mean) * (target - previous_center) / (cumulative - previous_center)
+
+def encode(sketch):
+    return HEADER.pack(sketch['count'], sketch['min'], sketch['max']) + \
+        b''.join(CENTROID.pack(mean, weight) for mean, weight in sketch['centroids'])
+
+def decode(data):
+    # DynamoDB returns binary attributes as boto3 Binary objects
+    data = bytes(getattr(data, 'value', data))
+    count, minimum, maximum = HEADER.unpack_from(data)
+    centroids = [CENTROID.unpack_from(data, offset) for offset in range(HEADER.size, len(data), CENTROID.size)]
+    return {'count': count, 'min': minimum, 'max': maximum, 'centroids': centroids}
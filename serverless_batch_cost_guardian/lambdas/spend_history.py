@@ -0,0 +1,138 @@
+import datetime
+
+# Compact time series of guardian spend samples.
+#
+# Samples are grouped per billing period (series_key = "YYYY-MM") into fixed-size
+# chunk items (sort key chunk_start = epoch seconds of the chunk's first sample).
+# Each field is scaled to an integer, delta-encoded against the previous sample in
+# the same chunk and packed as zigzag varints into a single Binary attribute, so one
+# Query page returns many hours of samples.
+
+SAMPLES_PER_CHUNK = 720
+
+# field name -> integer scale factor
+FIELDS = [
+    ('timestamp', 1),           # seconds
+    ('totalCpu', 1000),         # milli-vCPU
+    ('totalMemory', 1024),      # MiB
+    ('hourlyRate', 1000000),    # micro-USD per hour
+    ('accruedCost', 1000000)    # micro-USD
+]
+
+def billing_period(timestamp):
+    return timestamp.strftime('%Y-%m')
+
+def append_sample(table, timestamp, total_cpu, total_memory, hourly_rate, accrued_cost):
+
+    series_key = billing_period(timestamp)
+    sample = encode_sample(timestamp, total_cpu, total_memory, hourly_rate, accrued_cost)
+
+    # newest chunk of the series is the head we append to
+    response = table.query(
+        KeyConditionExpression='series_key = :series_key',
+        ExpressionAttributeValues={':series_key': series_key},
+        ScanIndexForward=False,
+        Limit=1
+    )
+    head = response['Items'][0] if response['Items'] else None
+
+    try:
+        if head is None or int(head['sampleCount']) >= SAMPLES_PER_CHUNK:
+            table.put_item(
+                Item={
+                    'series_key': series_key,
+                    'chunk_start': sample[0],
+                    'sampleCount': 1,
+                    'samples': pack([sample])
+                },
+                ConditionExpression='attribute_not_exists(chunk_start)'
+            )
+        else:
+            samples = unpack(bytes(head['samples']))
+            samples.append(sample)
+            table.update_item(
+                Key={
+                    'series_key': series_key,
+                    'chunk_start': head['chunk_start']
+                },
+                UpdateExpression='set samples = :samples, sampleCount = :new_count',
+                ConditionExpression='sampleCount = :old_count',
+                ExpressionAttributeValues={
+                    ':samples': pack(samples),
+                    ':new_count': len(samples),
+                    ':old_count': head['sampleCount']
+                }
+            )
+    except table.meta.client.exceptions.ConditionalCheckFailedException:
+        # history is best effort, never fail the guardian loop over a lost sample
+        print(f"Concurrent write to spend history chunk, dropped sample at {timestamp}")
+
+def read_series(table, series_key):
+
+    series = []
+    kwargs = {
+        'KeyConditionExpression': 'series_key = :series_key',
+        'ExpressionAttributeValues': {':series_key': series_key}
+    }
+    while True:
+        response = table.query(**kwargs)
+        for item in response['Items']:
+            for sample in unpack(bytes(item['samples'])):
+                series.append(decode_sample(sample))
+        if 'LastEvaluatedKey' not in response:
+            return series
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def encode_sample(timestamp, total_cpu, total_memory, hourly_rate, accrued_cost):
+    values = [timestamp.timestamp(), total_cpu, total_memory, hourly_rate, accrued_cost]
+    return [int(round(float(value) * scale)) for value, (name, scale) in zip(values, FIELDS)]
+
+def decode_sample(sample):
+    decoded = {name: value / scale for value, (name, scale) in zip(sample, FIELDS)}
+    decoded['timestamp'] = datetime.datetime.fromtimestamp(sample[0])
+    return decoded
+
+def pack(samples):
+    out = bytearray()
+    previous = [0] * len(FIELDS)
+    for sample in samples:
+        for i, value in enumerate(sample):
+            write_varint(out, zigzag(value - previous[i]))
+        previous = sample
+    return bytes(out)
+
+def unpack(data):
+    samples = []
+    previous = [0] * len(FIELDS)
+    pos = 0
+    while pos < len(data):
+        sample = []
+        for i in range(len(FIELDS)):
+            encoded, pos = read_varint(data, pos)
+            sample.append(previous[i] + unzigzag(encoded))
+        samples.append(sample)
+        previous = sample
+    return samples
+
+def zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+def unzigzag(value):
+    return value // 2 if value % 2 == 0 else -(value + 1) // 2
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+
+def read_varint(data, pos):
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, pos
+        shift += 7
@@ -1,25 +1,28 @@
 import json
 import boto3
 import os
+import batch_actions
+import escalation_policy
+import rate_governor
 
-batch_client = boto3.client('batch')
+batch_client = rate_governor.install(boto3.client('batch'), rate_governor.ENFORCEMENT)
+
+# with a STOP_NEW escalation tier, submissions are stopped by the tier instead of at startup
+escalation_tiers = escalation_policy.load_policy(os.environ.get('ESCALATION_POLICY', ''))
 
 def lambda_handler(event, context):
-    
-    # Update compute environment with state disabled 
-    # https://docs.aws.amazon.com/batch/latest/APIReference/API_UpdateComputeEnvironment.html
-    # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/batch.html#Batch.Client.update_compute_environment
-    response = batch_client.update_compute_environment(
-        computeEnvironment=os.environ['BATCH_COMPUTE_ENV_NAME'], 
-        state='DISABLED'
-    )
-    
-    # Update job queue with state disabled 
-    response = batch_client.update_job_queue(
-        jobQueue=os.environ['BATCH_JOB_QUEUE_NAME'],
-        state='DISABLED'
-    )
-    
+
+    if escalation_policy.defers_stop_new(escalation_tiers):
+        print("New submissions are stopped by the STOP_NEW escalation tier")
+    else:
+        # Update compute environment with state disabled
+        # https://docs.aws.amazon.com/batch/latest/APIReference/API_UpdateComputeEnvironment.html
+        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/batch.html#Batch.Client.update_compute_environment
+        batch_actions.disable_compute_environment(batch_client, os.environ['BATCH_COMPUTE_ENV_NAME'])
+
+        # Update job queue with state disabled
+        batch_actions.disable_job_queues(batch_client, [os.environ['BATCH_JOB_QUEUE_NAME']])
+
     return {
         'statusCode': 200,
         "startTime": event['startTime'],
@@ -1,29 +1,66 @@
 import json
 import boto3
+import datetime
 import os
+import batch_actions
+import guardian_metrics
+import rate_governor
 
-batch_client = boto3.client('batch')
-statuses = ['SUBMITTED','PENDING','RUNNABLE','STARTING','RUNNING']
+batch_client = rate_governor.install(boto3.client('batch'), rate_governor.ENFORCEMENT)
+dynamodb_resource = boto3.resource('dynamodb')
+aggregate_table_name = os.environ['AGGREGATE_TABLE_NAME']
+latest_timestamp_running_cost_table_name = os.environ['LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME']
+aggregate_table = dynamodb_resource.Table(aggregate_table_name)
+latest_timestamp_running_cost_table = dynamodb_resource.Table(latest_timestamp_running_cost_table_name)
 
 def lambda_handler(event, context):
     # Terminate all jobs (applies to all runnable, starting, pending, starting, and running jobs)
-    # https://aws.amazon.com/premiumsupport/knowledge-center/batch-jobs-termination/ 
+    # https://aws.amazon.com/premiumsupport/knowledge-center/batch-jobs-termination/
     # https://www.tutorialspoint.com/how-to-use-boto3-to-get-the-details-of-multiple-glue-jobs-at-a-time
     # https://dev.classmethod.jp/articles/count-aws-batch-queue-by-custom-metrics/
-    
-    for status in statuses:
-        response = batch_client.list_jobs(
-            jobQueue=os.environ['BATCH_JOB_QUEUE_NAME'],
-            jobStatus=status 
-        ) 
-        for x in response['jobSummaryList']: 
-            print(x['jobId'])
-            response = batch_client.terminate_job(
-                jobId=x['jobId'],
-                reason='nuke-jobs-budget-met'
-            )
+
+    terminate_issued_at = datetime.datetime.now()
+    guardian_metrics.emit_time_to_first_action(event)
+    # every job queue sharing the compute environment runs on the budget being enforced
+    job_queues = [os.environ['BATCH_JOB_QUEUE_NAME']] + sorted(
+        batch_actions.compute_environment_queues(batch_client, os.environ['BATCH_COMPUTE_ENV_NAME']) - {os.environ['BATCH_JOB_QUEUE_NAME']})
+    terminated_jobs = batch_actions.terminate_jobs(batch_client, job_queues, 'nuke-jobs-budget-met')
+
+    record_termination(terminate_issued_at, terminated_jobs)
 
     return {
         'statusCode': 200,
         'body': json.dumps('Hello from Lambda!')
     }
+
+def record_termination(terminate_issued_at, terminated_jobs):
+
+    try:
+        response = latest_timestamp_running_cost_table.update_item(
+        Key={
+            'partition-key': guardian_metrics.ENFORCEMENT_KEY
+        },
+        UpdateExpression='set terminateIssuedAt = :issued_at, terminatedJobs = :terminated_jobs',
+            ConditionExpression='attribute_exists(detectedAt) AND attribute_not_exists(terminateIssuedAt)',
+            ExpressionAttributeValues={
+                ':issued_at': guardian_metrics.format_timestamp(terminate_issued_at),
+                ':terminated_jobs': terminated_jobs
+            },
+            ReturnValues='ALL_NEW'
+        )
+    except latest_timestamp_running_cost_table.meta.client.exceptions.ConditionalCheckFailedException:
+        print("No open enforcement timeline, skipping termination metrics")
+        return
+
+    enforcement = response['Attributes']
+    guardian_metrics.emit({
+        'TerminationIssueLatency': guardian_metrics.seconds_between(enforcement['detectedAt'], enforcement['terminateIssuedAt'])
+    })
+
+    # with no running tasks left there is no STOPPED event to close the timeline
+    response = aggregate_table.get_item(Key={
+      "aggregate_key": "aggregate_key"
+    })
+    if int(response.get("Item", {}).get("taskCount", 0)) <= 0:
+        guardian_metrics.complete_enforcement(latest_timestamp_running_cost_table,
+            enforcement.get('lastStoppedAt', enforcement['terminateIssuedAt']))
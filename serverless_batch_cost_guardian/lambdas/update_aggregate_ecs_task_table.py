@@ -2,45 +2,82 @@ import json
 import boto3
 from decimal import Decimal
 import os
+import guardian_metrics
+import queue_budgets
+import running_tasks
 
 dynamodb_resource = boto3.resource('dynamodb')
 aggregate_table_name = os.environ['AGGREGATE_TABLE_NAME']
+latest_timestamp_running_cost_table_name = os.environ['LATEST_TIMESTAMP_RUNNING_COST_TABLE_NAME']
 aggregate_table = dynamodb_resource.Table(aggregate_table_name)
+latest_timestamp_running_cost_table = dynamodb_resource.Table(latest_timestamp_running_cost_table_name)
 
 def lambda_handler(event, context):
     
-    total_deleted_cpu = 0
-    total_deleted_memory = 0
+    # every change to a task item adds live(new image) - live(old image): snapshot puts add
+    # tasks, tombstones written for STOPPED events subtract them and everything else
+    # (re-snapshots, tombstone updates and expiry) adds nothing
+    delta_cpu = 0.0
+    delta_memory = 0.0
+    delta_tasks = 0
+    removed_tasks = 0
+    queue_deltas = {}
     
     for record in event["Records"]:
         
-        if record['eventName'] == 'REMOVE':
-            old_record = record['dynamodb']['OldImage']
-            print(f"{old_record} was deleted")
-            
-            # subtract removed from aggregate
-            deleted_cpu_str = old_record['taskCpuCount']['S']
-            deleted_memory_str = old_record['taskMemoryGb']['S']
-            print(deleted_cpu_str)
-            print(deleted_memory_str)
-            deleted_cpu = float(deleted_cpu_str)
-            deleted_memory = float(deleted_memory_str)
-            total_deleted_cpu = total_deleted_cpu + deleted_cpu
-            total_deleted_memory = total_deleted_memory + deleted_memory
-            
-    # update item, not put item
+        new_image = record['dynamodb'].get('NewImage')
+        old_image = record['dynamodb'].get('OldImage')
+        new_cpu, new_memory, new_tasks = running_tasks.live_resources(new_image)
+        old_cpu, old_memory, old_tasks = running_tasks.live_resources(old_image)
+        delta_cpu = delta_cpu + new_cpu - old_cpu
+        delta_memory = delta_memory + new_memory - old_memory
+        delta_tasks = delta_tasks + new_tasks - old_tasks
+        removed_tasks = removed_tasks + max(0, old_tasks - new_tasks)
+        
+        # per-queue totals follow the same rule for tasks attributed to a job queue
+        for image, sign in ((new_image, 1), (old_image, -1)):
+            queue = running_tasks.job_queue(image)
+            cpu, memory, tasks = running_tasks.live_resources(image)
+            if queue and tasks:
+                queue_cpu, queue_memory, queue_tasks = queue_deltas.get(queue, (0.0, 0.0, 0))
+                queue_deltas[queue] = (queue_cpu + sign * cpu, queue_memory + sign * memory, queue_tasks + sign * tasks)
+    
+    print(f"Aggregate change: {delta_tasks} tasks, {delta_cpu} vCPU, {delta_memory} GB")
+    if removed_tasks == 0 and delta_tasks == 0 and delta_cpu == 0 and delta_memory == 0:
+        return {
+            'statusCode': 200,
+            'body': json.dumps('No change')
+        }
+    
+    queue_clauses, queue_names, queue_values = queue_budgets.aggregate_update({queue: (Decimal(str(cpu)), Decimal(str(memory)), tasks)
+        for queue, (cpu, memory, tasks) in queue_deltas.items() if (cpu, memory, tasks) != (0, 0, 0)})
+    
+    # update item, not put item: ADD commutes with the snapshot marking its epoch
+    kwargs = {'ExpressionAttributeNames': queue_names} if queue_names else {}
     response = aggregate_table.update_item(
     Key={
         'aggregate_key': "aggregate_key"
     },
-    UpdateExpression='set totalCpu = totalCpu - :decrement_cpu, totalMemory = totalMemory - :decrement_memory',
-        ExpressionAttributeValues={
-            ':decrement_cpu': Decimal(total_deleted_cpu),
-            ':decrement_memory': Decimal(total_deleted_memory)
-        }    
+    UpdateExpression='add ' + ', '.join(['totalCpu :delta_cpu', 'totalMemory :delta_memory', 'taskCount :delta_count'] + queue_clauses),
+        ExpressionAttributeValues=dict({
+            ':delta_cpu': Decimal(str(delta_cpu)),
+            ':delta_memory': Decimal(str(delta_memory)),
+            ':delta_count': delta_tasks
+        }, **queue_values),
+        ReturnValues='UPDATED_NEW',
+        **kwargs
     )
     print(response)
     
+    # the last tracked task is gone: close the enforcement timeline if one is open
+    if removed_tasks > 0 and response['Attributes']['taskCount'] <= 0:
+        response = latest_timestamp_running_cost_table.get_item(Key={
+          "partition-key": guardian_metrics.ENFORCEMENT_KEY
+        })
+        enforcement = response.get("Item")
+        if enforcement is not None and 'lastStoppedAt' in enforcement:
+            guardian_metrics.complete_enforcement(latest_timestamp_running_cost_table, enforcement['lastStoppedAt'])
+    
     return {
         'statusCode': 200,
         'body': json.dumps('Hello from Lambda!')
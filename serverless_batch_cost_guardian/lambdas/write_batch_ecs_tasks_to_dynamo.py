@@ -1,15 +1,21 @@
 import json
 import boto3
-from decimal import Decimal
+import datetime
 import os
+import job_cost_caps
+import queue_budgets
+import rate_governor
+import running_tasks
 
-batch_client = boto3.client('batch')
-ecs_client = boto3.client('ecs')
+batch_client = rate_governor.install(boto3.client('batch'), rate_governor.BOOKKEEPING)
+ecs_client = rate_governor.install(boto3.client('ecs'), rate_governor.BOOKKEEPING)
 dynamodb_resource = boto3.resource('dynamodb')
 running_table_name = os.environ['RUNNING_TABLE_NAME'] 
 aggregate_table_name = os.environ['AGGREGATE_TABLE_NAME']
 running_table = dynamodb_resource.Table(running_table_name)
 aggregate_table = dynamodb_resource.Table(aggregate_table_name)
+job_caps = job_cost_caps.load_caps(os.environ.get('JOB_COST_CAPS', ''))
+budgets_by_queue = queue_budgets.load_budgets(os.environ.get('QUEUE_BUDGETS', ''))
 
 def lambda_handler(event, context):
     
@@ -25,20 +31,24 @@ def lambda_handler(event, context):
     # Help: https://www.simplifiedpython.net/python-split-string-by-character/ 
     ecs_cluster_name = ecs_cluster_arn.split('/')[1]
 
-    response = ecs_client.list_tasks(
-        cluster=ecs_cluster_name
-    )
+    # list_tasks returns at most 100 task ARNs per page
+    task_arns = []
+    paginator = ecs_client.get_paginator('list_tasks')
+    for page in paginator.paginate(cluster=ecs_cluster_name):
+        task_arns.extend(page['taskArns'])
     
-    total_cpu = 0
-    total_memory = 0
+    items = []
+    tasks_by_job = {}
+    snapshot_time = datetime.datetime.now()
     
-    for taskArn in response['taskArns']: 
+    for taskArn in task_arns: 
             response = ecs_client.describe_tasks(
                 cluster=ecs_cluster_name,
                 tasks=[
                     taskArn,
                 ]
             )
+            task = response['tasks'][0]
             task_id = response['tasks'][0]['taskArn']
             task_cpu_units = response['tasks'][0]['cpu']
             task_cpu_count = int(task_cpu_units)/1024
@@ -47,28 +57,50 @@ def lambda_handler(event, context):
             print(task_id)
             print(task_cpu_count)
             print(task_memory_gb)
-            total_cpu = total_cpu + task_cpu_count
-            total_memory = total_memory + task_memory_gb
-            # DDB put item here
-            # table name: batch_ecs_running_tasks_table
-            # pk: taskArn
-            response = running_table.put_item(
-            Item = { 
+            item = { 
                  'taskArn': task_id,
                  'taskCpuCount': str(task_cpu_count),
                  'taskMemoryGb': str(task_memory_gb)
                    }
-            )
-            print(response)
+            items.append(item)
+            # Batch starts the task with the job id as startedBy
+            if (job_cost_caps.enabled(job_caps) or budgets_by_queue) and task.get('startedBy'):
+                tasks_by_job[task['startedBy']] = (task, item)
     
-    response = aggregate_table.put_item(
-    Item = { 
-        'aggregate_key': "aggregate_key",
-        'totalCpu': Decimal(total_cpu),
-        'totalMemory': Decimal(total_memory)
-        }
-    )
-    print(response)
+    if tasks_by_job:
+        add_job_attributes(tasks_by_job, snapshot_time)
+    
+    # every put is conditional on the task having no tombstone (its STOPPED event was already
+    # processed) and no newer snapshot; the stream aggregator adds the accepted puts to the totals
+    epoch = event['startTime']
+    written = 0
+    for item in items:
+        # DDB put item here
+        # table name: batch_ecs_running_tasks_table
+        # pk: taskArn
+        if running_tasks.put_snapshot_item(running_table, item, epoch):
+            written += 1
+        else:
+            print(f"{item['taskArn']} stopped during the snapshot, not written")
+    
+    swept = sweep_stopped_tasks(set(task_arns), epoch)
+    print(f"Snapshot {epoch}: {written} of {len(items)} tasks written, {swept} stale tasks swept")
+    
+    # lets the spend checker tell this execution's snapshot from an earlier one
+    try:
+        aggregate_table.update_item(
+        Key={
+            'aggregate_key': "aggregate_key"
+        },
+        UpdateExpression='set startTime = :epoch, snapshotTasks = :written',
+            ConditionExpression='attribute_not_exists(startTime) OR startTime <= :epoch',
+            ExpressionAttributeValues={
+                ':epoch': epoch,
+                ':written': written
+            }
+        )
+    except aggregate_table.meta.client.exceptions.ConditionalCheckFailedException:
+        print(f"A newer snapshot than {epoch} was already written")
     
     return {
         'statusCode': 200,
@@ -76,4 +108,48 @@ def lambda_handler(event, context):
         "startCost": event['startCost'],
         "budgetLimit": event['budgetLimit'],
         'budgetMet': 'NO'
-    }
\ No newline at end of file
+    }
+
+def add_job_attributes(tasks_by_job, snapshot_time):
+    # attribute tasks to their job queue and put the tasks of capped jobs on the cap breach
+    # queue (describe_jobs takes 100 ids per call)
+    job_ids = list(tasks_by_job)
+    for start in range(0, len(job_ids), 100):
+        response = batch_client.describe_jobs(jobs=job_ids[start:start + 100])
+        for job in response['jobs']:
+            task, item = tasks_by_job[job['jobId']]
+            if budgets_by_queue:
+                item['jobQueue'] = queue_budgets.queue_name(job['jobQueue'])
+            cap = job_cost_caps.cap_for(job, job_caps)
+            if cap is None:
+                continue
+            started_at = job_cost_caps.task_started_at(task, snapshot_time)
+            item.update(job_cost_caps.cap_attributes(job['jobId'], started_at,
+                float(item['taskCpuCount']), float(item['taskMemoryGb']), cap))
+
+def sweep_stopped_tasks(listed_task_arns, epoch):
+    # live items of earlier epochs whose task is no longer listed stopped without a processed
+    # STOPPED event (e.g. it expired to the dead-letter queue): tombstone them so the stream
+    # aggregator subtracts them, unless a STOPPED event or a newer snapshot got there first
+    swept = 0
+    kwargs = {
+        'FilterExpression': running_tasks.STALE_CONDITION,
+        'ExpressionAttributeValues': {':epoch': epoch}
+    }
+    while True:
+        response = running_table.scan(**kwargs)
+        for item in response['Items']:
+            if item['taskArn'] in listed_task_arns:
+                continue
+            try:
+                running_table.put_item(
+                    Item=running_tasks.tombstone_item(item['taskArn'], datetime.datetime.now()),
+                    ConditionExpression=running_tasks.STALE_CONDITION,
+                    ExpressionAttributeValues={':epoch': epoch}
+                )
+                swept += 1
+            except running_table.meta.client.exceptions.ConditionalCheckFailedException:
+                pass
+        if 'LastEvaluatedKey' not in response:
+            return swept
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
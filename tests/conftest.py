@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the Lambda sources are flat directories of modules importing each other by name, as in
+# the deployed function, so they are put on the path rather than imported as packages
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for source_dir in ('serverless_batch_cost_guardian/lambdas', 'event_driven_budget_checker/lambda'):
+    sys.path.insert(0, os.path.join(ROOT, source_dir))
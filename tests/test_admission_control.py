@@ -0,0 +1,128 @@
+import base64
+import datetime
+import json
+from decimal import Decimal
+
+import pytest
+
+from guardian_simulator import fake_aws, simulator, synthetic_trace
+
+FUNCTION = 'admission-control-lambda-function'
+TRACE = synthetic_trace(seed=1, jobs_per_hour=5)
+SUBMIT_JOB = {'jobName': 'admitted', 'jobQueue': simulator.JOB_QUEUE_NAME, 'jobDefinition': sorted(TRACE['jobDefinitions'])[0]}
+
+
+@pytest.fixture
+def sim():
+    return simulator.Simulation(TRACE, {'waitTime': 300})
+
+
+def admission(sim, body):
+    result = sim.invoke(FUNCTION, {'body': body})
+    return result['statusCode'], json.loads(result['body'])
+
+
+def poll(sim, running_cost, seconds_ago=0, wait_seconds=300, budget_limit=100, hourly_rate=10):
+    # the pk item as the high velocity checker writes it on a poll
+    polled_at = sim.clock.now() - datetime.timedelta(seconds=seconds_ago)
+    sim.aws.dynamodb.Table('sim-latest-timestamp-running-cost-table').put_item(Item={
+        'partition-key': 'pk',
+        'latestTimeStamp': polled_at.strftime('%Y-%m-%d %H:%M:%S.%f'),
+        'runningCost': Decimal(str(running_cost)),
+        'budgetLimit': Decimal(str(budget_limit)),
+        'hourlyRate': Decimal(str(hourly_rate)),
+        'waitSeconds': wait_seconds
+    })
+
+
+@pytest.mark.parametrize('body', [
+    'not json',
+    '[1, 2]',
+    json.dumps({'vcpu': 'four', 'memoryGb': 8}),
+    json.dumps({'vcpu': 4, 'memoryGb': None}),
+    json.dumps({'vcpu': 4, 'memoryGb': 8, 'expectedDurationHours': 'two'}),
+    json.dumps({'vcpu': 4, 'memoryGb': 8, 'expectedDurationHours': -1}),
+    json.dumps({'vcpu': 4, 'memoryGb': 8, 'expectedDurationHours': float('nan')}),
+    json.dumps({'memoryGb': 8}),
+    json.dumps({'vcpu': 4, 'submitJob': 'my-job'})
+])
+def test_malformed_requests_are_rejected_with_400(sim, body):
+    status_code, response = admission(sim, body)
+    assert status_code == 400
+    assert response['error']
+    assert sim.errors == []
+
+
+def test_unusable_job_definitions_are_rejected_with_400(sim, monkeypatch):
+    sim.job_definitions['mnp'] = {'jobDefinitionName': 'mnp', 'type': 'multinode',
+        'nodeProperties': {'numNodes': 2, 'mainNode': 0, 'nodeRangeProperties': []}}
+    status_code, response = admission(sim, json.dumps({'jobDefinition': 'mnp'}))
+    assert status_code == 400
+    assert 'pass vcpu and memoryGb' in response['error']
+
+    def denied(**kwargs):
+        raise fake_aws.ClientError('ClientException', 'Not authorized', 'DescribeJobDefinitions')
+    monkeypatch.setattr(sim.aws.batch, 'describe_job_definitions', denied)
+    status_code, response = admission(sim, json.dumps({'jobDefinition': 'other'}))
+    assert status_code == 400
+    assert 'Not authorized' in response['error']
+    assert sim.errors == []
+
+
+def test_base64_encoded_body_is_decoded(sim):
+    body = base64.b64encode(json.dumps({'vcpu': 1, 'memoryGb': 2}).encode()).decode()
+    result = sim.invoke(FUNCTION, {'body': body, 'isBase64Encoded': True})
+    assert result['statusCode'] == 200
+    assert json.loads(result['body'])['decision'] == 'ADMIT'
+
+
+def test_job_that_fits_the_remaining_budget_is_admitted(sim):
+    # 100 budget, 40 spent, 10 an hour for the job's hour leaves 50
+    poll(sim, 40)
+    status_code, response = admission(sim, json.dumps({'vcpu': 1, 'memoryGb': 2}))
+    assert status_code == 200
+    assert response['decision'] == 'ADMIT'
+    assert response['reason'] == 'fits-remaining-budget'
+    assert response['remainingBudget'] == pytest.approx(50)
+
+
+def test_job_that_exceeds_the_remaining_budget_is_rejected(sim):
+    # 30 minutes since the last 15 minute poll accrue another 5 at 10 an hour, leaving 100 - 90 - 10 = 0
+    poll(sim, 85, seconds_ago=1800, wait_seconds=900)
+    status_code, response = admission(sim, json.dumps({'vcpu': 16, 'memoryGb': 64, 'submitJob': SUBMIT_JOB}))
+    assert status_code == 200
+    assert response['decision'] == 'REJECT'
+    assert response['accruedSpend'] == pytest.approx(90)
+    assert 'jobId' not in response
+    assert sim.aws.batch.jobs == {}
+
+
+@pytest.mark.parametrize('seconds_ago', [
+    # the guardian stopped polling: more than three 300 second waits since the last poll
+    3 * 300 + 1,
+    # an item left by last month's execution
+    40 * 24 * 3600
+])
+def test_state_left_by_an_ended_execution_is_not_enforced(sim, seconds_ago):
+    poll(sim, 99, seconds_ago=seconds_ago)
+    status_code, response = admission(sim, json.dumps({'vcpu': 16, 'memoryGb': 64}))
+    assert status_code == 200
+    assert response['decision'] == 'ADMIT'
+    assert response['reason'] == 'guardian-inactive'
+
+
+def test_admitted_job_is_submitted(sim):
+    status_code, response = admission(sim, json.dumps({'vcpu': 1, 'memoryGb': 2, 'submitJob': SUBMIT_JOB}))
+    assert status_code == 200
+    assert response['decision'] == 'ADMIT'
+    assert response['jobId'] in sim.aws.batch.jobs
+
+
+def test_submission_to_a_disabled_queue_is_a_conflict(sim):
+    sim.aws.batch.job_queues[simulator.JOB_QUEUE_NAME]['state'] = 'DISABLED'
+    status_code, response = admission(sim, json.dumps({'vcpu': 1, 'memoryGb': 2, 'submitJob': SUBMIT_JOB}))
+    assert status_code == 409
+    assert response['decision'] == 'ADMIT'
+    assert response['errorCode'] == 'ClientException'
+    assert 'jobId' not in response
+    assert sim.errors == []
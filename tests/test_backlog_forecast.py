@@ -0,0 +1,76 @@
+import pytest
+
+import backlog_forecast
+import fargate_pricing
+import runtime_sketch
+
+ARN_PREFIX = 'arn:aws:batch:us-east-1:123456789012:job-definition/'
+
+
+class StubBatch:
+    """list_jobs pages and describe_job_definitions over fixed queued jobs and definitions."""
+
+    def __init__(self, queued, definitions):
+        self.queued = queued                # (job queue, status, job definition ARN)
+        self.definitions = definitions      # job definition ARN -> describe_job_definitions entry
+
+    def get_paginator(self, operation):
+        assert operation == 'list_jobs'
+        return self
+
+    def paginate(self, jobQueue, jobStatus):
+        yield {'jobSummaryList': [{'jobDefinition': arn} for queue, status, arn in self.queued if (queue, status) == (jobQueue, jobStatus)]}
+
+    def describe_job_definitions(self, jobDefinitions):
+        return {'jobDefinitions': [self.definitions[arn] for arn in jobDefinitions if arn in self.definitions]}
+
+
+class StubSketchTable:
+
+    def __init__(self, runtimes):
+        self.items = {name: {'jobDefinition': name, 'sketch': runtime_sketch.encode(runtime_sketch.add(runtime_sketch.new(), hours))}
+            for name, hours in runtimes.items()}
+
+    def get_item(self, Key):
+        item = self.items.get(Key['jobDefinition'])
+        return {'Item': item} if item else {}
+
+
+def container_definition(name, vcpu, memory_mb):
+    return {'jobDefinitionName': name, 'type': 'container', 'containerProperties': {'resourceRequirements': [
+        {'type': 'VCPU', 'value': str(vcpu)}, {'type': 'MEMORY', 'value': str(memory_mb)}]}}
+
+
+@pytest.fixture(autouse=True)
+def empty_caches():
+    backlog_forecast._resources.clear()
+    backlog_forecast._runtimes.clear()
+
+
+def test_backlog_cost_prices_queued_jobs_with_their_runtime():
+    small, large = ARN_PREFIX + 'small:1', ARN_PREFIX + 'large:4'
+    batch_client = StubBatch(
+        [('queue-a', 'RUNNABLE', small), ('queue-a', 'SUBMITTED', small), ('queue-b', 'PENDING', large)],
+        {small: container_definition('small', 1, 2048), large: container_definition('large', 4, 8192)})
+    sketch_table = StubSketchTable({'large': [3.0, 3.0, 3.0]})
+    cost = backlog_forecast.backlog_cost(batch_client, sketch_table, ['queue-a', 'queue-b'], 0.5, 1.0)
+    # small has no finished runs yet and uses the default runtime
+    assert cost == pytest.approx(2 * fargate_pricing.hourly_cost(1, 2) * 1.0 + fargate_pricing.hourly_cost(4, 8) * 3.0)
+
+
+@pytest.mark.parametrize('definition', [
+    {'jobDefinitionName': 'mnp', 'type': 'multinode', 'nodeProperties': {'numNodes': 2, 'mainNode': 0, 'nodeRangeProperties': []}},
+    {'jobDefinitionName': 'eks', 'type': 'container', 'eksProperties': {'podProperties': {'containers': []}}}
+])
+def test_backlog_cost_skips_definitions_without_container_properties(definition):
+    container, other = ARN_PREFIX + 'small:1', ARN_PREFIX + definition['jobDefinitionName'] + ':1'
+    batch_client = StubBatch([('queue-a', 'RUNNABLE', container), ('queue-a', 'RUNNABLE', other)],
+        {container: container_definition('small', 1, 2048), other: definition})
+    cost = backlog_forecast.backlog_cost(batch_client, StubSketchTable({}), ['queue-a'], 0.5, 2.0)
+    assert cost == pytest.approx(fargate_pricing.hourly_cost(1, 2) * 2.0)
+    assert backlog_forecast.job_resources(batch_client, other) is None
+
+
+def test_deregistered_definition_is_not_priced():
+    batch_client = StubBatch([('queue-a', 'RUNNABLE', ARN_PREFIX + 'gone:1')], {})
+    assert backlog_forecast.backlog_cost(batch_client, StubSketchTable({}), ['queue-a'], 0.5, 1.0) == 0.0
@@ -0,0 +1,72 @@
+import json
+from decimal import Decimal
+
+import pytest
+
+import fargate_pricing
+from guardian_simulator import simulator, synthetic_trace
+
+FUNCTION = 'delete-ecs-task-from-dynamo-lambda-function'
+DETECTED_AT = '2022-10-20 10:00:00.000000'
+
+
+def stopped_records(indexes):
+    # one hour after detection, 1 vCPU and 2 GB each
+    return [{'messageId': f"message-{index}", 'body': json.dumps({'detail': {
+        'taskArn': f"arn:aws:ecs:us-east-1:123456789012:task/sim/{index}",
+        'stoppedAt': '2022-10-20T11:00:00.000Z',
+        'cpu': '1024',
+        'memory': '2048'
+    }})} for index in indexes]
+
+
+@pytest.fixture
+def sim():
+    sim = simulator.Simulation(synthetic_trace(seed=1, jobs_per_hour=1), {'waitTime': 300})
+    sim.aws.dynamodb.Table('sim-latest-timestamp-running-cost-table').put_item(Item={
+        'partition-key': 'enforcement',
+        'crossedAt': DETECTED_AT,
+        'detectedAt': DETECTED_AT,
+        'terminateIssuedAt': DETECTED_AT,
+        'windowSpend': Decimal('0'),
+        'stoppedTasks': 0
+    })
+    return sim
+
+
+def enforcement(sim):
+    return sim.aws.dynamodb.Table('sim-latest-timestamp-running-cost-table').get_item(Key={'partition-key': 'enforcement'})['Item']
+
+
+def test_redelivered_stops_are_counted_once(sim, monkeypatch):
+    # the last 5 of 30 tasks stay unprocessed through every retry, so their messages are redelivered
+    throttled = {f"arn:aws:ecs:us-east-1:123456789012:task/sim/{index}" for index in range(25, 30)}
+    batch_write_item = sim.aws.dynamodb.batch_write_item
+
+    def throttled_batch_write_item(RequestItems, **kwargs):
+        unprocessed = {}
+        for name, requests in RequestItems.items():
+            unprocessed[name] = [request for request in requests if request['PutRequest']['Item']['taskArn'] in throttled]
+            written = [request for request in requests if request not in unprocessed[name]]
+            if written:
+                batch_write_item(RequestItems={name: written})
+        return {'UnprocessedItems': {name: requests for name, requests in unprocessed.items() if requests}}
+
+    monkeypatch.setattr(sim.aws.dynamodb, 'batch_write_item', throttled_batch_write_item)
+    result = sim.invoke(FUNCTION, {'Records': stopped_records(range(30))})
+    assert sorted(failure['itemIdentifier'] for failure in result['batchItemFailures']) == [f"message-{index}" for index in range(25, 30)]
+    assert enforcement(sim)['stoppedTasks'] == 25
+
+    throttled.clear()
+    result = sim.invoke(FUNCTION, {'Records': stopped_records(range(25, 30))})
+    assert result['batchItemFailures'] == []
+    assert enforcement(sim)['stoppedTasks'] == 30
+    assert float(enforcement(sim)['windowSpend']) == pytest.approx(30 * fargate_pricing.hourly_cost(1, 2))
+
+
+def test_timeline_closes_when_the_aggregate_is_already_empty(sim):
+    # the stream aggregator processed the tombstones before the stops were recorded
+    sim.aws.dynamodb.Table('sim-batch-ecs-aggregate-table').put_item(Item={'aggregate_key': 'aggregate_key', 'taskCount': 0})
+    sim.invoke(FUNCTION, {'Records': stopped_records(range(3))})
+    assert enforcement(sim)['stoppedTasks'] == 3
+    assert enforcement(sim)['lastTaskStoppedAt'] == '2022-10-20 11:00:00.000000'
@@ -0,0 +1,86 @@
+import pytest
+
+import escalation_policy
+
+POLICY = escalation_policy.load_policy('''[
+    {"percent": 100, "action": "TERMINATE"},
+    {"percent": 70, "action": "NOTIFY"},
+    {"percent": 85, "action": "REDUCE_MAX_VCPUS", "waitSeconds": "120"},
+    {"percent": "80", "action": "STOP_NEW"},
+    {"percent": 95, "action": "CANCEL_QUEUED", "waitSeconds": 30}
+]''')
+DEFAULT_WAIT = 300
+
+
+def actions(tiers):
+    return [tier['action'] for tier in tiers]
+
+
+def test_load_policy_sorts_and_normalizes_tiers():
+    assert actions(POLICY) == ['NOTIFY', 'STOP_NEW', 'REDUCE_MAX_VCPUS', 'CANCEL_QUEUED', 'TERMINATE']
+    assert [tier['percent'] for tier in POLICY] == [70.0, 80.0, 85.0, 95.0, 100.0]
+    assert POLICY[2]['maxvCpusPercent'] == escalation_policy.DEFAULT_MAX_VCPUS_PERCENT
+    assert POLICY[2]['waitSeconds'] == 120
+    assert 'waitSeconds' not in POLICY[0]
+    assert escalation_policy.load_policy('') == []
+
+
+def test_load_policy_rejects_unknown_actions():
+    with pytest.raises(ValueError, match='Unknown escalation action DRAIN_EVERYTHING'):
+        escalation_policy.load_policy('[{"percent": 90, "action": "DRAIN_EVERYTHING"}]')
+
+
+def test_crossed_fires_nothing_below_the_next_tier():
+    assert escalation_policy.crossed(POLICY, 0, 69.99) == ([], 0)
+    assert escalation_policy.crossed(POLICY, 1, 79.0) == ([], 1)
+
+
+def test_crossed_fires_a_tier_at_its_percent():
+    fired, tier_index = escalation_policy.crossed(POLICY, 0, 70.0)
+    assert actions(fired) == ['NOTIFY']
+    assert tier_index == 1
+
+
+def test_crossed_fires_every_tier_jumped_in_one_poll():
+    # a burst of spend between two polls jumps from below the first tier past the fourth
+    fired, tier_index = escalation_policy.crossed(POLICY, 0, 96.0)
+    assert actions(fired) == ['NOTIFY', 'STOP_NEW', 'REDUCE_MAX_VCPUS', 'CANCEL_QUEUED']
+    assert tier_index == 4
+    # tiers fired by an earlier poll do not fire again
+    fired, tier_index = escalation_policy.crossed(POLICY, 2, 150.0)
+    assert actions(fired) == ['REDUCE_MAX_VCPUS', 'CANCEL_QUEUED', 'TERMINATE']
+    assert tier_index == len(POLICY)
+    assert escalation_policy.crossed(POLICY, len(POLICY), 500.0) == ([], len(POLICY))
+
+
+def test_wait_seconds_follows_the_last_tier_fired():
+    assert escalation_policy.wait_seconds(POLICY, 0, DEFAULT_WAIT) == DEFAULT_WAIT
+    # tiers without waitSeconds keep the default interval
+    assert escalation_policy.wait_seconds(POLICY, 2, DEFAULT_WAIT) == DEFAULT_WAIT
+    assert escalation_policy.wait_seconds(POLICY, 3, DEFAULT_WAIT) == 120
+    # jumping several tiers at once uses the interval of the highest one
+    _, tier_index = escalation_policy.crossed(POLICY, 0, 96.0)
+    assert escalation_policy.wait_seconds(POLICY, tier_index, DEFAULT_WAIT) == 30
+
+
+def test_submissions_stopped_with_a_stop_new_tier():
+    assert escalation_policy.defers_stop_new(POLICY)
+    assert escalation_policy.stop_new_percent(POLICY) == 80.0
+    assert not escalation_policy.submissions_stopped(POLICY, 0)
+    assert not escalation_policy.submissions_stopped(POLICY, 1)
+    assert escalation_policy.submissions_stopped(POLICY, 2)
+    _, tier_index = escalation_policy.crossed(POLICY, 0, 96.0)
+    assert escalation_policy.submissions_stopped(POLICY, tier_index)
+
+
+def test_submissions_stopped_without_a_stop_new_tier():
+    # the guardian stops new submissions when it starts
+    tiers = escalation_policy.load_policy('[{"percent": 90, "action": "NOTIFY"}]')
+    assert not escalation_policy.defers_stop_new(tiers)
+    assert escalation_policy.submissions_stopped(tiers, 0)
+    assert escalation_policy.submissions_stopped([], 0)
+
+
+def test_stop_new_percent_uses_the_lowest_stop_new_tier():
+    tiers = escalation_policy.load_policy('[{"percent": 90, "action": "STOP_NEW"}, {"percent": 75, "action": "STOP_NEW"}]')
+    assert escalation_policy.stop_new_percent(tiers) == 75.0
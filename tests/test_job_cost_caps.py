@@ -0,0 +1,105 @@
+import datetime
+
+import pytest
+
+import fargate_pricing
+import guardian_metrics
+import job_cost_caps
+from guardian_simulator import run_simulation, synthetic_trace
+
+CAPS = job_cost_caps.load_caps(
+    '{"jobDefinitions": {"render": 25, "etl": "40.5"}, "tags": {"team=vision": 10, "tier=batch": 30, "team=etl": 50}}'
+)
+
+
+def job(definition_name, tags=None, revision=3):
+    return {
+        'jobId': 'job-1',
+        'jobDefinition': f"arn:aws:batch:us-east-1:123456789012:job-definition/{definition_name}:{revision}",
+        'tags': tags or {}
+    }
+
+
+def test_load_caps():
+    assert CAPS == {
+        'jobDefinitions': {'render': 25.0, 'etl': 40.5},
+        'tags': {'team=vision': 10.0, 'tier=batch': 30.0, 'team=etl': 50.0}
+    }
+    assert job_cost_caps.load_caps('') == {'jobDefinitions': {}, 'tags': {}}
+    assert job_cost_caps.load_caps('{"tags": {"a=b": 1}}') == {'jobDefinitions': {}, 'tags': {'a=b': 1.0}}
+
+
+def test_enabled():
+    assert job_cost_caps.enabled(CAPS)
+    assert not job_cost_caps.enabled(job_cost_caps.load_caps(''))
+
+
+@pytest.mark.parametrize('definition_name, tags, cap', [
+    ('render', {}, 25.0),                                        # job definition only
+    ('other', {'team': 'vision'}, 10.0),                         # tag only
+    ('render', {'team': 'vision'}, 10.0),                        # the tag cap is lower
+    ('render', {'tier': 'batch'}, 25.0),                         # the job definition cap is lower
+    ('etl', {'team': 'etl', 'tier': 'batch'}, 30.0),             # lowest of three matches
+    ('render', {'team': 'vision', 'tier': 'batch'}, 10.0),
+    ('other', {}, None),                                         # nothing matches
+    ('other', {'team': 'audio', 'vision': 'team'}, None),        # keys and values are matched together
+    ('render-v2', {}, None)                                      # names are not prefixes
+])
+def test_cap_for_picks_the_lowest_matching_cap(definition_name, tags, cap):
+    assert job_cost_caps.cap_for(job(definition_name, tags), CAPS) == cap
+
+
+def test_cap_for_ignores_the_revision_and_missing_tags():
+    assert job_cost_caps.cap_for(job('render', revision=1), CAPS) == 25.0
+    assert job_cost_caps.cap_for(job('render', revision=42), CAPS) == 25.0
+    untagged = job('render')
+    del untagged['tags']
+    assert job_cost_caps.cap_for(untagged, CAPS) == 25.0
+
+
+def test_cap_attributes_breach_time():
+    started_at = datetime.datetime(2022, 10, 17, 12, 0, 0)
+    cap = 2 * fargate_pricing.hourly_cost(4, 8)
+    attributes = job_cost_caps.cap_attributes('job-1', started_at, 4, 8, cap)
+    assert attributes['capQueue'] == job_cost_caps.CAP_QUEUE
+    assert attributes['costCap'] == str(cap)
+    breach_at = guardian_metrics.parse_timestamp(attributes['capBreachAt'])
+    assert abs((breach_at - started_at) - datetime.timedelta(hours=2)) < datetime.timedelta(seconds=1)
+    # breach times sort as strings in the index the same way they sort as datetimes
+    later = job_cost_caps.cap_attributes('job-2', started_at, 4, 8, 2 * cap)
+    assert attributes['capBreachAt'] < later['capBreachAt']
+
+
+def test_accrued_cost():
+    now = datetime.datetime(2022, 10, 17, 12, 0, 0)
+    item = {'startedAt': guardian_metrics.format_timestamp(now - datetime.timedelta(minutes=90)), 'taskCpuCount': 2, 'taskMemoryGb': 4}
+    assert job_cost_caps.accrued_cost(item, now) == pytest.approx(1.5 * fargate_pricing.hourly_cost(2, 4))
+    item['startedAt'] = guardian_metrics.format_timestamp(now + datetime.timedelta(minutes=5))
+    assert job_cost_caps.accrued_cost(item, now) == 0
+
+
+def test_job_accrued_cost():
+    # a describe_jobs entry: epoch milliseconds and MEMORY in MiB
+    running = {'startedAt': 1666000000000, 'container': {'resourceRequirements': [
+        {'type': 'VCPU', 'value': '2'}, {'type': 'MEMORY', 'value': '4096'}]}}
+    assert job_cost_caps.job_accrued_cost(running, 1666000000000 + 90 * 60000) == pytest.approx(1.5 * fargate_pricing.hourly_cost(2, 4))
+    assert job_cost_caps.job_accrued_cost(running, 1666000000000 - 1000) == 0
+
+
+def test_caps_are_enforced_while_the_guardian_is_not_running():
+    # far from the budget, so the budget checker never starts the guardian
+    trace = synthetic_trace(hours=0, budget_limit=100000.0)
+    trace['jobs'] = [{'submitAt': 0.0, 'jobDefinition': 'sim-16vcpu', 'durationSeconds': 10 * 3600.0},
+        {'submitAt': 0.0, 'jobDefinition': 'sim-1vcpu', 'durationSeconds': 10 * 3600.0}]
+    report = run_simulation(trace, {'jobCostCaps': '{"jobDefinitions": {"sim-16vcpu": 1}}', 'horizonHours': 12})
+    assert report['executions'] == []
+    assert report['cappedJobs'] == 1
+    assert report['metrics']['JobCapTerminations']['count'] == 1
+    assert report['errors'] == []
+
+
+def test_task_started_at():
+    now = datetime.datetime(2022, 10, 17, 12, 0, 0)
+    aware = datetime.datetime(2022, 10, 17, 13, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=2)))
+    assert job_cost_caps.task_started_at({'startedAt': aware}, now) == datetime.datetime(2022, 10, 17, 11, 30)
+    assert job_cost_caps.task_started_at({}, now) == now
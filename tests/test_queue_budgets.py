@@ -0,0 +1,122 @@
+import datetime
+import json
+from decimal import Decimal
+
+import pytest
+
+import fargate_pricing
+import guardian_metrics
+import queue_budgets
+from guardian_simulator import run_simulation, simulator, synthetic_trace
+
+
+def test_load_budgets():
+    assert queue_budgets.load_budgets('{"high": 150, "low": "25.5"}') == {'high': 150.0, 'low': 25.5}
+    assert queue_budgets.load_budgets('') == {}
+
+
+def test_queue_name():
+    assert queue_budgets.queue_name('arn:aws:batch:us-east-1:123456789012:job-queue/high-priority') == 'high-priority'
+    assert queue_budgets.queue_name('high-priority') == 'high-priority'
+
+
+def test_aggregate_update():
+    clauses, names, values = queue_budgets.aggregate_update({'low': (1.0, 2.0, 1), 'high': (4.0, 8.0, -2)})
+    # queues are numbered in name order, so the expression is stable between polls
+    assert clauses == ['#qc0 :qc0', '#qm0 :qm0', '#qn0 :qn0', '#qc1 :qc1', '#qm1 :qm1', '#qn1 :qn1']
+    assert names == {'#qc0': 'queueCpu#high', '#qm0': 'queueMemory#high', '#qn0': 'queueTasks#high',
+        '#qc1': 'queueCpu#low', '#qm1': 'queueMemory#low', '#qn1': 'queueTasks#low'}
+    assert values == {':qc0': 4.0, ':qm0': 8.0, ':qn0': -2, ':qc1': 1.0, ':qm1': 2.0, ':qn1': 1}
+    assert queue_budgets.aggregate_update({}) == ([], {}, {})
+
+
+def test_queue_rates():
+    aggregate_item = {
+        'partition-key': 'pk', 'totalCpu': Decimal('6'), 'totalMemory': Decimal('12'),
+        'queueCpu#high': Decimal('4'), 'queueMemory#high': Decimal('8'), 'queueTasks#high': Decimal('2'),
+        'queueCpu#low': Decimal('2'), 'queueMemory#low': Decimal('4'), 'queueTasks#low': Decimal('1')
+    }
+    rates = queue_budgets.queue_rates(aggregate_item)
+    assert rates == {'high': pytest.approx(fargate_pricing.hourly_cost(4, 8)), 'low': pytest.approx(fargate_pricing.hourly_cost(2, 4))}
+    # memory that has not been aggregated yet counts as none
+    assert queue_budgets.queue_rates({'queueCpu#x': Decimal('1')}) == {'x': pytest.approx(fargate_pricing.hourly_cost(1, 0))}
+
+
+@pytest.fixture
+def sim():
+    return simulator.Simulation(synthetic_trace(seed=1, hours=0, job_queues=['team-a-queue']), {'queueBudgets': json.dumps({'team-a-queue': 1.0})})
+
+
+@pytest.fixture
+def table(sim):
+    return sim.aws.dynamodb.Table('sim-latest-timestamp-running-cost-table')
+
+
+def test_accrue_month(table):
+    now = datetime.datetime(2022, 10, 20, 12, 0, 0, 500000)
+    windows = []
+
+    def cost_since(since):
+        windows.append(since)
+        return 2.0
+    assert queue_budgets.accrue_month(table, 'high', now, cost_since)[0] == 2.0
+    later = now + datetime.timedelta(minutes=5)
+    assert queue_budgets.accrue_month(table, 'high', later, cost_since)[0] == 4.0
+    # a new item is charged from wherever the caller starts, later ones from accruedAt
+    assert windows == [None, now]
+    item = table.get_item(Key={'partition-key': 'queueCost#high#2022-10'})['Item']
+    assert float(item['cost']) == 4.0
+    assert guardian_metrics.parse_timestamp(item['accruedAt']) == later
+    # the next month starts a new item
+    assert queue_budgets.accrue_month(table, 'high', datetime.datetime(2022, 11, 1, 0, 5), cost_since)[0] == 2.0
+
+
+def test_accrue_month_drops_a_window_charged_by_another_writer(table):
+    now = datetime.datetime(2022, 10, 20, 12, 0, 0, 500000)
+    queue_budgets.accrue_month(table, 'high', now, lambda since: 1.0)
+
+    def racing_cost_since(since):
+        # the scheduled check and a poll accrue the same window at once
+        queue_budgets.accrue_month(table, 'high', now + datetime.timedelta(minutes=2), lambda since: 0.5)
+        return 0.7
+    assert queue_budgets.accrue_month(table, 'high', now + datetime.timedelta(minutes=3), racing_cost_since)[0] == 1.0
+    assert float(table.get_item(Key={'partition-key': 'queueCost#high#2022-10'})['Item']['cost']) == 1.5
+
+
+def test_overrun(table):
+    now = datetime.datetime(2022, 10, 20, 12, 0, 0, 500000)
+    budgets = {'high': 10.0, 'low': 5.0, 'batch': 1.0}
+    costs = {'high': 10.5, 'low': 5.0, 'batch': 2.0, 'unbudgeted': 100.0}
+    # exactly at budget is not over it, and only queues with a budget are checked
+    assert queue_budgets.overrun(table, budgets, now, lambda queue, since: costs[queue]) == ['batch', 'high']
+    # a queue stopped this month is not stopped again, whichever check stopped it
+    assert queue_budgets.overrun(table, budgets, now, lambda queue, since: 0.0) == []
+    assert 'stoppedAt' in table.get_item(Key={'partition-key': 'queueCost#high#2022-10'})['Item']
+    assert queue_budgets.overrun(table, budgets, datetime.datetime(2022, 11, 1, 0, 5), lambda queue, since: costs[queue]) == ['batch', 'high']
+
+
+def test_queue_budget_survives_a_second_execution_start(sim, table):
+    # team-a-queue runs 16 vCPU and 32 GB, about $0.79 an hour against its $1 budget
+    sim.aws.dynamodb.Table('sim-batch-ecs-aggregate-table').put_item(Item={'aggregate_key': 'aggregate_key', 'startTime': 'start',
+        'totalCpu': Decimal('16'), 'totalMemory': Decimal('32'), 'queueCpu#team-a-queue': Decimal('16'), 'queueMemory#team-a-queue': Decimal('32')})
+    actions = []
+    for execution in range(2):
+        # each execution's initialize state replaces the pk item
+        table.put_item(Item={'partition-key': 'pk', 'latestTimeStamp': sim.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f'), 'runningCost': Decimal('0')})
+        sim.advance(sim.clock.seconds + 2700)
+        result = sim.invoke('high-velocity-batch-spend-checker-lambda-function', {'budgetLimit': 1000000, 'startTime': 'start'})
+        actions.append([action for action in result['actions'] if action['action'] == 'STOP_QUEUES'])
+    # 45 minutes in each execution: $0.59, then $1.19 month to date
+    assert actions == [[], [{'action': 'STOP_QUEUES', 'jobQueues': ['team-a-queue']}]]
+    assert sim.errors == []
+
+
+def test_queue_budget_is_enforced_while_the_guardian_is_not_running():
+    # far from the compute environment's budget, so the budget checker never starts the guardian
+    trace = synthetic_trace(hours=0, budget_limit=100000.0, job_queues=['team-a-queue'])
+    trace['jobs'] = [{'submitAt': 0.0, 'jobDefinition': 'sim-16vcpu', 'jobQueue': 'team-a-queue', 'durationSeconds': 10 * 3600.0},
+        {'submitAt': 0.0, 'jobDefinition': 'sim-16vcpu', 'durationSeconds': 10 * 3600.0}]
+    report = run_simulation(trace, {'queueBudgets': json.dumps({'team-a-queue': 1.0}), 'horizonHours': 12})
+    assert report['executions'] == []
+    assert report['stoppedQueues'] == ['team-a-queue']
+    assert report['errors'] == []
@@ -0,0 +1,116 @@
+import math
+from decimal import Decimal
+
+import pytest
+
+import rate_anomaly
+from guardian_simulator import simulator, synthetic_trace
+
+TOLERANCE = 0.01
+Z_SCORE = 3.0
+WARMUP = 3
+
+
+def feed(rates, alpha=0.3, window=5):
+    state = rate_anomaly.initial_state()
+    for rate in rates:
+        state = rate_anomaly.update(state, rate, alpha, window)
+    return state
+
+
+def test_falling_or_flat_rate_is_not_an_anomaly():
+    state = feed([12.0, 10.0, 8.0, 8.0])
+    assert rate_anomaly.detect(state, 8.0, TOLERANCE, Z_SCORE, WARMUP) is None
+    assert rate_anomaly.detect(state, 0.0, TOLERANCE, Z_SCORE, WARMUP) is None
+
+
+def test_increase_within_tolerance():
+    state = feed([10.0])
+    # up to 1% above the previous poll is rounding, not new work
+    assert rate_anomaly.detect(state, 10.0 * (1 + TOLERANCE), TOLERANCE, Z_SCORE, WARMUP) is None
+    assert rate_anomaly.detect(state, 10.0 * (1 + TOLERANCE) + 0.001, TOLERANCE, Z_SCORE, WARMUP) == 'increase'
+
+
+def test_slow_rise_over_several_polls():
+    # each poll is half the tolerance above the one before, so only the rise since the lowest recent poll flags it
+    rates = [10.0 * (1 + TOLERANCE / 2) ** poll for poll in range(4)]
+    state = feed(rates[:1])
+    assert rate_anomaly.detect(state, rates[1], TOLERANCE, Z_SCORE, WARMUP) is None
+    state = feed(rates[:2])
+    assert rate_anomaly.detect(state, rates[2], TOLERANCE, Z_SCORE, WARMUP) == 'increase'
+    # once the lowest poll leaves the window the rise is measured from the next one
+    state = feed(rates[:3], window=1)
+    assert rate_anomaly.detect(state, rates[3], TOLERANCE, Z_SCORE, WARMUP) is None
+
+
+def test_checker_flags_a_slow_rise_in_accrued_cost():
+    sim = simulator.Simulation(synthetic_trace(seed=1, jobs_per_hour=1), {'waitTime': 300})
+    state_table = sim.aws.dynamodb.Table('sim-latest-timestamp-running-cost-table')
+    aggregate_table = sim.aws.dynamodb.Table('sim-batch-ecs-aggregate-table')
+    state_table.put_item(Item={'partition-key': 'pk', 'latestTimeStamp': sim.clock.now().strftime('%Y-%m-%d %H:%M:%S.%f'), 'runningCost': Decimal('0')})
+    anomalies = []
+    for poll in range(1, 5):
+        # tasks keep leaking in at 0.6% more per poll, under the 1% tolerance between two polls
+        aggregate_table.put_item(Item={'aggregate_key': 'aggregate_key', 'startTime': 'start',
+            'totalCpu': Decimal(str(100 * 1.006 ** poll)), 'totalMemory': Decimal(str(200 * 1.006 ** poll))})
+        sim.advance(poll * 300)
+        result = sim.invoke('high-velocity-batch-spend-checker-lambda-function', {'budgetLimit': 1000000, 'startTime': 'start'})
+        anomalies.append(result['anomaly'])
+    assert anomalies == [None, None, 'increase', 'increase']
+    assert sim.errors == []
+
+
+def test_no_previous_rate():
+    assert rate_anomaly.detect(rate_anomaly.initial_state(), 100.0, TOLERANCE, Z_SCORE, WARMUP) is None
+
+
+def test_spike_against_the_moving_average():
+    # the previous poll was already high, so only the z-score flags the new rate
+    state = {'rateEwma': 10.0, 'rateVariance': 1.0, 'recentRates': [20.0], 'rateSamples': WARMUP}
+    assert rate_anomaly.detect(state, 13.0 + 1e-6, TOLERANCE, Z_SCORE, WARMUP) == 'spike'
+    assert rate_anomaly.detect(state, 13.0 - 1e-6, TOLERANCE, Z_SCORE, WARMUP) is None
+
+
+def test_spike_needs_warmup_and_variance():
+    state = {'rateEwma': 10.0, 'rateVariance': 1.0, 'recentRates': [20.0], 'rateSamples': WARMUP - 1}
+    assert rate_anomaly.detect(state, 19.0, TOLERANCE, Z_SCORE, WARMUP) is None
+    state = dict(state, rateSamples=WARMUP, rateVariance=0.0)
+    assert rate_anomaly.detect(state, 19.0, TOLERANCE, Z_SCORE, WARMUP) is None
+
+
+def test_update_first_sample():
+    state = rate_anomaly.update(rate_anomaly.initial_state(), 7.5, 0.3, 5)
+    assert state == {'rateEwma': 7.5, 'rateVariance': 0.0, 'recentRates': [7.5], 'rateSamples': 1}
+
+
+def test_update_matches_exponentially_weighted_statistics():
+    alpha = 0.3
+    rates = [10.0, 12.0, 9.0, 11.0, 30.0, 10.0]
+    state = feed(rates, alpha)
+    # reference: the same recurrences written out (West's incremental EW variance)
+    mean, variance = rates[0], 0.0
+    for rate in rates[1:]:
+        diff = rate - mean
+        mean += alpha * diff
+        variance = (1 - alpha) * (variance + alpha * diff * diff)
+    assert state['rateEwma'] == pytest.approx(mean)
+    assert state['rateVariance'] == pytest.approx(variance)
+    assert state['rateVariance'] >= 0
+    assert state['rateSamples'] == len(rates)
+
+
+def test_recent_rates_window():
+    state = feed([1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0], window=3)
+    assert state['recentRates'] == [5.0, 6.0, 7.0]
+
+
+def test_state_round_trips_through_the_item():
+    state = feed([10.0, 9.0, 8.5])
+    # DynamoDB hands numbers back as Decimal
+    item = {'rateEwma': Decimal(str(state['rateEwma'])), 'rateVariance': Decimal(str(state['rateVariance'])),
+        'recentRates': [Decimal(str(rate)) for rate in state['recentRates']], 'rateSamples': Decimal(state['rateSamples'])}
+    restored = rate_anomaly.state_from_item(item)
+    assert restored['rateSamples'] == 3
+    assert restored['recentRates'] == state['recentRates']
+    assert math.isclose(restored['rateEwma'], state['rateEwma'])
+    assert rate_anomaly.state_from_item({'latestTimeStamp': 'x'}) == rate_anomaly.initial_state()
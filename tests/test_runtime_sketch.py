@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+
+import runtime_sketch
+
+QUANTILES = [0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99]
+# a sketch of any size encodes to the header and fewer than COMPRESSION centroids
+MAX_ENCODED_BYTES = runtime_sketch.HEADER.size + runtime_sketch.COMPRESSION * runtime_sketch.CENTROID.size
+
+
+def distributions():
+    rng = np.random.default_rng(7)
+    return {
+        'uniform': rng.uniform(0.1, 10, 20000),
+        'normal': rng.normal(5, 1, 20000),
+        'lognormal': rng.lognormal(0, 1, 20000),
+        'exponential': rng.exponential(2, 20000)
+    }
+
+
+def sketch_of(values, batches=40):
+    # built a batch of finished jobs at a time, as record_job_runtimes does
+    sketch = runtime_sketch.new()
+    for batch in np.array_split(values, batches):
+        sketch = runtime_sketch.add(sketch, batch)
+    return sketch
+
+
+@pytest.mark.parametrize('name', ['uniform', 'normal', 'lognormal', 'exponential'])
+def test_quantiles_match_numpy(name):
+    values = distributions()[name]
+    ordered = np.sort(values)
+    # the sketch stored in DynamoDB is the float32 encoding
+    sketch = runtime_sketch.decode(runtime_sketch.encode(sketch_of(values)))
+    assert sketch['count'] == len(values)
+    for q in QUANTILES:
+        estimate = runtime_sketch.quantile(sketch, q)
+        # rank error: the fraction of runtimes below the estimate is within half a percent of q
+        assert abs(np.searchsorted(ordered, estimate) / len(values) - q) <= 0.005
+        if 0.1 <= q <= 0.9:
+            assert estimate == pytest.approx(np.quantile(values, q), rel=0.02)
+
+
+@pytest.mark.parametrize('name', ['uniform', 'normal', 'lognormal', 'exponential'])
+def test_encoded_size_is_bounded(name):
+    sketch = sketch_of(distributions()[name])
+    assert len(sketch['centroids']) < runtime_sketch.COMPRESSION
+    assert len(runtime_sketch.encode(sketch)) <= MAX_ENCODED_BYTES
+    # five times the runs, the same few hundred bytes
+    larger = sketch_of(np.tile(distributions()[name], 5), batches=200)
+    assert len(runtime_sketch.encode(larger)) <= MAX_ENCODED_BYTES
+
+
+def test_encode_round_trip():
+    sketch = sketch_of(distributions()['lognormal'])
+    decoded = runtime_sketch.decode(runtime_sketch.encode(sketch))
+    assert decoded['count'] == sketch['count']
+    assert decoded['min'] == pytest.approx(sketch['min'], rel=1e-6)
+    assert decoded['max'] == pytest.approx(sketch['max'], rel=1e-6)
+    assert len(decoded['centroids']) == len(sketch['centroids'])
+    for (mean, weight), (decoded_mean, decoded_weight) in zip(sketch['centroids'], decoded['centroids']):
+        assert decoded_mean == pytest.approx(mean, rel=1e-6)
+        assert decoded_weight == pytest.approx(weight, rel=1e-6)
+
+
+def test_decode_accepts_binary_attribute_values():
+    class Binary:
+        def __init__(self, value):
+            self.value = value
+    sketch = runtime_sketch.add(runtime_sketch.new(), [1.0, 2.0, 3.0])
+    assert runtime_sketch.decode(Binary(runtime_sketch.encode(sketch))) == runtime_sketch.decode(runtime_sketch.encode(sketch))
+
+
+def test_small_and_empty_sketches():
+    assert runtime_sketch.quantile(runtime_sketch.new(), 0.5) is None
+    assert runtime_sketch.add(runtime_sketch.new(), []) == runtime_sketch.new()
+    single = runtime_sketch.add(runtime_sketch.new(), [4.0])
+    assert runtime_sketch.quantile(single, 0.1) == runtime_sketch.quantile(single, 0.9) == 4.0
+    sketch = runtime_sketch.add(runtime_sketch.new(), [1.0, 2.0, 3.0, 4.0])
+    assert (sketch['min'], sketch['max'], sketch['count']) == (1.0, 4.0, 4.0)
+    assert runtime_sketch.quantile(sketch, 0.0) == 1.0
+    assert runtime_sketch.quantile(sketch, 1.0) == 4.0
+    assert runtime_sketch.quantile(sketch, 0.5) == pytest.approx(2.5)
+
+
+def test_compress_keeps_weight_and_mean():
+    values = distributions()['exponential']
+    centroids = runtime_sketch.compress([(value, 1.0) for value in values])
+    assert sum(weight for _, weight in centroids) == pytest.approx(len(values))
+    assert sum(mean * weight for mean, weight in centroids) == pytest.approx(values.sum())
+    assert [mean for mean, _ in centroids] == sorted(mean for mean, _ in centroids)
+    # centroids stay small at the tails and grow towards the median
+    weights = [weight for _, weight in centroids]
+    assert weights[0] < max(weights) and weights[-1] < max(weights)
+
+
+def test_merging_two_sketches():
+    values = distributions()['normal']
+    first, second = sketch_of(values[:8000]), sketch_of(values[8000:])
+    merged = {
+        'count': first['count'] + second['count'],
+        'min': min(first['min'], second['min']),
+        'max': max(first['max'], second['max']),
+        'centroids': runtime_sketch.compress(first['centroids'] + second['centroids'])
+    }
+    assert len(merged['centroids']) < runtime_sketch.COMPRESSION
+    for q in QUANTILES:
+        assert runtime_sketch.quantile(merged, q) == pytest.approx(np.quantile(values, q), rel=0.02)
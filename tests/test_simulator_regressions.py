@@ -0,0 +1,51 @@
+import json
+
+import pytest
+
+from guardian_simulator import run_simulation, synthetic_trace
+
+
+@pytest.mark.parametrize('wait_time', [300, 900])
+def test_overlapping_executions_keep_charging_the_burn_rate(wait_time):
+    # At a 50% threshold the budget checker starts a new execution on each CUR delivery,
+    # and the older one keeps polling. Each one stamps the shared aggregate with its own
+    # start time, and the older execution's polls must still charge the burn rate.
+    report = run_simulation(synthetic_trace(seed=1, jobs_per_hour=20, budget_limit=450),
+        {'waitTime': wait_time, 'desiredBudgetThresholdPercent': 50})
+    assert report['errors'] == []
+    started = [execution['startedAt'] for execution in report['executions']]
+    assert len(started) >= 2 and started[1] < report['detectedAt']
+    # detected within about one wait of the crossing, as with a single execution
+    assert report['detectionLatencySeconds'] <= wait_time + 60
+
+
+@pytest.mark.parametrize('escalation_policy', ['', json.dumps([{'percent': 80, 'action': 'STOP_NEW'}])])
+def test_drain_mode_finishes_checkpointed_jobs_within_the_budget(escalation_policy):
+    report = run_simulation(synthetic_trace(mean_duration_hours=30, jobs_per_hour=10),
+        {'waitTime': 900, 'desiredBudgetThresholdPercent': 90, 'drainGraceSeconds': 600, 'escalationPolicy': escalation_policy})
+    assert report['errors'] == []
+    assert report['drainedJobs'] > 0
+    assert report['lostJobHours'] == 0
+    assert report['overshootUsd'] == 0
+
+
+def test_job_caps_and_queue_budgets_in_one_execution():
+    trace = synthetic_trace(mean_duration_hours=30, jobs_per_hour=10, job_queues=['team-a-queue'])
+    report = run_simulation(trace, {'waitTime': 300, 'desiredBudgetThresholdPercent': 90,
+        'jobCostCaps': json.dumps({'jobDefinitions': {'sim-16vcpu': 5}, 'tags': {}}), 'queueBudgets': json.dumps({'team-a-queue': 1.0})})
+    assert report['errors'] == []
+    assert report['cappedJobs'] > 0
+    assert report['stoppedQueues'] == ['team-a-queue']
+
+
+def test_first_check_acts_without_waiting_for_the_snapshot():
+    # the month-to-date spend is over the budget when the guardian starts, with thousands of tasks to snapshot
+    trace = synthetic_trace(mean_duration_hours=30, jobs_per_hour=60, budget_limit=1500, month_to_date_spend=1560)
+    trace['maxvCpus'] = 100000
+    report = run_simulation(trace, {'waitTime': 60, 'desiredBudgetThresholdPercent': 90})
+    assert report['errors'] == []
+    assert report['apiCalls']['ecs:DescribeTasks'] > 100
+    # terminated right after the first check, not once the snapshot Lambda returns
+    assert report['terminateIssuedAt'] - report['guardianStartedAt'] < 1
+    assert report['timeToFirstActionSeconds'] < 1
+    assert [execution['status'] for execution in report['executions']] == ['SUCCEEDED']
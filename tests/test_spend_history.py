@@ -0,0 +1,59 @@
+import datetime
+import random
+
+import pytest
+
+import spend_history
+
+
+def test_zigzag_round_trip():
+    for value in [0, 1, -1, 2, -2, 63, -64, 2 ** 40, -(2 ** 40)]:
+        assert spend_history.unzigzag(spend_history.zigzag(value)) == value
+    # small magnitudes of either sign map to small unsigned values
+    assert [spend_history.zigzag(value) for value in (0, -1, 1, -2, 2)] == [0, 1, 2, 3, 4]
+
+
+@pytest.mark.parametrize('value', [0, 1, 127, 128, 300, 16383, 16384, 2 ** 35 + 7])
+def test_varint_round_trip(value):
+    out = bytearray()
+    spend_history.write_varint(out, value)
+    assert len(out) == max(1, (value.bit_length() + 6) // 7)
+    assert spend_history.read_varint(bytes(out), 0) == (value, len(out))
+
+
+def test_pack_unpack_round_trip():
+    rng = random.Random(7)
+    start = datetime.datetime(2022, 10, 20, 10, 15, 30)
+    samples = []
+    accrued = 0.0
+    for i in range(spend_history.SAMPLES_PER_CHUNK):
+        cpu = rng.choice([0, 0.25, 4, 16, 256])
+        memory = rng.choice([0, 0.5, 8, 30, 2048])
+        rate = cpu * 0.04048 + memory * 0.004445
+        accrued += rate / 60
+        samples.append(spend_history.encode_sample(start + datetime.timedelta(seconds=60 * i), cpu, memory, rate, accrued))
+    assert spend_history.unpack(spend_history.pack(samples)) == samples
+
+
+def test_pack_handles_decreasing_values():
+    # the burn rate and running tasks fall once jobs are terminated: negative deltas
+    samples = [[1666260930, 256000, 2097152, 12000000, 400000000], [1666260990, 0, 0, 0, 400200000], [1666261050, 4000, 8192, 197000, 400203283]]
+    assert spend_history.unpack(spend_history.pack(samples)) == samples
+
+
+def test_pack_is_compact():
+    start = datetime.datetime(2022, 10, 20)
+    samples = [spend_history.encode_sample(start + datetime.timedelta(seconds=60 * i), 16, 32, 0.79, 0.79 * i / 60) for i in range(100)]
+    # after the first sample only small timestamp and accrued cost deltas remain
+    assert len(spend_history.pack(samples)) < 100 * 8
+
+
+def test_encode_decode_sample():
+    timestamp = datetime.datetime(2022, 10, 20, 10, 15, 30)
+    decoded = spend_history.decode_sample(spend_history.encode_sample(timestamp, 4.25, 8.5, 0.2098, 12.345678))
+    assert decoded['timestamp'] == timestamp
+    assert decoded['totalCpu'] == 4.25
+    assert decoded['totalMemory'] == 8.5
+    assert decoded['hourlyRate'] == pytest.approx(0.2098)
+    assert decoded['accruedCost'] == pytest.approx(12.345678)
+    assert spend_history.unpack(b'') == []
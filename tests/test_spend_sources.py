@@ -0,0 +1,234 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+import urllib.parse
+
+import pytest
+
+import spend_sources
+from guardian_simulator import fake_aws
+
+ENVIRONMENT = 'my-compute-environment'
+OPEN_DAYS = 3
+
+
+class StubCostExplorer:
+    """get_cost_and_usage over a fixed cost per day. Every day of the open month is
+    Estimated, as in Cost Explorer, and DAILY results are paged."""
+
+    PAGE_SIZE = 7
+
+    def __init__(self, daily_costs):
+        self.daily_costs = daily_costs
+        self.calls = []
+
+    def get_cost_and_usage(self, TimePeriod, Granularity, Metrics, Filter, NextPageToken=None):
+        if NextPageToken is None:
+            # one entry per query, whatever its number of pages
+            self.calls.append((TimePeriod['Start'], TimePeriod['End'], Granularity))
+        start = datetime.date.fromisoformat(TimePeriod['Start'])
+        end = datetime.date.fromisoformat(TimePeriod['End'])
+        days = [start + datetime.timedelta(days=i) for i in range((end - start).days)]
+        if Granularity == 'MONTHLY':
+            periods = [(days[0], end)] if days else []
+        else:
+            periods = [(day, day + datetime.timedelta(days=1)) for day in days]
+        offset = int(NextPageToken or 0)
+        page = periods[offset:offset + self.PAGE_SIZE] if Granularity == 'DAILY' else periods
+        response = {'ResultsByTime': [{
+            'TimePeriod': {'Start': begin.isoformat(), 'End': finish.isoformat()},
+            'Total': {'UnblendedCost': {'Amount': '%.10f' % self.cost(begin, finish), 'Unit': 'USD'}},
+            'Estimated': True
+        } for begin, finish in page]}
+        if Granularity == 'DAILY' and offset + self.PAGE_SIZE < len(periods):
+            response['NextPageToken'] = str(offset + self.PAGE_SIZE)
+        return response
+
+    def cost(self, begin, finish):
+        return sum(self.daily_costs.get((begin + datetime.timedelta(days=i)).isoformat(), 0.0) for i in range((finish - begin).days))
+
+
+class StubCacheTable:
+    """Cost Explorer cache table: put_item and the BETWEEN query on the date sort key."""
+
+    def __init__(self):
+        self.items = {}
+
+    def put_item(self, Item):
+        self.items[(Item['environment'], Item['date'])] = dict(Item)
+
+    def query(self, ExpressionAttributeValues, **kwargs):
+        values = ExpressionAttributeValues
+        return {'Items': [item for (environment, date), item in sorted(self.items.items())
+            if environment == values[':environment'] and values[':start'] <= date <= values[':last']]}
+
+
+def daily_costs(first, last):
+    # distinct costs per day, so a day counted twice or missed changes the total
+    costs = {}
+    day = first
+    while day <= last:
+        costs[day.isoformat()] = round(1 + day.toordinal() % 17 * 0.37, 2)
+        day += datetime.timedelta(days=1)
+    return costs
+
+
+def expected_spend(costs, start, end):
+    return sum(amount for day, amount in costs.items() if start <= day < end)
+
+
+# (today, expected start, expected exclusive end)
+PERIODS = [
+    (datetime.date(2022, 10, 1), '2022-10-01', '2022-10-02'),    # first day of the month
+    (datetime.date(2022, 10, 17), '2022-10-01', '2022-10-18'),   # mid-month
+    (datetime.date(2022, 10, 31), '2022-10-01', '2022-11-01'),   # last day of a 31 day month
+    (datetime.date(2023, 2, 28), '2023-02-01', '2023-03-01'),    # last day of February
+    (datetime.date(2024, 2, 29), '2024-02-01', '2024-03-01'),    # last day of February in a leap year
+    (datetime.date(2022, 12, 31), '2022-12-01', '2023-01-01')    # December -> January
+]
+
+
+@pytest.mark.parametrize('today, start, end', PERIODS)
+def test_month_to_date_period(today, start, end):
+    assert spend_sources.month_to_date_period(today) == (start, end)
+
+
+@pytest.mark.parametrize('today, start, end', PERIODS)
+def test_monthly_cost_explorer(today, start, end):
+    # a neighbouring month's spend must not leak into the answer
+    costs = daily_costs(today - datetime.timedelta(days=62), today + datetime.timedelta(days=31))
+    ce_client = StubCostExplorer(costs)
+    source = spend_sources.CostExplorerSpendSource(ce_client, ENVIRONMENT)
+    assert source.month_to_date(start, end) == pytest.approx(expected_spend(costs, start, end))
+    assert ce_client.calls == [(start, end, 'MONTHLY')]
+
+
+@pytest.mark.parametrize('today, start, end', PERIODS)
+def test_daily_cost_explorer_caches_closed_days(today, start, end):
+    costs = daily_costs(today - datetime.timedelta(days=62), today + datetime.timedelta(days=31))
+    ce_client = StubCostExplorer(costs)
+    cache_table = StubCacheTable()
+    source = spend_sources.DailyCostExplorerSpendSource(ce_client, ENVIRONMENT, cache_table, OPEN_DAYS)
+
+    assert source.month_to_date(start, end) == pytest.approx(expected_spend(costs, start, end))
+    closed_end = spend_sources.closed_days_end(start, end, OPEN_DAYS)
+    assert start <= closed_end <= end
+    # days before the cutoff are cached even though Cost Explorer flags them Estimated
+    assert sorted(date for _, date in cache_table.items) == sorted(day for day in costs if start <= day < closed_end)
+
+    # the next run only asks for the open days, with the same answer
+    ce_client.calls.clear()
+    assert source.month_to_date(start, end) == pytest.approx(expected_spend(costs, start, end))
+    assert ce_client.calls == [(closed_end, end, 'DAILY')]
+    assert all(call_start >= start and call_end <= end for call_start, call_end, _ in ce_client.calls)
+
+
+def test_daily_cost_explorer_first_day_of_month():
+    # on the 1st nothing is closed yet: no cache entries, a single open day queried
+    costs = daily_costs(datetime.date(2022, 12, 1), datetime.date(2023, 1, 5))
+    ce_client = StubCostExplorer(costs)
+    cache_table = StubCacheTable()
+    source = spend_sources.DailyCostExplorerSpendSource(ce_client, ENVIRONMENT, cache_table, OPEN_DAYS)
+    assert source.month_to_date('2023-01-01', '2023-01-02') == pytest.approx(costs['2023-01-01'])
+    assert cache_table.items == {}
+    assert ce_client.calls == [('2023-01-01', '2023-01-02', 'DAILY')]
+
+
+def test_daily_cost_explorer_refetches_from_first_missing_day():
+    costs = daily_costs(datetime.date(2022, 10, 1), datetime.date(2022, 10, 31))
+    ce_client = StubCostExplorer(costs)
+    cache_table = StubCacheTable()
+    source = spend_sources.DailyCostExplorerSpendSource(ce_client, ENVIRONMENT, cache_table, OPEN_DAYS)
+    source.month_to_date('2022-10-01', '2022-10-18')
+    del cache_table.items[(ENVIRONMENT, '2022-10-05')]
+
+    ce_client.calls.clear()
+    assert source.month_to_date('2022-10-01', '2022-10-18') == pytest.approx(expected_spend(costs, '2022-10-01', '2022-10-18'))
+    assert ce_client.calls == [('2022-10-05', '2022-10-18', 'DAILY')]
+
+
+def test_daily_cost_explorer_across_month_end():
+    # the cache of the previous month is not read in the new one
+    costs = daily_costs(datetime.date(2022, 12, 1), datetime.date(2023, 1, 31))
+    ce_client = StubCostExplorer(costs)
+    cache_table = StubCacheTable()
+    source = spend_sources.DailyCostExplorerSpendSource(ce_client, ENVIRONMENT, cache_table, OPEN_DAYS)
+    source.month_to_date(*spend_sources.month_to_date_period(datetime.date(2022, 12, 31)))
+    start, end = spend_sources.month_to_date_period(datetime.date(2023, 1, 2))
+    assert source.month_to_date(start, end) == pytest.approx(costs['2023-01-01'] + costs['2023-01-02'])
+
+
+@pytest.mark.parametrize('start, end, open_days, closed_end', [
+    ('2022-10-01', '2022-10-02', 3, '2022-10-01'),
+    ('2022-10-01', '2022-10-04', 3, '2022-10-01'),
+    ('2022-10-01', '2022-10-05', 3, '2022-10-02'),
+    ('2022-10-01', '2022-11-01', 3, '2022-10-29'),
+    ('2023-02-01', '2023-03-01', 3, '2023-02-26'),
+    ('2022-12-01', '2023-01-01', 3, '2022-12-29'),
+    ('2022-12-01', '2023-01-01', 0, '2023-01-01')
+])
+def test_closed_days_end(start, end, open_days, closed_end):
+    assert spend_sources.closed_days_end(start, end, open_days) == closed_end
+
+
+def test_first_missing_day():
+    cached = {'2022-10-01': 1.0, '2022-10-02': 1.0, '2022-10-04': 1.0}
+    assert spend_sources.first_missing_day('2022-10-01', '2022-10-10', cached) == '2022-10-03'
+    assert spend_sources.first_missing_day('2022-10-01', '2022-10-02', cached) == '2022-10-02'
+    assert spend_sources.first_missing_day('2022-10-01', '2022-10-01', {}) == '2022-10-01'
+
+
+CUR_COLUMNS = ['lineItem/ProductCode', 'resourceTags/aws:batch:compute-environment', 'lineItem/UsageStartDate', 'lineItem/UnblendedCost']
+
+
+def cur_file(rows):
+    text = io.StringIO()
+    writer = csv.writer(text)
+    writer.writerow(CUR_COLUMNS)
+    writer.writerows(rows)
+    return gzip.compress(text.getvalue().encode())
+
+
+def cur_event(key):
+    return {'Records': [{'s3': {'bucket': {'name': 'cur-bucket'}, 'object': {'key': key}}}]}
+
+
+def test_cur_split_delivery_in_the_standard_layout():
+    # <prefix>/<report>/<yyyymmdd-yyyymmdd>/<assemblyId>/<report>-<n>.csv.gz, the manifest in the billing period
+    s3_client = fake_aws.FakeS3(fake_aws.Meter())
+    period = 'cur/my-report/20221001-20221101'
+    old_key = f"{period}/assembly-1/my-report-1.csv.gz"
+    keys = [f"{period}/assembly-2/my-report-1.csv.gz", f"{period}/assembly-2/my-report-2.csv.gz"]
+    s3_client.put('cur-bucket', old_key, cur_file([['AmazonECS', ENVIRONMENT, '2022-10-03T00:00:00Z', '100']]))
+    s3_client.put('cur-bucket', keys[0], cur_file([
+        ['AmazonECS', ENVIRONMENT, '2022-10-03T00:00:00Z', '1.25'],
+        ['AmazonECS', 'other-environment', '2022-10-03T00:00:00Z', '7'],
+        ['AmazonEC2', ENVIRONMENT, '2022-10-03T00:00:00Z', '7'],
+        ['AmazonECS', ENVIRONMENT, '2022-09-30T00:00:00Z', '7']
+    ]))
+    s3_client.put('cur-bucket', keys[1], cur_file([['AmazonECS', ENVIRONMENT, '2022-10-16T00:00:00Z', '2.5']]))
+    s3_client.put('cur-bucket', f"{period}/my-report-Manifest.json", json.dumps({'assemblyId': 'assembly-2', 'reportKeys': keys}).encode())
+
+    # triggered by the first file only, both files are read, the older assembly is not
+    source = spend_sources.CurSpendSource(s3_client, cur_event(urllib.parse.quote_plus(keys[0])), ENVIRONMENT)
+    assert source.month_to_date('2022-10-01', '2022-10-18') == pytest.approx(3.75)
+
+
+def test_cur_manifest_next_to_the_files():
+    s3_client = fake_aws.FakeS3(fake_aws.Meter())
+    keys = ['cur/delivery/report-1.csv.gz', 'cur/delivery/report-2.csv.gz']
+    s3_client.put('cur-bucket', keys[0], cur_file([['AmazonECS', ENVIRONMENT, '2022-10-03T00:00:00Z', '1']]))
+    s3_client.put('cur-bucket', keys[1], cur_file([['AmazonECS', ENVIRONMENT, '2022-10-04T00:00:00Z', '2']]))
+    s3_client.put('cur-bucket', 'cur/delivery/report-Manifest.json', json.dumps({'reportKeys': keys}).encode())
+    source = spend_sources.CurSpendSource(s3_client, cur_event(keys[1]), ENVIRONMENT)
+    assert source.month_to_date('2022-10-01', '2022-10-18') == pytest.approx(3.0)
+
+
+def test_cur_without_a_manifest_reads_the_delivered_file():
+    s3_client = fake_aws.FakeS3(fake_aws.Meter())
+    key = 'cur/my-report/20221001-20221101/assembly-1/my-report-1.csv.gz'
+    s3_client.put('cur-bucket', key, cur_file([['AmazonECS', ENVIRONMENT, '2022-10-03T00:00:00Z', '1.5']]))
+    source = spend_sources.CurSpendSource(s3_client, cur_event(key), ENVIRONMENT)
+    assert source.month_to_date('2022-10-01', '2022-10-18') == pytest.approx(1.5)